@@ -1,37 +1,174 @@
-from typing import List
+from typing import Dict, List, Sequence
 import numpy as np
 import tensorflow as tf
 import logging
 import os
 import datetime
+import time
+from numpy_network import NumpyNetwork
+from eval_cache import EvaluationCache
+from board import Board, encode_features_batch
+
+NUM_HIDDEN = 40
+BACKENDS = ("tensorflow", "numpy")
 
 
 class TDagent:
-    def __init__(self, alpha=0.1, LAMBDA=0.7, num_features=196):
+    def __init__(self, alpha=0.1, LAMBDA=0.7, num_features=196, backend="tensorflow", cache_size=0):
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown backend '{backend}', expected one of {BACKENDS}")
         self.num_features = num_features
+        self.backend = backend
+        # The Keras model is always built, as it defines the initial weights and the checkpoint format
         self.model = self.generate_model()
+        # The same model, also returning the hidden layer's activations for update_selected()
+        self._hidden_model = tf.keras.Model(inputs=self.model.input,
+                                            outputs=[self.model.layers[1].output, self.model.output])
+        self.network = None
+        if backend == "numpy":
+            self.network = NumpyNetwork(num_features, NUM_HIDDEN)
+            self.network.set_weights(self.model.get_weights())
         self.alpha = alpha
         self.LAMBDA = LAMBDA
 
         self.trace = []
         self.learning_enabled = True
+        self._pending = None  # Forward pass of the last assess_for_update(), for update_selected()
+        # Optional LRU cache of position values, most useful when learning is disabled
+        self.cache = EvaluationCache(cache_size) if cache_size > 0 else None
+        # Optional PhaseProfiler, attached by Game.enable_profiling(), timing feature encoding and network calls
+        self.profiler = None
 
     def reset_trace(self):
+        if self.network is not None:
+            self.network.reset_trace()
+            return
         for i in range(len(self.trace)):
             self.trace[i].assign(tf.zeros(self.trace[i].get_shape()))
 
     def generate_model(self):
         inputs = tf.keras.Input(shape=(self.num_features,))
-        x = tf.keras.layers.Dense(40, activation="sigmoid")(inputs)
+        x = tf.keras.layers.Dense(NUM_HIDDEN, activation="sigmoid")(inputs)
         outputs = tf.keras.layers.Dense(1, activation="sigmoid")(x)
         return tf.keras.Model(inputs=inputs, outputs=outputs)
 
     def assess_features(self, state: np.ndarray):
+        if self.network is not None:
+            return self.network.predict(state).sum()
         prediction = self.model(state)
         return tf.reduce_sum(prediction)
 
-    @tf.function
+    def assess_batch(self, features_matrix: np.ndarray) -> np.ndarray:
+        # Value of every row of an (N, num_features) matrix from a single forward pass
+        if self.profiler is not None:
+            phase_start = time.perf_counter()
+        if self.network is not None:
+            values = self.network.predict(features_matrix)
+        else:
+            values = self.model(features_matrix, training=False).numpy()[:, 0]
+        if self.profiler is not None:
+            self.profiler.record("network", phase_start)
+        return values
+
+    def _encode(self, boards: Sequence[Board], player: int) -> np.ndarray:
+        if self.profiler is None:
+            return encode_features_batch(boards, player)
+        phase_start = time.perf_counter()
+        features = encode_features_batch(boards, player)
+        self.profiler.record("encode_features", phase_start)
+        return features
+
+    def assess_boards(self, boards: Sequence[Board], player: int) -> np.ndarray:
+        # Value of each board from the player's perspective, only encoding and evaluating positions not in the cache
+        if self.cache is None:
+            return self.assess_batch(self._encode(boards, player))
+        keys = [board.position_key(player) for board in boards]
+        values = np.empty(len(boards), dtype=np.float32)
+        missing = []
+        for i, key in enumerate(keys):
+            value = self.cache.get(key)
+            if value is None:
+                missing.append(i)
+            else:
+                values[i] = value
+        if len(missing) > 0:
+            new_values = self.assess_batch(self._encode([boards[i] for i in missing], player))
+            values[missing] = new_values
+            for i, value in zip(missing, new_values):
+                self.cache.put(keys[i], value)
+        return values
+
+    def cache_stats(self) -> Dict[str, float]:
+        if self.cache is None:
+            return {}
+        return self.cache.stats()
+
     def update_model(self, previous_state, new_state, reward, episode_end):
+        if not self.learning_enabled:
+            return
+        if self.network is None:
+            self._update_model_tf(previous_state, new_state, reward, episode_end)
+        else:
+            self.network.td_update(previous_state, new_state, reward, self.alpha, self.LAMBDA)
+            if episode_end:
+                self.reset_trace()
+        if self.cache is not None:
+            self.cache.invalidate()
+
+    def assess_for_update(self, boards: Sequence[Board], player: int, previous_board: Board) -> np.ndarray:
+        # assess_boards() for choosing a move while learning.  previous_board, the position before the move, is valued
+        # in the same forward pass and the activations are kept, so that update_selected() only has to do the
+        # backward pass for the chosen board.
+        features = self._encode(list(boards) + [previous_board], player)
+        if self.profiler is not None:
+            phase_start = time.perf_counter()
+        if self.network is not None:
+            values, hidden = self.network.predict_with_hidden(features)
+        else:
+            hidden, values = self._hidden_model(features, training=False)
+            hidden = hidden.numpy()
+            values = values.numpy()[:, 0]
+        if self.profiler is not None:
+            self.profiler.record("network", phase_start)
+        self._pending = (features, hidden, values)
+        return values[:-1]
+
+    def update_selected(self, index: int, reward, episode_end) -> None:
+        # update_model() from previous_board to boards[index] of the last assess_for_update(), reusing its forward pass
+        features, hidden, values = self._pending
+        self._pending = None
+        if not self.learning_enabled:
+            return
+        if self.network is None:
+            if len(self.trace) == 0:
+                self.trace = [tf.Variable(tf.zeros(v.shape), trainable=False) for v in self.model.trainable_variables]
+            self._update_from_forward_tf(features[index], hidden[index], values[index], values[-1], reward,
+                                         episode_end)
+        else:
+            self.network.td_update_from_forward(float(values[-1]), features[index], hidden[index],
+                                                float(values[index]), reward, self.alpha, self.LAMBDA)
+            if episode_end:
+                self.reset_trace()
+        if self.cache is not None:
+            self.cache.invalidate()
+
+    @tf.function
+    def _update_from_forward_tf(self, features, hidden, value_next, value_previous, reward, episode_end):
+        # The gradient of the value of one position, worked out directly from its activations (see
+        # NumpyNetwork._gradient), then the same trace and weight updates as _update_model_tf()
+        d_output = value_next * (1 - value_next)
+        d_hidden = d_output * self.model.trainable_variables[2][:, 0] * hidden * (1 - hidden)
+        grads = [tf.tensordot(features, d_hidden, axes=0), d_hidden, tf.reshape(hidden * d_output, (-1, 1)),
+                 tf.reshape(d_output, (1,))]
+        td_error = reward + value_next - value_previous
+        for i in range(len(grads)):
+            self.trace[i].assign((self.LAMBDA * self.trace[i]) + grads[i])
+            self.model.trainable_variables[i].assign_add(self.alpha * td_error * self.trace[i])
+        if episode_end:
+            self.reset_trace()
+
+    @tf.function
+    def _update_model_tf(self, previous_state, new_state, reward, episode_end):
         if self.learning_enabled:
             with tf.GradientTape() as tape:
                 value_next = self.assess_features(new_state)
@@ -50,6 +187,58 @@ class TDagent:
             if episode_end:
                 self.reset_trace()
 
+    def fit_batch(self, features_matrix: np.ndarray, targets: np.ndarray) -> float:
+        # Supervised step towards fixed targets for a minibatch of positions, as used by offline_train.py: one
+        # gradient step of alpha on half the mean squared error, which is returned from before the step
+        if self.network is not None:
+            loss = self.network.fit_batch(features_matrix, targets, self.alpha)
+        else:
+            loss = float(self._fit_batch_tf(tf.constant(features_matrix, dtype=tf.float32),
+                                            tf.constant(targets, dtype=tf.float32)))
+        if self.cache is not None:
+            self.cache.invalidate()
+        return loss
+
+    @tf.function
+    def _fit_batch_tf(self, features_matrix, targets):
+        with tf.GradientTape() as tape:
+            values = self.model(features_matrix, training=True)[:, 0]
+            loss = 0.5 * tf.reduce_mean(tf.square(targets - values))
+        grads = tape.gradient(loss, self.model.trainable_variables)
+        for variable, grad in zip(self.model.trainable_variables, grads):
+            variable.assign_sub(self.alpha * grad)
+        return loss
+
+    def get_weights(self) -> List[np.ndarray]:
+        # Current weights in tf.keras.Model.get_weights() order, whichever backend is in use
+        if self.network is not None:
+            return self.network.get_weights()
+        return self.model.get_weights()
+
+    def set_weights(self, weights: List[np.ndarray]) -> None:
+        if self.network is not None:
+            self.network.set_weights(weights)
+        else:
+            self.model.set_weights(weights)
+        if self.cache is not None:
+            self.cache.invalidate()
+
+    def get_trace(self) -> List[np.ndarray]:
+        # Eligibility traces in get_weights() order (empty if the TensorFlow path has not trained yet)
+        if self.network is not None:
+            return [t.copy() for t in self.network.trace]
+        return [t.numpy() for t in self.trace]
+
+    def set_trace(self, trace: List[np.ndarray]) -> None:
+        if self.network is not None:
+            for mine, theirs in zip(self.network.trace, trace):
+                mine[...] = theirs
+        elif len(self.trace) == 0:
+            self.trace = [tf.Variable(t, trainable=False) for t in trace]
+        else:
+            for mine, theirs in zip(self.trace, trace):
+                mine.assign(theirs)
+
     def enable_learning(self):
         self.learning_enabled = True
 
@@ -62,6 +251,8 @@ class TDagent:
             os.mkdir(directory)
 
         path = directory + "/" + checkpoint_name
+        if self.network is not None:
+            self.model.set_weights(self.network.get_weights())
         self.model.save_weights(path)
 
         logging.info("saving checkpoint [path = %s]", path)
@@ -72,6 +263,10 @@ class TDagent:
         logging.info("loading checkpoint [path = %s]", checkpoint_name)
 
         self.model.load_weights("checkpoints/" + checkpoint_name)
+        if self.network is not None:
+            self.network.set_weights(self.model.get_weights())
+        if self.cache is not None:
+            self.cache.invalidate()
 
 
 if __name__ == '__main__':
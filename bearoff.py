@@ -0,0 +1,221 @@
+# One-sided bear-off database: for every arrangement of up to 15 pieces on the 6 home points, the probability of
+# bearing them all off in exactly n rolls, assuming the rolls are played to minimise the expected number of rolls.
+# Once neither player has a piece outside their home area there is no more contact, so the chance of winning follows
+# exactly from the two players' distributions, and move selection can look positions up instead of evaluating them
+# (see race.EvaluationRouter).
+# The file is memory-mapped, so loading it is instant and processes running on the same machine share one copy.
+#   python bearoff.py --output bearoff_os15.db
+import argparse
+import logging
+import os
+import time
+from math import comb
+from typing import Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from board import Board, NUM_POINTS, PLAYER_X, PLAYER_O, stack_boards, _index
+
+BEAROFF_POINTS = 6
+MAX_CHECKERS = 15
+NUM_POSITIONS = comb(MAX_CHECKERS + BEAROFF_POINTS, BEAROFF_POINTS)
+MAX_ROLLS = 128  # Distribution length; the chance of needing more rolls is added to the last entry
+DEFAULT_PATH = "bearoff_os15.db"
+
+_MAGIC = b"BGOS"
+_VERSION = 1
+_HEADER_DTYPE = np.dtype([("magic", "S4"), ("version", "<u2"), ("points", "<u2"), ("checkers", "<u2"),
+                          ("rolls", "<u2"), ("positions", "<u4")])
+_SCALE = 65535  # Probabilities are stored as fractions of this
+# Binomial coefficients for ranking positions with the combinatorial number system
+_BINOMIAL = np.array([[comb(n, k) for k in range(BEAROFF_POINTS + 1)]
+                      for n in range(MAX_CHECKERS + BEAROFF_POINTS)], dtype=np.int64)
+# Slots of each player's home points, nearest to bearing off first
+_HOME_SLOTS = [[_index(player, NUM_POINTS - distance) for distance in range(1, BEAROFF_POINTS + 1)]
+               for player in (PLAYER_X, PLAYER_O)]
+
+
+def position_index(counts: Sequence[int]) -> int:
+    # counts[d] is the number of pieces d + 1 pips from being borne off.  Indexes run from 0 (no pieces left) to
+    # NUM_POSITIONS - 1.
+    index = 0
+    total = 0
+    for i in range(BEAROFF_POINTS):
+        total += counts[i]
+        index += comb(total + i, i + 1)
+    return index
+
+
+def position_indices(positions: np.ndarray, player: int) -> np.ndarray:
+    # Vectorised position_index for the given player's home points of an (N, BOARD_ARRAY_SIZE) array of positions
+    totals = np.cumsum(positions[:, _HOME_SLOTS[player]], axis=1) + np.arange(BEAROFF_POINTS)
+    return _BINOMIAL[totals, np.arange(1, BEAROFF_POINTS + 1)].sum(axis=1)
+
+
+def is_bearoff(board: Board) -> bool:
+    # Neither player has a piece on the bar or outside their home area, so no more contact is possible
+    return board.pieces_outside_home(PLAYER_X) == 0 and board.pieces_outside_home(PLAYER_O) == 0
+
+
+def _all_positions() -> List[Tuple[int, ...]]:
+    positions = []
+
+    def fill(prefix: Tuple[int, ...], remaining: int) -> None:
+        if len(prefix) == BEAROFF_POINTS:
+            positions.append(prefix)
+            return
+        for n in range(remaining + 1):
+            fill(prefix + (n,), remaining - n)
+    fill((), MAX_CHECKERS)
+    return positions
+
+
+def _single_die_moves(counts: Tuple[int, ...], die: int) -> List[Tuple[int, ...]]:
+    # Positions reachable by playing one die, following Board's rules: a piece can only be borne off with an exact roll
+    moves = []
+    for d in range(die, BEAROFF_POINTS + 1):
+        if counts[d - 1] > 0:
+            new_counts = list(counts)
+            new_counts[d - 1] -= 1
+            if d > die:
+                new_counts[d - die - 1] += 1
+            moves.append(tuple(new_counts))
+    return moves
+
+
+def _roll_afterstates(index: int, dice: Tuple[int, int], single: List[List[List[int]]]) -> List[int]:
+    # Distinct results of playing a whole roll, with the same rules as Board.legal_afterstates: as many dice as
+    # possible must be used, and the larger die if only one of them can be
+    if dice[0] == dice[1]:
+        orders = [dice * 2]
+    else:
+        orders = [(max(dice), min(dice)), (min(dice), max(dice))]
+    results: Dict[int, int] = {}  # Afterstate index -> first die played
+    most_dice_used = 0
+    for order in orders:
+        layer = {index}
+        dice_used = 0
+        for die in order:
+            next_layer = {s for position in layer for s in single[position][die - 1]}
+            if len(next_layer) == 0:
+                break
+            layer = next_layer
+            dice_used += 1
+        if dice_used > most_dice_used:
+            most_dice_used = dice_used
+            results = {}
+        if dice_used == most_dice_used:
+            for s in layer:
+                results.setdefault(s, order[0])
+    if most_dice_used == 1 and dice[0] != dice[1]:
+        largest_used = max(results.values())
+        return [s for s, first in results.items() if first == largest_used]
+    return list(results)
+
+
+def generate(path: str = DEFAULT_PATH) -> None:
+    start_time = time.time()
+    positions = _all_positions()
+    indices = {counts: position_index(counts) for counts in positions}
+    assert sorted(indices.values()) == list(range(NUM_POSITIONS))
+    single: List[List[List[int]]] = [None] * NUM_POSITIONS
+    for counts, index in indices.items():
+        single[index] = [[indices[s] for s in _single_die_moves(counts, die)] for die in range(1, 7)]
+    rolls = [((a, b), (1 if a == b else 2) / 36) for a in range(1, 7) for b in range(a, 7)]
+
+    expected = np.zeros(NUM_POSITIONS, dtype=np.float64)
+    distributions = np.zeros((NUM_POSITIONS, MAX_ROLLS), dtype=np.float64)
+    distributions[0, 0] = 1  # Nothing left to bear off
+    # Every move lowers the pip count, so working up from the lowest pip counts means every afterstate is already done
+    for counts in sorted(positions, key=lambda c: sum((d + 1) * n for d, n in enumerate(c))):
+        index = indices[counts]
+        if index == 0:
+            continue
+        blocked = 0.0
+        moved_expected = 0.0
+        shifted = np.zeros(MAX_ROLLS, dtype=np.float64)
+        for dice, probability in rolls:
+            afterstates = [s for s in _roll_afterstates(index, dice, single) if s != index]
+            if len(afterstates) == 0:
+                blocked += probability  # No legal move, so the roll is wasted
+                continue
+            best = min(afterstates, key=expected.__getitem__)
+            moved_expected += probability * expected[best]
+            shifted[1:] += probability * distributions[best, :-1]
+            shifted[-1] += probability * distributions[best, -1]  # Keep the overflow in the last entry
+        # A wasted roll leaves the position unchanged: E = 1 + blocked * E + sum(p * E[best])
+        expected[index] = (1 + moved_expected) / (1 - blocked)
+        distribution = distributions[index]
+        distribution[:] = shifted
+        if blocked > 0:
+            for n in range(1, MAX_ROLLS):
+                distribution[n] += blocked * distribution[n - 1]
+            distribution[-1] += 1 - distribution.sum()
+
+    # Round to integers that still sum to _SCALE, putting the rounding error into the most likely entry
+    stored = np.floor(distributions * _SCALE + 0.5).astype(np.int64)
+    rows = np.arange(NUM_POSITIONS)
+    stored[rows, distributions.argmax(axis=1)] += _SCALE - stored.sum(axis=1)
+    header = np.array([(_MAGIC, _VERSION, BEAROFF_POINTS, MAX_CHECKERS, MAX_ROLLS, NUM_POSITIONS)],
+                      dtype=_HEADER_DTYPE)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(header.tobytes())
+        f.write(expected.astype("<f4").tobytes())
+        f.write(stored.astype("<u2").tobytes())
+    os.replace(tmp_path, path)
+    logging.info("Generated bear-off database %s in %.1fs", path, time.time() - start_time)
+
+
+class BearoffDatabase:
+    def __init__(self, path: str = DEFAULT_PATH):
+        self.path = path
+        header = np.fromfile(path, dtype=_HEADER_DTYPE, count=1)[0]
+        if header["magic"] != _MAGIC or header["version"] != _VERSION:
+            raise ValueError(f"{path} is not a version {_VERSION} bear-off database")
+        if (header["points"], header["checkers"], header["positions"]) != (BEAROFF_POINTS, MAX_CHECKERS,
+                                                                           NUM_POSITIONS):
+            raise ValueError(f"{path} covers {header['checkers']} pieces on {header['points']} points, expected "
+                             f"{MAX_CHECKERS} on {BEAROFF_POINTS}")
+        self.max_rolls = int(header["rolls"])
+        offset = _HEADER_DTYPE.itemsize
+        self.expected = np.memmap(path, dtype="<f4", mode="r", offset=offset, shape=(NUM_POSITIONS,))
+        offset += NUM_POSITIONS * 4
+        self.distributions = np.memmap(path, dtype="<u2", mode="r", offset=offset,
+                                       shape=(NUM_POSITIONS, self.max_rolls))
+
+    def expected_rolls(self, board: Board, player: int) -> float:
+        return float(self.expected[position_indices(stack_boards([board]), player)[0]])
+
+    def roll_distribution(self, board: Board, player: int) -> np.ndarray:
+        # Probability of the player bearing off all of their pieces in exactly n rolls, for n up to max_rolls - 1
+        return self.distributions[position_indices(stack_boards([board]), player)[0]] / _SCALE
+
+    def win_probability(self, boards: Sequence[Board], player: int) -> np.ndarray:
+        # Chance that the player, who has just moved, wins each bear-off position with their opponent on roll.  The
+        # opponent needing k rolls beats the player needing n rolls whenever k <= n.
+        positions = stack_boards(boards)
+        mine = self.distributions[position_indices(positions, player)] / _SCALE
+        theirs = self.distributions[position_indices(positions, 1 - player)] / _SCALE
+        return (mine * (1 - np.cumsum(theirs, axis=1))).sum(axis=1)
+
+
+def load_database(path: Optional[str]) -> Optional[BearoffDatabase]:
+    # None if no path is given or the database has not been generated
+    if path is None or not os.path.exists(path):
+        if path is not None:
+            logging.warning("No bear-off database at %s; run bearoff.py to generate it", path)
+        return None
+    return BearoffDatabase(path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Generate the one-sided bear-off database")
+    parser.add_argument("--output", default=DEFAULT_PATH)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    generate(args.output)
+    database = BearoffDatabase(args.output)
+    print(f"{NUM_POSITIONS} positions, {os.path.getsize(args.output) / 1e6:.1f} MB")
+    print(f"Expected rolls to bear off 15 pieces from the 6 point: {database.expected[position_index((0, 0, 0, 0, 0, 15))]:.2f}")
+    print(f"Largest chance of needing {MAX_ROLLS - 1} or more rolls: "
+          f"{database.distributions[:, -1].max() / _SCALE:.2e}")
@@ -0,0 +1,241 @@
+# Benchmarks for the engine hot paths and end-to-end self-play, run over a fixed, seeded corpus of positions.
+# Results are written as JSON so runs can be compared, e.g.:
+#   python benchmark.py --output before.json
+#   python benchmark.py --output after.json --compare before.json
+import argparse
+import json
+import logging
+import platform
+import sys
+import time
+from typing import Callable, Dict, List, Tuple
+import numpy as np
+from board import Board, PLAYER_X, PLAYER_O
+from game import Game
+from race import EvaluationRouter, race_win_probability
+from TDGammon_agent import TDagent
+
+CATEGORIES = ("opening", "contact", "race", "bearoff", "bar_entry")
+# A result is flagged as a regression when it is this much slower than the comparison run
+REGRESSION_THRESHOLD = 0.10
+
+# Corpus entry: position, player on roll and the dice they rolled
+Position = Tuple[Board, int, List[int]]
+
+
+def _classify(board: Board, player: int, turn: int) -> str:
+    if turn < 3:
+        return "opening"
+    if board.get_bar(player) > 0:
+        return "bar_entry"
+    if board.pieces_outside_home(PLAYER_X) == 0 and board.pieces_outside_home(PLAYER_O) == 0:
+        return "bearoff"
+    if board.has_contact():
+        return "contact"
+    return "race"
+
+
+def _roll(rng: np.random.RandomState) -> List[int]:
+    dice = [int(d) for d in rng.randint(1, 7, size=2)]
+    return dice * 2 if dice[0] == dice[1] else dice
+
+
+def build_corpus(seed: int, per_category: int) -> Dict[str, List[Position]]:
+    # Positions are sampled from random-play games, so the corpus depends only on the seed
+    rng = np.random.RandomState(seed)
+    np_state = np.random.get_state()
+    np.random.seed(seed)  # Board() draws endgame layouts from the global generator
+    corpus = {category: [] for category in CATEGORIES}
+    game_number = 0
+    while any(len(positions) < per_category for positions in corpus.values()):
+        board = Board(endgame_board=(game_number % 3 == 2))
+        game_number += 1
+        player = int(rng.randint(0, 2))
+        turn = 0
+        while not (board.game_won(PLAYER_X) or board.game_won(PLAYER_O)):
+            dice = _roll(rng)
+            category = _classify(board, player, turn)
+            if len(corpus[category]) < per_category and rng.rand() < 0.25:
+                corpus[category].append((board.clone(), player, dice))
+            afterstates = board.legal_afterstates(dice, player)
+            board = afterstates[rng.randint(len(afterstates))][1]
+            player = 1 - player
+            turn += 1
+    np.random.set_state(np_state)
+    return corpus
+
+
+def _stats(calls: int, elapsed: float) -> Dict[str, float]:
+    return {"calls": calls, "total_sec": elapsed, "per_call_us": elapsed / calls * 1e6, "ops_per_sec": calls / elapsed}
+
+
+def _time(fn: Callable[[], int], min_time: float) -> Dict[str, float]:
+    # Repeats fn (which returns the number of calls it made) until at least min_time has elapsed
+    calls = 0
+    start = time.perf_counter()
+    elapsed = 0.0
+    while elapsed < min_time:
+        calls += fn()
+        elapsed = time.perf_counter() - start
+    return _stats(calls, elapsed)
+
+
+def run_benchmarks(corpus: Dict[str, List[Position]], agent: TDagent, min_time: float,
+                   num_games: int) -> Dict[str, Dict[str, float]]:
+    results = {}
+    positions = [p for category in CATEGORIES for p in corpus[category]]
+
+    for category in CATEGORIES + ("all",):
+        sample = positions if category == "all" else corpus[category]
+
+        def permitted_moves() -> int:
+            for board, player, dice in sample:
+                board.permitted_moves(dice, player)
+            return len(sample)
+        results[f"permitted_moves[{category}]"] = _time(permitted_moves, min_time)
+
+        def legal_afterstates() -> int:
+            for board, player, dice in sample:
+                board.legal_afterstates(dice, player)
+            return len(sample)
+        results[f"legal_afterstates[{category}]"] = _time(legal_afterstates, min_time)
+
+    moves = [(board, player, move) for board, player, dice in positions
+             for move in board.permitted_moves(dice, player)[:1]]
+
+    move_time = [0.0]
+
+    def perform_move() -> int:
+        clones = [board.clone() for board, _, _ in moves]
+        start = time.perf_counter()
+        for clone, (_, player, move) in zip(clones, moves):
+            clone.perform_move(*move, player)
+        # Only the moves themselves count towards the time, not making the clones
+        move_time[0] += time.perf_counter() - start
+        return len(moves)
+    results["perform_move"] = _stats(_time(perform_move, min_time)["calls"], move_time[0])
+
+    def encode_features() -> int:
+        for board, player, _ in positions:
+            board.encode_features(player)
+        return len(positions)
+    results["encode_features"] = _time(encode_features, min_time)
+
+    features = [board.encode_features(player) for board, player, _ in positions]
+
+    def assess_features() -> int:
+        for state in features:
+            agent.assess_features(state)
+        return len(features)
+    results["assess_features"] = _time(assess_features, min_time)
+
+    matrix = np.concatenate(features).astype(np.float32)
+
+    def assess_batch() -> int:
+        agent.assess_batch(matrix)
+        return len(matrix)
+    results["assess_batch (per position)"] = _time(assess_batch, min_time)
+
+    race_candidates = [b for board, player, dice in corpus["race"] for _, b in board.legal_afterstates(dice, player)]
+
+    def race_evaluator() -> int:
+        race_win_probability(race_candidates, PLAYER_X)
+        return len(race_candidates)
+    results["race_evaluator (per position)"] = _time(race_evaluator, min_time)
+
+    def network_on_race() -> int:
+        agent.assess_boards(race_candidates, PLAYER_X)
+        return len(race_candidates)
+    results["assess_boards on races (per position)"] = _time(network_on_race, min_time)
+
+    weights = agent.get_weights()
+
+    def update_model() -> int:
+        for n in range(1, len(features)):
+            agent.update_model(features[n - 1], features[n], 0, episode_end=False)
+        return len(features) - 1
+    results["update_model"] = _time(update_model, min_time)
+    agent.set_weights(weights)
+    agent.reset_trace()
+
+    g = Game(agent, agent, verbose=False)
+
+    def move_tree_analysis() -> int:
+        for board, player, dice in positions:
+            g.pID = player
+            g.move_tree_analysis(agent, board, dice, [])
+        return len(positions)
+    results["move_tree_analysis"] = _time(move_tree_analysis, min_time)
+
+    # Whole self-play games, with learning, from the standard starting board
+    np.random.seed(0)
+    start = time.perf_counter()
+    for _ in range(num_games):
+        g.training_game(False)
+    elapsed = time.perf_counter() - start
+    agent.set_weights(weights)
+    # Game lengths vary a lot, so the rate is measured in turns rather than games
+    results["self_play_turn"] = _stats(sum(g.game_len_history), elapsed)
+    results["self_play_turn"]["games"] = num_games
+
+    # The same games again, with races played by the race formula instead of the network
+    g.router = EvaluationRouter(race=True)
+    g.game_len_history.clear()
+    np.random.seed(0)
+    start = time.perf_counter()
+    for _ in range(num_games):
+        g.training_game(False)
+    elapsed = time.perf_counter() - start
+    agent.set_weights(weights)
+    results["self_play_turn (race router)"] = _stats(sum(g.game_len_history), elapsed)
+    results["self_play_turn (race router)"].update(g.router.stats())
+    return results
+
+
+def compare(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]]) -> List[str]:
+    # Prints the speed-up of each benchmark against a previous run and returns the names that regressed
+    regressions = []
+    for name, stats in results.items():
+        if name not in baseline:
+            continue
+        ratio = stats["ops_per_sec"] / baseline[name]["ops_per_sec"]
+        flag = ""
+        if ratio < 1 - REGRESSION_THRESHOLD:
+            flag = "  <-- REGRESSION"
+            regressions.append(name)
+        print(f"{name:36s} {ratio:6.2f}x{flag}")
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the backgammon engine and training loop")
+    parser.add_argument("--seed", type=int, default=1234, help="Seed for the position corpus")
+    parser.add_argument("--positions", type=int, default=50, help="Positions per corpus category")
+    parser.add_argument("--min-time", type=float, default=1.0, help="Minimum seconds to spend on each benchmark")
+    parser.add_argument("--games", type=int, default=5, help="Self-play games to time")
+    parser.add_argument("--backend", choices=["tensorflow", "numpy"], default="tensorflow")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--compare", help="Previous results JSON to compare against")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARN, format="%(message)s")
+    corpus = build_corpus(args.seed, args.positions)
+    np.random.seed(args.seed)
+    bench_agent = TDagent(0.1, 0.7, 196, backend=args.backend)
+    results = run_benchmarks(corpus, bench_agent, args.min_time, args.games)
+
+    report = {"meta": {"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+                       "numpy": np.__version__, "platform": platform.platform(), "backend": args.backend,
+                       "seed": args.seed, "corpus": {c: len(p) for c, p in corpus.items()}},
+              "results": results}
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    for name, stats in results.items():
+        print(f"{name:36s} {stats['ops_per_sec']:14.1f} /sec {stats['per_call_us']:12.2f} us")
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+        if len(compare(results, baseline)) > 0:
+            sys.exit(1)
@@ -1,45 +1,288 @@
+import array
+import itertools
+import random
 import numpy as np
-from typing import List, Tuple, Union
+from typing import Iterator, List, Sequence, Tuple, Union
 import logging
 
 PLAYER_X = 0
 PLAYER_O = 1
 NUM_POINTS = 24
+BAR = -1  # Effective position of the bar on each player's number scale
+HOME = NUM_POINTS  # Effective position of a piece that has been removed from the board
+
+# Layout of the backing array.  Each player owns a block of 26 slots, indexed by (effective position + 1):
+# slot 0 is the bar, slots 1-24 are the points and slot 25 holds the pieces already removed.  This means a
+# move is always "subtract one at start, add one at start + roll", whether it leaves the bar, lands on a
+# point or bears off.  After the two blocks come running counters maintained by perform_move: the number of each
+# player's pieces outside their home area (bar included), then each player's pip count, then the effective position of
+# each player's rearmost piece (HOME once they have all been removed).
+_POS_OFFSET = 1
+_PLAYER_STRIDE = NUM_POINTS + 2
+POSITION_SIZE = 2 * _PLAYER_STRIDE
+_OUTSIDE_HOME = POSITION_SIZE
+_PIP_COUNT = POSITION_SIZE + 2
+_REARMOST = POSITION_SIZE + 4
+BOARD_ARRAY_SIZE = POSITION_SIZE + 6
+HOME_START = NUM_POINTS - 6  # First point of the home area
+
+NUM_FEATURES = 196
+MAX_PIECES = 15
+DIE_FACES = range(1, 7)
+
+
+def _index(player: int, position: int) -> int:
+    return player * _PLAYER_STRIDE + _POS_OFFSET + position
+
+
+def _build_point_feature_table() -> np.ndarray:
+    # Row n holds the four features of a point occupied by n pieces (see Board.encode_features)
+    table = np.zeros((MAX_PIECES + 1, 4), dtype=np.float32)
+    table[1, 0] = 1
+    table[2, 1] = 1
+    table[3, 2] = 1
+    table[4:, 3] = (np.arange(4, MAX_PIECES + 1) - 3) / 2
+    return table
+
+
+_POINT_FEATURE_TABLE = _build_point_feature_table()
+# Slots of a player block as seen from that player: the bar, then the 24 points
+_BAR_SLOT = _POS_OFFSET + BAR
+_POINT_SLOTS = np.arange(_POS_OFFSET, _POS_OFFSET + NUM_POINTS)
+
+
+def _build_zobrist_tables() -> Tuple[List[List[int]], List[List[int]]]:
+    # One random 64-bit code per (array slot, piece count).  The second table swaps the two player blocks, so a hash
+    # built with it describes the position as seen by player O using the same codes player X's view would use.
+    rng = random.Random(0x7D6A3F)  # Fixed seed so hashes are stable between runs and processes
+    codes = [[rng.getrandbits(64) for _ in range(MAX_PIECES + 1)] for _ in range(POSITION_SIZE)]
+    swapped = codes[_PLAYER_STRIDE:] + codes[:_PLAYER_STRIDE]
+    return codes, swapped
+
+
+_ZOBRIST_X, _ZOBRIST_O = _build_zobrist_tables()
+
+# Per-slot contributions to the running counters: a piece at position p is 24 - p pips from being removed (25 on the
+# bar, 0 once removed) and is outside home while p < HOME_START
+_SLOT_PLAYER = [i // _PLAYER_STRIDE for i in range(POSITION_SIZE)]
+_SLOT_PIPS = [NUM_POINTS - (i % _PLAYER_STRIDE - _POS_OFFSET) for i in range(POSITION_SIZE)]
+_SLOT_OUTSIDE = [int(i % _PLAYER_STRIDE - _POS_OFFSET < HOME_START) for i in range(POSITION_SIZE)]
+
+
+def _build_move_tables() -> Tuple[List[List[List[int]]], List[List[List[int]]]]:
+    # For each player, start position (bar included) and die: the array slot the piece lands on, and the slot of the
+    # opponent's point it lands on (-1 when bearing off, and both -1 when the move overshoots the board)
+    destinations = []
+    opponents = []
+    for player in (PLAYER_X, PLAYER_O):
+        player_destinations = []
+        player_opponents = []
+        for start in range(BAR, NUM_POINTS):
+            die_destinations = [-1] * (max(DIE_FACES) + 1)
+            die_opponents = [-1] * (max(DIE_FACES) + 1)
+            for die in DIE_FACES:
+                new_position = start + die
+                if new_position <= HOME:
+                    die_destinations[die] = _index(player, new_position)
+                if new_position < HOME:
+                    die_opponents[die] = _index(1 - player, NUM_POINTS - new_position - 1)
+            player_destinations.append(die_destinations)
+            player_opponents.append(die_opponents)
+        destinations.append(player_destinations)
+        opponents.append(player_opponents)
+    return destinations, opponents
+
+
+# Indexed [player][start + 1][die]
+_MOVE_DEST, _MOVE_OPP = _build_move_tables()
 
 
 class Board:
+    __slots__ = ("num_pieces", "_data", "_hash_x", "_hash_o")
+
     def __init__(self, endgame_board):
         self.num_pieces = 0
-        self.o_board, self.o_bar = self.generate_board_list(endgame_board)
-        self.x_board, self.x_bar = self.generate_board_list(endgame_board)
-        self.o_removed = 0
-        self.x_removed = 0
+        self._data = array.array("h", [0] * BOARD_ARRAY_SIZE)
+        o_board, o_bar = self.generate_board_list(endgame_board)
+        x_board, x_bar = self.generate_board_list(endgame_board)
+        self._load_player(PLAYER_O, o_board, o_bar, 0)
+        self._load_player(PLAYER_X, x_board, x_bar, 0)
+        self._data[POSITION_SIZE:] = self._compute_counters()
+        self._hash_x, self._hash_o = self._compute_hashes()
 
-    def get_bar(self, player: int) -> int:
+    def _load_player(self, player: int, board: Sequence[int], bar: int, removed: int) -> None:
+        start = _index(player, BAR)
+        self._data[start:start + _PLAYER_STRIDE] = array.array("h", [bar] + list(board) + [removed])
+
+    def clone(self) -> "Board":
+        new_board = Board.__new__(Board)
+        new_board.num_pieces = self.num_pieces
+        new_board._data = self._data[:]
+        new_board._hash_x = self._hash_x
+        new_board._hash_o = self._hash_o
+        return new_board
+
+    def copy_into(self, other: "Board") -> "Board":
+        # Overwrite an existing board in place, avoiding any allocation
+        other.num_pieces = self.num_pieces
+        other._data[:] = self._data
+        other._hash_x = self._hash_x
+        other._hash_o = self._hash_o
+        return other
+
+    @classmethod
+    def from_position(cls, position: Sequence[int]) -> "Board":
+        # Board with the given counts in its first POSITION_SIZE slots, e.g. a position saved by records.GameWriter
+        board = cls.__new__(cls)
+        board.num_pieces = MAX_PIECES
+        board._data = array.array("h", [int(count) for count in position[:POSITION_SIZE]] +
+                                  [0] * (BOARD_ARRAY_SIZE - POSITION_SIZE))
+        board._data[POSITION_SIZE:] = board._compute_counters()
+        board._hash_x, board._hash_o = board._compute_hashes()
+        return board
+
+    def __copy__(self) -> "Board":
+        return self.clone()
+
+    def __deepcopy__(self, memo) -> "Board":
+        return self.clone()
+
+    def _compute_hashes(self) -> Tuple[int, int]:
+        hash_x = 0
+        hash_o = 0
+        for i in range(POSITION_SIZE):
+            count = self._data[i]
+            hash_x ^= _ZOBRIST_X[i][count]
+            hash_o ^= _ZOBRIST_O[i][count]
+        return hash_x, hash_o
+
+    def _compute_counters(self) -> array.array:
+        counters = array.array("h", [0] * (BOARD_ARRAY_SIZE - POSITION_SIZE))
+        for i in range(POSITION_SIZE):
+            player = _SLOT_PLAYER[i]
+            counters[_OUTSIDE_HOME - POSITION_SIZE + player] += self._data[i] * _SLOT_OUTSIDE[i]
+            counters[_PIP_COUNT - POSITION_SIZE + player] += self._data[i] * _SLOT_PIPS[i]
+        for player in (PLAYER_X, PLAYER_O):
+            counters[_REARMOST - POSITION_SIZE + player] = self._scan_rearmost(player, BAR)
+        return counters
+
+    def _scan_rearmost(self, player: int, position: int) -> int:
+        # Effective position of the player's first piece at or after position, or HOME if there is none
+        data = self._data
+        i = _index(player, position)
+        end = _index(player, HOME)
+        while i < end and data[i] == 0:
+            i += 1
+        return i - _index(player, BAR) + BAR
+
+    def verify_hash(self) -> bool:
+        # Check the incrementally maintained hashes against a recalculation from scratch
+        return (self._hash_x, self._hash_o) == self._compute_hashes()
+
+    def verify_counters(self) -> bool:
+        # Check the incrementally maintained counters against a recalculation from scratch
+        return self._data[POSITION_SIZE:] == self._compute_counters()
+
+    def _adjust_slot(self, i: int, delta: int) -> None:
+        # Change the piece count held in array slot i, keeping the Zobrist hashes and counters in step
+        data = self._data
+        count = data[i]
+        data[i] = count + delta
+        self._hash_x ^= _ZOBRIST_X[i][count] ^ _ZOBRIST_X[i][count + delta]
+        self._hash_o ^= _ZOBRIST_O[i][count] ^ _ZOBRIST_O[i][count + delta]
+        player = _SLOT_PLAYER[i]
+        data[_OUTSIDE_HOME + player] += delta * _SLOT_OUTSIDE[i]
+        data[_PIP_COUNT + player] += delta * _SLOT_PIPS[i]
+        position = i - _index(player, BAR) + BAR
+        if position != HOME:
+            if delta > 0 and position < data[_REARMOST + player]:
+                data[_REARMOST + player] = position
+            elif data[i] == 0 and position == data[_REARMOST + player]:
+                data[_REARMOST + player] = self._scan_rearmost(player, position)
+
+    def pip_count(self, player: int) -> int:
+        return self._data[_PIP_COUNT + player]
+
+    def pieces_outside_home(self, player: int) -> int:
+        return self._data[_OUTSIDE_HOME + player]
+
+    def rearmost(self, player: int) -> int:
+        # Effective position of the player's rearmost piece: BAR if one is on the bar, HOME if all have been removed
+        return self._data[_REARMOST + player]
+
+    def has_contact(self) -> bool:
+        # Contact remains while some piece still has an opposing piece ahead of it.  A piece on point p of one player
+        # is on point 23 - p of the other, so the rearmost pieces have passed each other once their positions sum to
+        # at least 23.
+        return self._data[_REARMOST] + self._data[_REARMOST + 1] < NUM_POINTS - 1
+
+    def position_key(self, player: int) -> int:
+        # 64-bit Zobrist hash of the position as seen by the player, so equal keys mean equal encode_features
         if player == PLAYER_X:
-            bar = self.x_bar
-        else:
-            bar = self.o_bar
-        return bar
+            return self._hash_x
+        return self._hash_o
+
+    def get_bar(self, player: int) -> int:
+        return self._data[_index(player, BAR)]
 
     def adjust_bar(self, player: int, delta: int) -> None:
-        if player == PLAYER_X:
-            self.x_bar += delta
-        else:
-            self.o_bar += delta
+        self._adjust_slot(_index(player, BAR), delta)
 
-    def get_board(self, player: int) -> List:
-        if player == PLAYER_X:
-            board = self.x_board
-        else:
-            board = self.o_board
-        return board
+    def get_removed(self, player: int) -> int:
+        return self._data[_index(player, HOME)]
+
+    def get_board(self, player: int) -> Sequence[int]:
+        # Read-only view onto the player's 24 points (no copy).  Use set_board to change it.
+        start = _index(player, 0)
+        return memoryview(self._data).toreadonly()[start:start + NUM_POINTS]
 
     def set_board(self, player: int, index: int, delta: int) -> None:
-        if player == PLAYER_X:
-            self.x_board[index] += delta
-        else:
-            self.o_board[index] += delta
+        self._adjust_slot(_index(player, index), delta)
+
+    # Attribute-style access retained for the GUI and older callers
+    @property
+    def x_board(self) -> Sequence[int]:
+        return self.get_board(PLAYER_X)
+
+    @property
+    def o_board(self) -> Sequence[int]:
+        return self.get_board(PLAYER_O)
+
+    @property
+    def x_bar(self) -> int:
+        return self._data[_index(PLAYER_X, BAR)]
+
+    @x_bar.setter
+    def x_bar(self, value: int) -> None:
+        i = _index(PLAYER_X, BAR)
+        self._adjust_slot(i, value - self._data[i])
+
+    @property
+    def o_bar(self) -> int:
+        return self._data[_index(PLAYER_O, BAR)]
+
+    @o_bar.setter
+    def o_bar(self, value: int) -> None:
+        i = _index(PLAYER_O, BAR)
+        self._adjust_slot(i, value - self._data[i])
+
+    @property
+    def x_removed(self) -> int:
+        return self._data[_index(PLAYER_X, HOME)]
+
+    @x_removed.setter
+    def x_removed(self, value: int) -> None:
+        i = _index(PLAYER_X, HOME)
+        self._adjust_slot(i, value - self._data[i])
+
+    @property
+    def o_removed(self) -> int:
+        return self._data[_index(PLAYER_O, HOME)]
+
+    @o_removed.setter
+    def o_removed(self, value: int) -> None:
+        i = _index(PLAYER_O, HOME)
+        self._adjust_slot(i, value - self._data[i])
 
     def generate_board_list(self, endgame_board: bool) -> Tuple[List[int], int]:
         if endgame_board:
@@ -54,88 +297,148 @@ class Board:
             board[0] = min(2, remaining)
             bar = max(remaining - board[0], 0)
             self.num_pieces = 15
-            print(board)
+            logging.debug("Endgame starting board: %s", board)
         else:
             board = [2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 5, 0, 0, 0, 0, 3, 0, 5, 0, 0, 0, 0, 0]
             bar = 0
             self.num_pieces = 15
         return board, bar
 
-    def _can_bear_off(self, board: List[int], bar: int) -> bool:
-        can_bear_off = (bar == 0)
-        for p in range(0, NUM_POINTS - 6):
-            if board[p] > 0:
-                can_bear_off = False
-        return can_bear_off
+    def _can_bear_off(self, player: int) -> bool:
+        # All pieces must be in the home area (and none on the bar)
+        return self._data[_OUTSIDE_HOME + player] == 0
+
+    def _iter_permitted_moves(self, rolls: List[int], player: int) -> Iterator[Tuple[int, int]]:
+        data = self._data
+        destinations = _MOVE_DEST[player]
+        opponents = _MOVE_OPP[player]
+        roll_values = set(rolls)  # Remove duplicates (e.g. if rolled a double)
+        if data[_index(player, BAR)] > 0:
+            # Can only move off bar if destination is empty or blotted
+            for roll_value in roll_values:
+                if data[opponents[0][roll_value]] <= 1:
+                    yield BAR, roll_value
+            return
+        can_bear_off = data[_OUTSIDE_HOME + player] == 0
+        first = _index(player, 0)
+        occupied = [p for p in range(NUM_POINTS) if data[first + p] > 0]
+        for roll_value in roll_values:
+            for p in occupied:
+                opp = opponents[p + 1][roll_value]
+                if opp >= 0:
+                    if data[opp] <= 1:  # Blocked if other player has 2 or more pieces there
+                        yield p, roll_value
+                elif can_bear_off and destinations[p + 1][roll_value] >= 0:  # Exact bear-off, not overshooting
+                    yield p, roll_value
 
     def permitted_moves(self, rolls: List[int], player: int) -> List[Tuple[int, int]]:
-        rolls = list(set(rolls))  # Remove duplicates (e.g. if rolled a double)
-        permitted_moves = []
-        bar = self.get_bar(player)
-        for roll_value in rolls:
-            if bar > 0:
-                if self.move_permitted("bar", roll_value, player):
-                    permitted_moves.append(("bar", roll_value))
-            else:
-                for p in range(0, NUM_POINTS):
-                    if self.move_permitted(p, roll_value, player):
-                        permitted_moves.append((p, roll_value))
-        return permitted_moves
-
-    def move_permitted(self, start: Union[int, str], roll_value: int, player: int) -> bool:
-        my_board = self.get_board(player)
-        their_board = self.get_board(1 - player)
-        bar = self.get_bar(player)
-
-        if start == "bar":  # We are trying to move a piece from the bar
-            if bar > 0:
-                new_position = -1 + roll_value  # "bar" has effective position -1
-                opp_point_occ = their_board[NUM_POINTS - new_position - 1]
-                return opp_point_occ <= 1  # Can only move off bar if destination is empty or blotted
-        else:  # Trying to move a piece not on bar
-            if bar > 0:  # There's a piece on the bar so can't move a non-bar piece
-                return False
-            if my_board[start] > 0:  # There is a piece here
-                new_position = start + roll_value
-                if new_position == NUM_POINTS:  # Will be removed from board
-                    return self._can_bear_off(my_board, bar)  # Can only be removed if all pieces in home area
-                elif new_position > NUM_POINTS:  # Will overshoot board end
-                    return False
-                their_position = NUM_POINTS - new_position - 1
-                if their_board[their_position] > 1:  # Other player has 2 or more pieces there
-                    return False
-            else:
-                return False
+        return list(self._iter_permitted_moves(rolls, player))
 
-        # If reached here then move is permitted
-        return True
+    def has_any_legal_move(self, rolls: List[int], player: int) -> bool:
+        # Stops at the first legal move found
+        return next(self._iter_permitted_moves(rolls, player), None) is not None
+
+    def legal_afterstates(self, rolls: List[int], player: int) -> List[Tuple[List[Tuple[int, int]], "Board"]]:
+        # Every distinct position reachable by playing a whole turn, each paired with one move sequence that
+        # reaches it.  The player must use as many dice as possible, and the larger die if only one can be used.
+        orders = sorted(set(itertools.permutations(rolls)), reverse=True)  # A double has a single ordering
+        layer_start = {self._hash_x: ([], self)}
+        afterstates = {}
+        most_dice_used = 0
+        for order in orders:
+            layer = layer_start
+            dice_used = 0
+            for roll_value in order:
+                next_layer = {}
+                # Positions reached by several routes (e.g. transpositions within a double) are expanded once
+                for moves, board in layer.values():
+                    for move in board.permitted_moves([roll_value], player):
+                        new_board = board.clone()
+                        new_board.perform_move(*move, player)
+                        key = new_board._hash_x
+                        if key not in next_layer:
+                            next_layer[key] = (moves + [move], new_board)
+                if len(next_layer) == 0:
+                    break
+                layer = next_layer
+                dice_used += 1
+            if dice_used > most_dice_used:
+                most_dice_used = dice_used
+                afterstates = {}
+            if dice_used == most_dice_used:
+                for key, afterstate in layer.items():
+                    afterstates.setdefault(key, afterstate)
+
+        if most_dice_used == 0:
+            return [([], self.clone())]
+        if most_dice_used == 1 and len(set(rolls)) > 1:
+            # Only one die can be played, so the larger one must be used if possible
+            largest_used = max(moves[0][1] for moves, _ in afterstates.values())
+            return [(moves, board) for moves, board in afterstates.values() if moves[0][1] == largest_used]
+        return list(afterstates.values())
+
+    def move_permitted(self, start: int, roll_value: int, player: int) -> bool:
+        data = self._data
+        bar = data[_index(player, BAR)]
+        if not BAR <= start < NUM_POINTS:
+            return False
+        if start == BAR:  # We are trying to move a piece from the bar
+            if bar == 0:
+                return False
+        elif bar > 0:  # There's a piece on the bar so can't move a non-bar piece
+            return False
+        elif data[_index(player, start)] == 0:  # There is no piece here
+            return False
+        opp = _MOVE_OPP[player][start + 1][roll_value]
+        if opp >= 0:
+            return data[opp] <= 1  # Can only move if destination is empty or blotted
+        if _MOVE_DEST[player][start + 1][roll_value] >= 0:  # Will be removed from board
+            return self._can_bear_off(player)  # Can only be removed if all pieces in home area
+        return False  # Will overshoot board end
 
     def perform_move(self, position: int, roll: int, player: int):
-        my_board = self.get_board(player)
-        their_board = self.get_board(1 - player)
-        # Lift piece from start position
-        if position == "bar":
-            self.adjust_bar(player, -1)
-        else:
-            my_board[position] -= 1
+        data = self._data
+        zobrist_x = _ZOBRIST_X
+        zobrist_o = _ZOBRIST_O
+        hash_x = self._hash_x
+        hash_o = self._hash_o
+        # Lift piece from start position (the bar and home slots share the same numbering as the points)
+        start = _index(player, position)
+        count = data[start]
+        data[start] = count - 1
+        hash_x ^= zobrist_x[start][count] ^ zobrist_x[start][count - 1]
+        hash_o ^= zobrist_o[start][count] ^ zobrist_o[start][count - 1]
         # Place piece in finish position
-        if position == "bar":
-            position = -1  # Effective position on number scale
         new_position = position + roll
-        if new_position == NUM_POINTS:  # Piece has been removed from board
-            if player == PLAYER_X:
-                self.x_removed += 1
-            else:
-                self.o_removed += 1
-        else:  # Piece has moved to a new location on the board
-            my_board[new_position] += 1
+        end = start + roll
+        count = data[end]
+        data[end] = count + 1
+        hash_x ^= zobrist_x[end][count] ^ zobrist_x[end][count + 1]
+        hash_o ^= zobrist_o[end][count] ^ zobrist_o[end][count + 1]
+        data[_PIP_COUNT + player] -= roll
+        data[_OUTSIDE_HOME + player] += _SLOT_OUTSIDE[end] - _SLOT_OUTSIDE[start]
+        if data[start] == 0 and position == data[_REARMOST + player]:
+            # The rearmost piece has moved up; the next one can be no further forward than where it landed
+            data[_REARMOST + player] = self._scan_rearmost(player, position + 1)
+        if new_position != HOME:  # Piece has moved to a new location on the board
             # If piece has taken an opponent's piece, then move it to the opponent's bar
-            opp_position = NUM_POINTS - new_position - 1
-            if their_board[opp_position] > 0:
-                # their_board[opp_position] -= 1
-                self.set_board(1 - player, opp_position, -1)
-                self.adjust_bar(1 - player, +1)
-                logging.info(f"Piece taken by player {player} at point {new_position} (player's own coords).  bar={self.x_bar},{self.o_bar}")
+            opp_index = _index(1 - player, NUM_POINTS - new_position - 1)
+            if data[opp_index] > 0:
+                data[opp_index] = 0  # Can only ever be a single piece
+                hash_x ^= zobrist_x[opp_index][1] ^ zobrist_x[opp_index][0]
+                hash_o ^= zobrist_o[opp_index][1] ^ zobrist_o[opp_index][0]
+                opp_bar = _index(1 - player, BAR)
+                count = data[opp_bar]
+                data[opp_bar] = count + 1
+                hash_x ^= zobrist_x[opp_bar][count] ^ zobrist_x[opp_bar][count + 1]
+                hash_o ^= zobrist_o[opp_bar][count] ^ zobrist_o[opp_bar][count + 1]
+                data[_PIP_COUNT + 1 - player] += _SLOT_PIPS[opp_bar] - _SLOT_PIPS[opp_index]
+                data[_OUTSIDE_HOME + 1 - player] += 1 - _SLOT_OUTSIDE[opp_index]
+                data[_REARMOST + 1 - player] = BAR
+                logging.info("Piece taken by player %d at point %d (player's own coords).  bar=%d,%d",
+                             player, new_position, data[_index(PLAYER_X, BAR)], data[_index(PLAYER_O, BAR)])
+        self._hash_x = hash_x
+        self._hash_o = hash_o
 
     def encode_features(self, player: int):
         # Based on Tesauro TDGammon v0.0
@@ -168,7 +471,7 @@ class Board:
             features[index:index + 4] = self._encode_point(point)
         features[192] = my_bar / 2
         features[193] = their_bar / 2
-        features[193] = num_mine_cleared / 15
+        features[194] = num_mine_cleared / 15
         features[195] = num_theirs_cleared / 15
         return features[np.newaxis]
 
@@ -185,8 +488,66 @@ class Board:
         return point_features
 
     def game_won(self, player):
-        if player == PLAYER_X:
-            num_removed = self.x_removed
-        else:
-            num_removed = self.o_removed
-        return num_removed == self.num_pieces
+        return self._data[_index(player, HOME)] == self.num_pieces
+
+
+def stack_boards(boards: Sequence[Board]) -> np.ndarray:
+    # Raw (N, BOARD_ARRAY_SIZE) view of many boards, built with a single buffer join
+    raw = b"".join(board._data.tobytes() for board in boards)
+    return np.frombuffer(raw, dtype=np.int16).reshape(len(boards), BOARD_ARRAY_SIZE)
+
+
+def encode_positions(positions: np.ndarray, player: Union[int, np.ndarray]) -> np.ndarray:
+    # Vectorised equivalent of Board.encode_features for an (N, BOARD_ARRAY_SIZE) array of positions.
+    # player may be a single player for every row or one player per row.  Returns an (N, 196) float32 array.
+    num_positions = positions.shape[0]
+    player = np.broadcast_to(np.asarray(player, dtype=np.intp), (num_positions,))
+    my_start = (player * _PLAYER_STRIDE)[:, np.newaxis]
+    their_start = ((1 - player) * _PLAYER_STRIDE)[:, np.newaxis]
+    my_block = np.take_along_axis(positions, my_start + np.arange(_PLAYER_STRIDE), axis=1)
+    their_block = np.take_along_axis(positions, their_start + np.arange(_PLAYER_STRIDE), axis=1)
+    my_points = my_block[:, _POINT_SLOTS]
+    their_points = their_block[:, _POINT_SLOTS]
+
+    features = np.empty((num_positions, NUM_FEATURES), dtype=np.float32)
+    points = np.concatenate((my_points, their_points), axis=1)
+    features[:, :192] = _POINT_FEATURE_TABLE[points].reshape(num_positions, 192)
+    features[:, 192] = my_block[:, _BAR_SLOT] / 2
+    features[:, 193] = their_block[:, _BAR_SLOT] / 2
+    features[:, 194] = my_points.sum(axis=1) / 15
+    features[:, 195] = their_points.sum(axis=1) / 15
+    return features
+
+
+def encode_features_batch(boards: Sequence[Board], player: Union[int, np.ndarray]) -> np.ndarray:
+    return encode_positions(stack_boards(boards), player)
+
+
+if __name__ == '__main__':
+    import copy
+    import timeit
+
+    # Compare board copies per second between the old deepcopy path and clone()/copy_into()
+    b = Board(False)
+    scratch = b.clone()
+    num_copies = 100000
+    # The pre-array board held two lists, two bar counts and two removed counts
+    legacy_state = {"x_board": list(b.x_board), "o_board": list(b.o_board), "x_bar": 0, "o_bar": 0,
+                    "x_removed": 0, "o_removed": 0}
+    for name, fn in [("legacy deepcopy", lambda: copy.deepcopy(legacy_state)),
+                     ("Board.clone", b.clone),
+                     ("Board.copy_into", lambda: b.copy_into(scratch))]:
+        elapsed = timeit.timeit(fn, number=num_copies)
+        print(f"{name:16s} {num_copies / elapsed:12.0f} boards/sec")
+
+    # Compare positions encoded per second, one board at a time versus in a batch
+    candidates = [a for _, a in b.legal_afterstates([3, 3, 3, 3], PLAYER_X)]
+    batch = encode_features_batch(candidates, PLAYER_X)
+    reference = np.concatenate([c.encode_features(PLAYER_X) for c in candidates])
+    assert np.allclose(batch, reference), "Batch encoding does not match Board.encode_features"
+    num_repeats = 200
+    elapsed = timeit.timeit(lambda: [c.encode_features(PLAYER_X) for c in candidates], number=num_repeats)
+    print(f"{'encode_features':16s} {num_repeats * len(candidates) / elapsed:12.0f} positions/sec")
+    elapsed = timeit.timeit(lambda: encode_features_batch(candidates, PLAYER_X), number=num_repeats)
+    print(f"{'batch encode':16s} {num_repeats * len(candidates) / elapsed:12.0f} positions/sec "
+          f"({len(candidates)} per batch)")
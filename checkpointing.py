@@ -0,0 +1,78 @@
+# Resumable training checkpoints.  A snapshot of the full training state (weights, eligibility traces, RNG state,
+# game counters and histories) is copied on the training thread, then pickled and written by a background thread, so
+# self-play only pauses for the in-memory copy.  Files are written under a temporary name and renamed into place, so a
+# run killed mid-write never leaves a truncated checkpoint behind.
+import glob
+import logging
+import os
+import pickle
+import threading
+from typing import Dict, List, Optional
+
+CHECKPOINT_PREFIX = "training-"
+CHECKPOINT_SUFFIX = ".ckpt"
+
+
+class CheckpointManager:
+    def __init__(self, directory: str = "checkpoints", keep: int = 3):
+        # keep: number of most recent checkpoints left on disk, older ones are deleted after each save
+        self.directory = directory
+        self.keep = keep
+        self._thread: Optional[threading.Thread] = None
+        self._error: Optional[BaseException] = None
+        os.makedirs(directory, exist_ok=True)
+
+    def path_for(self, episode: int) -> str:
+        return os.path.join(self.directory, f"{CHECKPOINT_PREFIX}{episode:09d}{CHECKPOINT_SUFFIX}")
+
+    def checkpoints(self) -> List[str]:
+        # Oldest first; the zero padded episode number makes name order the same as episode order
+        return sorted(glob.glob(os.path.join(self.directory, CHECKPOINT_PREFIX + "*" + CHECKPOINT_SUFFIX)))
+
+    def latest(self) -> Optional[str]:
+        checkpoints = self.checkpoints()
+        return checkpoints[-1] if len(checkpoints) > 0 else None
+
+    def save_async(self, episode: int, state: Dict) -> None:
+        # state must already be a private copy, as it is written while training carries on.  Only one write is in
+        # flight at a time, so saving again waits for the previous write to finish.
+        self.wait()
+        self._thread = threading.Thread(target=self._write, args=(self.path_for(episode), state),
+                                        name="CheckpointWriter", daemon=True)
+        self._thread.start()
+
+    def save(self, episode: int, state: Dict) -> None:
+        self.save_async(episode, state)
+        self.wait()
+
+    def wait(self) -> None:
+        # Blocks until the pending write is on disk, and re-raises any error it hit
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def _write(self, path: str, state: Dict) -> None:
+        tmp_path = path + ".tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+            logging.info("Saved training checkpoint %s", path)
+            for old_path in self.checkpoints()[:-self.keep]:
+                os.remove(old_path)
+        except BaseException as e:
+            self._error = e
+
+    def load(self, path: Optional[str] = None) -> Optional[Dict]:
+        # Loads the given checkpoint, or the latest one if no path is given.  Returns None if there is none.
+        path = path or self.latest()
+        if path is None:
+            return None
+        logging.info("Loading training checkpoint %s", path)
+        with open(path, "rb") as f:
+            return pickle.load(f)
@@ -0,0 +1,48 @@
+from collections import OrderedDict
+from typing import Dict, Hashable, Optional
+
+
+class EvaluationCache:
+    # Bounded least-recently-used map from position key to network value.  Entries are tagged with the weights
+    # version they were computed under, so bumping the version invalidates everything in O(1).
+    def __init__(self, max_size: int):
+        if max_size <= 0:
+            raise ValueError(f"Cache size must be positive, got {max_size}")
+        self.max_size = max_size
+        self.version = 0
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[float]:
+        entry = self._entries.get(key)
+        if entry is None or entry[0] != self.version:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key: Hashable, value: float) -> None:
+        if key in self._entries:
+            self._entries.move_to_end(key)
+        elif len(self._entries) >= self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+        self._entries[key] = (self.version, value)
+
+    def invalidate(self) -> None:
+        # Called whenever the weights change; stale entries are replaced as they are next looked up or evicted
+        self.version += 1
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {"size": len(self._entries), "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups > 0 else 0.0, "version": self.version}
@@ -0,0 +1,302 @@
+# Evaluation matches that need far fewer games than playing a fixed number of training games against RandomAgent.
+# Games are played in duplicate pairs: both games of a pair use the same pre-drawn dice, with the seats swapped, so each
+# side gets the rolls the other had and most of the dice luck cancels out.  Pairs are played across a process pool and
+# a sequential test stops the match as soon as the result is clear.
+import argparse
+import logging
+import math
+import multiprocessing as mp
+import time
+from collections import deque
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+import numpy as np
+from bearoff import BearoffDatabase, load_database
+from board import Board, encode_features_batch
+from numpy_network import NumpyNetwork
+from quantized import QuantizedNetwork
+from race import EvaluationRouter
+from random_agent import RandomAgent
+from search import ExpectimaxSearch
+
+# A player is either "random", the path of a quantised network from quantized.py, or the weights of a TDagent network,
+# in TDagent.get_weights() order
+PlayerSpec = Union[str, List[np.ndarray]]
+DICE_BLOCK = 128  # Rolls drawn at a time for a dice sequence; most games are shorter than this
+
+
+class NetworkPlayer:
+    # Inference-only player built from TDagent weights, so pool workers never have to import TensorFlow
+    def __init__(self, weights: List[np.ndarray]):
+        num_features, num_hidden = weights[0].shape
+        self.network = NumpyNetwork(num_features, num_hidden)
+        self.network.set_weights(weights)
+
+    def assess_boards(self, boards, player: int) -> np.ndarray:
+        return self.network.predict(encode_features_batch(boards, player))
+
+
+def make_player(spec: PlayerSpec):
+    if isinstance(spec, str):
+        if spec.endswith(".npz"):
+            return QuantizedNetwork.load(spec)
+        if spec != "random":
+            raise ValueError(f"Unknown player '{spec}', expected 'random', a .npz file or network weights")
+        return RandomAgent()
+    return NetworkPlayer(spec)
+
+
+class DiceSequence:
+    # The rolls for one pair of games, indexed by turn, so both games see the same dice on the same turn
+    def __init__(self, seed):
+        self._rng = np.random.RandomState(seed)
+        self._rolls = self._rng.randint(1, 7, size=(DICE_BLOCK, 2))
+
+    def roll(self, turn: int) -> List[int]:
+        while turn >= len(self._rolls):
+            self._rolls = np.concatenate([self._rolls, self._rng.randint(1, 7, size=(DICE_BLOCK, 2))])
+        first, second = int(self._rolls[turn, 0]), int(self._rolls[turn, 1])
+        if first == second:
+            return [first] * 4
+        return [first, second]
+
+
+def play_game(first, second, dice: DiceSequence, seed, endgame_board: bool = False,
+              searches: Sequence[Optional[ExpectimaxSearch]] = (None, None)) -> int:
+    # Plays without learning; returns 0 if the first mover won and 1 otherwise.  A player with a search chooses their
+    # moves with it, the others by their assess_boards() alone.
+    np.random.seed(seed)  # The endgame layout and RandomAgent both draw from the global generator
+    board = Board(endgame_board)
+    players = (first, second)
+    pID = 0
+    turn = 0
+    while True:
+        if searches[pID] is not None:
+            _, _, board = searches[pID].choose(board, dice.roll(turn), pID)
+        else:
+            afterstates = board.legal_afterstates(dice.roll(turn), pID)
+            values = players[pID].assess_boards([b for _, b in afterstates], pID)
+            board = afterstates[int(np.argmax(values))][1]
+        if board.game_won(pID):
+            return pID
+        pID = 1 - pID
+        turn += 1
+
+
+def play_pair(agent, opponent, seed, endgame_board: bool = False,
+              searches: Sequence[Optional[ExpectimaxSearch]] = (None, None)) -> float:
+    # Score of the agent over a duplicate pair: 1 for two wins, 0.5 for a split and 0 for two losses.  searches holds
+    # the agent's search and then the opponent's.
+    dice = DiceSequence(seed)
+    first_won = play_game(agent, opponent, dice, seed, endgame_board, searches) == 0
+    second_won = play_game(opponent, agent, dice, seed, endgame_board, searches[::-1]) == 1
+    return (first_won + second_won) / 2
+
+
+_databases: Dict[str, Optional[BearoffDatabase]] = {}  # Bear-off databases opened by this process, by path
+
+
+def _play_pairs(agent_spec: PlayerSpec, opponent_spec: PlayerSpec, seeds: Sequence,
+                settings: Dict) -> Tuple[List[float], int, float]:
+    # Returns the pair scores, and the nodes and seconds spent searching
+    players = (make_player(agent_spec), make_player(opponent_spec))
+    bearoff_path = settings["bearoff_path"]
+    if bearoff_path not in _databases:
+        _databases[bearoff_path] = load_database(bearoff_path)
+    bearoff = _databases[bearoff_path]
+    router = EvaluationRouter(bearoff, settings["race"]) if settings["race"] or bearoff is not None else None
+    # Network players search; RandomAgent just picks at random
+    searches = [ExpectimaxSearch(player, settings["plies"], settings["filter_width"], router)
+                if not isinstance(player, RandomAgent) else None for player in players]
+    scores = [play_pair(players[0], players[1], seed, settings["endgame_board"], searches) for seed in seeds]
+    searched = [search for search in searches if search is not None]
+    return scores, sum(search.nodes for search in searched), sum(search.elapsed for search in searched)
+
+
+class SequentialTest:
+    # Decides whether the agent's expected pair score is above 0.5 from as few pairs as possible.
+    # "sprt": sequential probability ratio test of score p0 (H0) against p1 (H1), using the normal approximation to the
+    #   log-likelihood ratio, so it copes with the three possible pair scores.  Decides "stronger" or "not_stronger".
+    # "ci": stops once the confidence interval of the mean score excludes 0.5 ("stronger" or "weaker"), or is
+    #   narrower than +/- half_width ("level").
+    def __init__(self, method: str = "sprt", p0: float = 0.5, p1: float = 0.55, alpha: float = 0.05,
+                 beta: float = 0.05, z: float = 1.96, half_width: float = 0.02, min_pairs: int = 16,
+                 max_pairs: int = 2000):
+        if method not in ("sprt", "ci"):
+            raise ValueError(f"Unknown sequential test '{method}', expected 'sprt' or 'ci'")
+        self.method = method
+        self.p0 = p0
+        self.p1 = p1
+        self.lower_bound = math.log(beta / (1 - alpha))
+        self.upper_bound = math.log((1 - beta) / alpha)
+        self.z = z
+        self.half_width = half_width
+        self.min_pairs = min_pairs
+        self.max_pairs = max_pairs
+        self.reset()
+
+    def reset(self) -> None:
+        self.n = 0
+        self.total = 0.0
+        self.total_sq = 0.0
+
+    def add(self, score: float) -> None:
+        self.n += 1
+        self.total += score
+        self.total_sq += score * score
+
+    def mean(self) -> float:
+        return self.total / self.n if self.n > 0 else 0.5
+
+    def variance(self) -> float:
+        # Per-pair variance, floored so a run of identical scores still gives a finite statistic
+        if self.n < 2:
+            return 0.25
+        mean = self.mean()
+        return max(self.total_sq / self.n - mean * mean, 1e-4)
+
+    def interval(self) -> List[float]:
+        half_width = self.z * math.sqrt(self.variance() / max(self.n, 1))
+        return [self.mean() - half_width, self.mean() + half_width]
+
+    def llr(self) -> float:
+        return self.n * (self.p1 - self.p0) * (2 * self.mean() - self.p0 - self.p1) / (2 * self.variance())
+
+    def decision(self) -> Optional[str]:
+        if self.n < self.min_pairs:
+            return None
+        if self.method == "sprt":
+            llr = self.llr()
+            if llr >= self.upper_bound:
+                return "stronger"
+            if llr <= self.lower_bound:
+                return "not_stronger"
+        else:
+            low, high = self.interval()
+            if low > 0.5:
+                return "stronger"
+            if high < 0.5:
+                return "weaker"
+            if (high - low) / 2 < self.half_width:
+                return "level"
+        if self.n >= self.max_pairs:
+            return "undecided"
+        return None
+
+
+class Evaluator:
+    def __init__(self, num_workers: int = 0, pairs_per_task: int = 4, endgame_board: bool = False,
+                 bearoff_path: Optional[str] = None, race: bool = False, plies: int = 1, filter_width: int = 8):
+        # num_workers: size of the process pool, which is kept between evaluations (0 to play in this process)
+        # bearoff_path: bear-off database for the network players, memory-mapped by each worker
+        # race: network players choose moves in races by pip count
+        # plies, filter_width: depth and move filter of the network players' expectimax search
+        self.num_workers = num_workers
+        self.pairs_per_task = pairs_per_task
+        self.settings = {"endgame_board": endgame_board, "bearoff_path": bearoff_path, "race": race, "plies": plies,
+                         "filter_width": filter_width}
+        self.pool = mp.get_context("spawn").Pool(num_workers) if num_workers > 0 else None
+
+    def evaluate(self, agent: PlayerSpec, opponent: PlayerSpec = "random", seed: int = 0,
+                 test: Optional[SequentialTest] = None) -> Dict:
+        # Pair n of an evaluation always uses the dice drawn from seed (seed, n), so repeated evaluations of different
+        # checkpoints are played on the same dice
+        test = test or SequentialTest()
+        test.reset()
+        start_time = time.time()
+        nodes = 0
+        search_time = 0.0
+        tasks = ([(seed, n) for n in range(start, min(start + self.pairs_per_task, test.max_pairs))]
+                 for start in range(0, test.max_pairs, self.pairs_per_task))
+        if self.pool is None:
+            np_state = np.random.get_state()  # Leave the caller's random sequence untouched
+            for seeds in tasks:
+                scores, task_nodes, task_time = _play_pairs(agent, opponent, seeds, self.settings)
+                for score in scores:
+                    test.add(score)
+                nodes += task_nodes
+                search_time += task_time
+                if test.decision() is not None:
+                    break
+            np.random.set_state(np_state)
+        else:
+            # Keep a couple of tasks per worker in flight, and feed the results to the test in submission order.
+            # Tasks still running when the test decides are left to finish and their results are ignored.
+            in_flight = deque()
+            for seeds in tasks:
+                in_flight.append(self.pool.apply_async(_play_pairs, (agent, opponent, seeds, self.settings)))
+                if len(in_flight) < 2 * self.num_workers:
+                    continue
+                scores, task_nodes, task_time = in_flight.popleft().get()
+                for score in scores:
+                    test.add(score)
+                nodes += task_nodes
+                search_time += task_time
+                if test.decision() is not None:
+                    break
+            while test.decision() is None and len(in_flight) > 0:
+                scores, task_nodes, task_time = in_flight.popleft().get()
+                for score in scores:
+                    test.add(score)
+                nodes += task_nodes
+                search_time += task_time
+        elapsed = time.time() - start_time
+        low, high = test.interval()
+        return {"decision": test.decision(), "pairs": test.n, "games": 2 * test.n, "score": test.mean(),
+                "ci_low": low, "ci_high": high, "llr": test.llr(), "elapsed": elapsed,
+                "games_per_sec": 2 * test.n / elapsed, "nodes": nodes,
+                "nodes_per_sec": nodes / search_time if search_time > 0 else 0.0}
+
+    def close(self) -> None:
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+    def __enter__(self) -> "Evaluator":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+
+def format_result(result: Dict) -> str:
+    return (f"{result['decision']} after {result['games']} games: score {result['score']:.3f} "
+            f"[{result['ci_low']:.3f}, {result['ci_high']:.3f}], LLR {result['llr']:.2f}, "
+            f"{result['games_per_sec']:.1f} games/sec, {result['nodes_per_sec']:.0f} nodes/sec")
+
+
+if __name__ == '__main__':
+    from TDGammon_agent import TDagent
+
+    parser = argparse.ArgumentParser(description="Play a duplicate-dice evaluation match between two networks")
+    parser.add_argument("--agent", default="TDGammon",
+                        help="Keras weights in checkpoints/, a quantised .npz file, or 'new' for fresh weights")
+    parser.add_argument("--opponent", default="random",
+                        help="'random', 'new', a quantised .npz file, or Keras weights in checkpoints/")
+    parser.add_argument("--method", choices=["sprt", "ci"], default="sprt")
+    parser.add_argument("--p1", type=float, default=0.55, help="Pair score the SPRT tests against 0.5")
+    parser.add_argument("--max-pairs", type=int, default=2000)
+    parser.add_argument("--workers", type=int, default=max(mp.cpu_count() - 1, 1))
+    parser.add_argument("--endgame", action="store_true", help="Use the endgame starting board")
+    parser.add_argument("--bearoff", help="Bear-off database for the network players")
+    parser.add_argument("--race", action="store_true", help="Network players choose moves in races by pip count")
+    parser.add_argument("--plies", type=int, default=1, help="Search depth of the network players")
+    parser.add_argument("--filter", type=int, default=8, help="Candidates searched deeper at each move node")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARN, format="%(message)s")
+
+    def load_spec(name: str) -> PlayerSpec:
+        if name == "random" or name.endswith(".npz"):
+            return name
+        agent = TDagent(backend="numpy")
+        if name != "new":
+            agent.load(name)
+        return agent.get_weights()
+
+    with Evaluator(args.workers, endgame_board=args.endgame, bearoff_path=args.bearoff, race=args.race,
+                   plies=args.plies, filter_width=args.filter) as evaluator:
+        match = evaluator.evaluate(load_spec(args.agent), load_spec(args.opponent), args.seed,
+                                   SequentialTest(args.method, p1=args.p1, max_pairs=args.max_pairs))
+    print(format_result(match))
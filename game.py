@@ -1,25 +1,67 @@
 # game
-import copy
-from typing import List, Tuple
+from collections import deque
+from typing import Dict, List, Optional, Tuple
 from board import Board
 from TDGammon_agent import TDagent
-from random_agent import RandomAgent
+from profiler import PhaseProfiler
+from metrics import MetricsSink
+from race import EvaluationRouter
+from records import GameWriter
 import numpy as np
 import logging
-import matplotlib.pyplot as plt
 import time
 
+HISTORY_LENGTH = 100000  # Most recent games kept in win_history and game_len_history
+
 
 class Game:
-    def __init__(self, player1, player2, simple_board=False):
+    def __init__(self, player1, player2, simple_board=False, metrics: MetricsSink = None, verbose=True,
+                 history_length=HISTORY_LENGTH, router: EvaluationRouter = None, recorder: GameWriter = None):
+        # metrics: optional sink recording structured per-game stats
+        # verbose: print a line for every game
+        # router: optional EvaluationRouter, so positions without contact skip the agent's network
+        # recorder: optional GameWriter that every game is saved to
         self.players = [player1, player2]
         self.board = None
         self.pID = 0
         self.step = 0
         self.game_count = 0
         self.win_counts = [0, 0]
-        self.game_len_history = []
-        self.win_history = []  # Will record ratio of games won by player 0 by game
+        self.game_len_history = deque(maxlen=history_length)
+        self.win_history = deque(maxlen=history_length)  # Will record ratio of games won by player 0 by game
+        self.metrics = metrics
+        self.verbose = verbose
+        self.profiler = None
+        self.router = router
+        self.recorder = recorder
+
+    def enable_profiling(self, report_every: int = 0, trace_memory: bool = False) -> PhaseProfiler:
+        self.profiler = PhaseProfiler(report_every, trace_memory)
+        self._attach_profiler(self.profiler)
+        return self.profiler
+
+    def disable_profiling(self) -> None:
+        self.profiler = None
+        self._attach_profiler(None)
+
+    def _attach_profiler(self, profiler) -> None:
+        # TDagent times its own feature encoding and network calls, which happen inside its assess methods
+        for player in self.players:
+            if isinstance(player, TDagent):
+                player.profiler = profiler
+
+    def get_state(self) -> Dict:
+        # Counters and histories needed to carry on a run from a checkpoint
+        return {"game_count": self.game_count, "win_counts": list(self.win_counts),
+                "win_history": list(self.win_history), "game_len_history": list(self.game_len_history)}
+
+    def set_state(self, state: Dict) -> None:
+        self.game_count = state["game_count"]
+        self.win_counts = list(state["win_counts"])
+        self.win_history.clear()
+        self.win_history.extend(state["win_history"])
+        self.game_len_history.clear()
+        self.game_len_history.extend(state["game_len_history"])
 
     def choose_first_player(self):
         self.step = 0
@@ -27,18 +69,18 @@ class Game:
             self.pID = 0
         else:
             self.pID = 1
-        logging.info(f"First player is {self.pID}")
+        logging.info("First player is %d", self.pID)
         return self.pID
 
     def next_player(self):
         self.pID = 1 - self.pID
         self.step += 1
-        logging.info(f"Turn {self.step}: Player {self.pID}")
+        logging.info("Turn %d: Player %d", self.step, self.pID)
 
     def set_player(self, player_num):
         self.pID = player_num
         self.step += 1
-        logging.info(f"Turn {self.step}: Player {self.pID} (externally set)")
+        logging.info("Turn %d: Player %d (externally set)", self.step, self.pID)
 
     def _roll_dice(self) -> List[int]:
         rolls = []
@@ -57,165 +99,118 @@ class Game:
 
     def training_game(self, endgame_board: bool) -> float:
         start_game_time = time.time()
+        prof = self.profiler
         # Generate start board
         self.generate_starting_board(endgame_board)
         # Start game
         self.choose_first_player()
+        if self.recorder is not None:
+            self.recorder.start_game(self.board, self.pID)
         reward = 0
         while reward == 0:
             player_agent = self.players[self.pID]
             rolls = self._roll_dice()
-            logging.info(f"Player {self.pID} rolls dice: {rolls}")
-            old_board = copy.deepcopy(self.board)
-            while len(rolls) > 0:
-                permitted_moves = self.board.permitted_moves(rolls, self.pID)
-                logging.info(f"{len(permitted_moves)} possible moves: {permitted_moves}")
-                max_value = -np.inf
-                max_move = None
-                for move in permitted_moves:
-                    temp_board = copy.deepcopy(self.board)
-                    temp_board.perform_move(*move, self.pID)
-                    new_state = temp_board.encode_features(self.pID)
-                    value = player_agent.assess_features(new_state)
-                    # Find optimal policy. Note that due to randomness of dice rolls, epsilon-greedy is not required.
-                    if value > max_value:
-                        max_value = value
-                        max_move = move
-                if max_move is not None:
-                    self.board.perform_move(*max_move, self.pID)
-                    if self.board.game_won(self.pID):
-                        reward = 1
-                        break
-                    else:
-                        reward = 0
-                    del rolls[rolls.index(max_move[1])]
-                else:
-                    reward = 0
-                    break
-            prev_state = old_board.encode_features(self.pID)
-            new_state = self.board.encode_features(self.pID)
-            player_agent.update_model(prev_state, new_state, reward, episode_end=(reward == 1))
+            logging.info("Player %d rolls dice: %s", self.pID, rolls)
+            old_board = self.board
+            # Find optimal policy. Note that due to randomness of dice rolls, epsilon-greedy is not required.
+            max_value, max_moves, self.board, chosen = self._choose_afterstate(player_agent, old_board, rolls,
+                                                                                self._fuse_update(player_agent))
+            logging.info("Player %d plays %s", self.pID, max_moves)
+            if self.recorder is not None:
+                self.recorder.record_turn(self.pID, rolls, max_moves, self.board)
+            if self.board.game_won(self.pID):
+                reward = 1
+            else:
+                reward = 0
+            if prof is not None:
+                phase_start = time.perf_counter()
+            if chosen is not None:
+                # Both positions were encoded and valued while choosing the move
+                player_agent.update_selected(chosen, reward, episode_end=(reward == 1))
+            else:
+                prev_state = old_board.encode_features(self.pID)
+                new_state = self.board.encode_features(self.pID)
+                if prof is not None:
+                    phase_start = prof.record("encode_features", phase_start)
+                player_agent.update_model(prev_state, new_state, reward, episode_end=(reward == 1))
+            if prof is not None:
+                prof.record("td_update", phase_start)
             if reward == 1:
                 break
             else:
                 self.next_player()
 
         # Game ended
-        logging.info(f"Player {self.pID} won!")
+        logging.info("Player %d won!", self.pID)
         self.game_count += 1
         self.win_counts[self.pID] += 1
         self.win_history.append(self.win_counts[0] / (self.win_counts[0] + self.win_counts[1]))
         self.game_len_history.append(self.step)
+        if self.recorder is not None:
+            self.recorder.end_game(self.pID)
         total_game_time = time.time() - start_game_time
         steps_per_second = self.step / total_game_time
-        print(f"Game: {self.game_count}\tSteps: {self.step}\tElapsed:{total_game_time:.4f}s\t"
-              f"Steps per sec:{steps_per_second:.1f}\tWinner: Player {self.pID}\t"
-              f"Win ratio: {self.win_history[-1]:.4f}")
+        if self.metrics is not None:
+            self.metrics.record_game(self.pID, self.step, elapsed=total_game_time, steps_per_sec=steps_per_second,
+                                     win_ratio=self.win_history[-1])
+        if self.verbose:
+            print(f"Game: {self.game_count}\tSteps: {self.step}\tElapsed:{total_game_time:.4f}s\t"
+                  f"Steps per sec:{steps_per_second:.1f}\tWinner: Player {self.pID}\t"
+                  f"Win ratio: {self.win_history[-1]:.4f}")
+        if prof is not None:
+            prof.end_game()
 
         return total_game_time
 
-    def move_tree_analysis(self, agent, current_board: Board, available_rolls: List[int], prior_moves: List[Tuple[int, int]]):
-        logging.debug(f"AI looking for moves subsequent to prior moves {prior_moves}")
-        possible_moves = current_board.permitted_moves(available_rolls, self.pID)
-        if len(possible_moves) == 0:
-            # No valid moves, so return current state
-            logging.debug(f"AI found no valid moves with remaining dice rolls ({available_rolls}")
-            new_state = current_board.encode_features(self.pID)
-            value = agent.assess_features(new_state)
-            return value, prior_moves
+    def _fuse_update(self, agent) -> bool:
+        # A learning TDagent can reuse move selection's forward pass for its TD update, on the turns where the router
+        # would send every candidate to the network anyway (see _choose_afterstate)
+        return isinstance(agent, TDagent) and agent.learning_enabled
+
+    def _choose_afterstate(self, agent, current_board: Board, available_rolls: List[int], for_update: bool = False) \
+            -> Tuple[float, List[Tuple[int, int]], Board, Optional[int]]:
+        # Returns the best afterstate's value, moves and board, and its index for agent.update_selected() if the
+        # candidates were valued with agent.assess_for_update() (otherwise None).  for_update: do so if the router
+        # would send every candidate to the network; a move that breaks contact is valued by the router instead.
+        prof = self.profiler
+        if prof is not None:
+            phase_start = time.perf_counter()
+        afterstates = current_board.legal_afterstates(available_rolls, self.pID)
+        if prof is not None:
+            # Move generation includes copying the board for every candidate
+            phase_start = prof.record("move_generation", phase_start)
+            prof.count("afterstates", len(afterstates))
+            nested = prof.total("encode_features", "network")
+        logging.debug("%d distinct positions reachable with rolls %s", len(afterstates), available_rolls)
+        # Score every candidate position with a single call to the agent
+        boards = [board for _, board in afterstates]
+        if for_update and self.router is not None:
+            for_update = self.router.network_only(boards)
+        if for_update:
+            values = agent.assess_for_update(boards, self.pID, current_board)
+            if self.router is not None:
+                self.router.count_network(len(boards))
+        elif self.router is None:
+            values = agent.assess_boards(boards, self.pID)
         else:
-            # At least one valid move to look at
-            logging.debug(f"AI examining subsequent moves: {possible_moves}")
-            max_value = -np.inf
-            max_branch = None
-            for move in possible_moves:
-                temp_board = copy.deepcopy(current_board)
-                temp_board.perform_move(*move, self.pID)
-                remaining_rolls = [available_rolls[i] for i in range(len(available_rolls)) if
-                                   i != available_rolls.index(move[1])]
-                extant_moves = prior_moves + [move]
-                if len(remaining_rolls) > 0:
-                    # Still got rolls to do
-                    best_subsequent_value, best_subsequent_move_tree = \
-                        self.move_tree_analysis(agent, temp_board, remaining_rolls, extant_moves)
-                    if best_subsequent_value > max_value:
-                        max_value = best_subsequent_value
-                        max_branch = best_subsequent_move_tree
-                else:
-                    new_state = temp_board.encode_features(self.pID)
-                    value = agent.assess_features(new_state)
-                    if value > max_value:
-                        max_value = value
-                        max_branch = extant_moves
-            logging.debug(f"AI's best board found so far with score {max_value} on branch {max_branch}")
-            return max_value, max_branch
-
-
-if __name__ == '__main__':
-    logging.basicConfig(level=logging.WARN, format="%(message)s")
-    common_TD_agent = TDagent(0.1, 0.7, 196)
-
-    # Ask what board configuration to use
-    response = input("Use endgame backgammon starting board (y/n)?: ")
-    use_endgame_board = (str(response).upper() == "Y")
-    # Offer to load existing model
-    response = input("Do you want to load a checkpoint (y/n): ")
-    if str(response).upper() == "Y":
-        # response = input("Specify checkpoint name (TDGammon): ")
-        # if use_endgame_board:
-        #     common_TD_agent.load("TDGammon_endgame")
-        # else:
-        #     common_TD_agent.load("TDGammon")
-        common_TD_agent.load("TDGammon")
-
-    # Ask for length
-    response = input("How many training episodes: ")
-    num_training_episodes = int(response)
-    response = input("How often to save checkpoints: ")
-    checkpoint_period = int(response)
-    response = input("How many test episodes per checkpoint: ")
-    num_test_episodes = int(response)
-    response = input("Allow learning during test rounds? (y/n): ")
-    test_training = str(response).upper() == "Y"
-
-    g = Game(common_TD_agent, common_TD_agent)
-    g_test = Game(common_TD_agent, RandomAgent())
-    last_ten_ep_lengths = [0.0] * 10
-    for episode in range(1, num_training_episodes + 1):
-        episode_length = g.training_game(use_endgame_board)
-        last_ten_ep_lengths = last_ten_ep_lengths[1:] + [episode_length]
-        if episode % checkpoint_period == 0 and episode > 1:
-            print("Saving checkpoint")
-            common_TD_agent.save("TDGammon")
-            # if use_endgame_board:
-            #     common_TD_agent.save("TDGammon_simple")
-            # else:
-            #     common_TD_agent.save("TDGammon")
-            print("Starting test phase versus RandomAgent(). Learning disabled.")
-            if not test_training:
-                common_TD_agent.disable_learning()
-            for test_episode in range(0, num_test_episodes):
-                g_test.training_game(use_endgame_board)
-            print("Resuming training.")
-            if not test_training:
-                common_TD_agent.enable_learning()
-        if episode % 10 == 0 and episode > 1 and num_test_episodes == 0:
-            # Give estimate of time to complete
-            remaining_episodes = num_training_episodes - episode
-            remaining_time = remaining_episodes * np.average(last_ten_ep_lengths)
-            print(f"Estimated time to complete: {remaining_time / 60:.2f} mins")
-
-
-    train_win_history = copy.deepcopy(g.win_history)
-    train_len_history = copy.deepcopy(g.game_len_history)
-
-    plt.plot(train_win_history, label="Training")
-    plt.plot(g_test.win_history, label="Testing")
-    plt.plot([0.5] * num_training_episodes, ":")
-    plt.legend()
-    plt.show()
-
-
+            values = self.router.assess(agent, boards, self.pID)
+        if prof is not None:
+            # The agent records its encoding and network time itself; what is left is cache lookups and the router
+            prof.record("evaluation", phase_start, exclude=prof.total("encode_features", "network") - nested)
+        best = int(np.argmax(values))
+        max_value = values[best]
+        max_moves, max_board = afterstates[best]
+        return max_value, max_moves, max_board, best if for_update else None
 
+    def move_tree_analysis(self, agent, current_board: Board, available_rolls: List[int], prior_moves: List[Tuple[int, int]]):
+        logging.debug("AI looking for moves subsequent to prior moves %s", prior_moves)
+        max_value, max_moves, _, _ = self._choose_afterstate(agent, current_board, available_rolls)
+        max_branch = prior_moves + max_moves
+        logging.debug("AI's best board found with score %s on branch %s", max_value, max_branch)
+        return max_value, max_branch
 
 
+if __name__ == '__main__':
+    # Training is configured from the command line, see train.py for the options
+    from train import main
+    main()
@@ -1,20 +1,25 @@
-import copy
-
 from game import Game
+from bearoff import DEFAULT_PATH as BEAROFF_PATH, load_database
+from race import EvaluationRouter
+from search import ExpectimaxSearch
 from board import Board
 from TDGammon_agent import TDagent
+from quantized import QuantizedNetwork
 import pygame
 import logging
 from enum import Enum
 from human_agent import HumanAgent
 from typing import List, Union, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 import random
+import threading
 import time
 import ctypes
-import numpy as np
 
 # Cope with Windows display scaling
-ctypes.windll.user32.SetProcessDPIAware()
+if hasattr(ctypes, "windll"):
+    ctypes.windll.user32.SetProcessDPIAware()
 
 BLACK = (30, 30, 30)
 WHITE = (220, 220, 220)
@@ -43,7 +48,11 @@ RES_X = RES_Y / 3 * 4
 TARGET_FPS = 30
 MOVE_ANIM_FRAMES = 30
 DICE_ROLL_TIME_RANGE = 1
-AI_THINK_TIME = 1
+AI_THINK_TIME = 1  # Seconds the AI spends searching each move
+AI_CACHE_SIZE = 100000  # Positions remembered by the AI's evaluation cache
+AI_MAX_PLIES = 3  # Deepest expectimax search the AI tries; 1 just scores the positions reachable with its roll
+AI_FILTER_WIDTH = 8  # Moves the AI looks at more deeply
+AI_QUANTIZED_MODEL = None  # A file from quantized.py, e.g. "checkpoints/TDGammon.int8.npz", to play instead of TDGammon
 MSG_DISPLAY_TIME = 1.5
 
 # Define board dimensions
@@ -73,6 +82,12 @@ class GameState(Enum):
     WAIT_X = 4
     WAIT_O = 5
     GAME_END = 6
+    ROLL_DICE_ANIM = 16
+    PLAYER_DICE_ROLLED = 17
+    FIRST_ROLL_O = 18
+    FIRST_PLAYER_CHOSEN = 19
+    SHOW_MESSAGE = 20
+    AI_THINKING = 21
 
 
 class GameType(Enum):
@@ -81,6 +96,47 @@ class GameType(Enum):
     PvE = 2
 
 
+screen: pygame.Surface = None  # Set up by init_display()
+dirty_rects: List[pygame.Rect] = []  # Areas of the screen drawn on since the window was last updated
+_board_cache: Tuple[pygame.Surface, List["Point"]] = None  # The empty board, drawn once by draw_board()
+
+
+def init_display() -> pygame.Surface:
+    global screen
+    pygame.init()
+    screen = pygame.display.set_mode((RES_X, RES_Y))
+    pygame.display.set_caption("MRGammon")
+    return screen
+
+
+def mark_dirty(rect) -> None:
+    dirty_rects.append(pygame.Rect(rect))
+
+
+def update_display() -> None:
+    # Copies only the areas drawn on since the last update to the window, or the whole screen once most of it has
+    # been redrawn anyway
+    if len(dirty_rects) == 0:
+        return
+    bounds = dirty_rects[0].unionall(dirty_rects[1:])
+    if bounds.width * bounds.height >= screen.get_width() * screen.get_height() / 2:
+        pygame.display.update()
+    else:
+        pygame.display.update(dirty_rects)
+    dirty_rects.clear()
+
+
+# Fonts and sounds are loaded from disk the first time they are used and kept
+@lru_cache(maxsize=None)
+def get_font(size: int) -> pygame.font.Font:
+    return pygame.font.SysFont(None, size)
+
+
+@lru_cache(maxsize=None)
+def get_sound(path: str) -> pygame.mixer.Sound:
+    return pygame.mixer.Sound(path)
+
+
 class Point:
     def __init__(self, rect, global_point: int):
         self.rect = rect
@@ -157,11 +213,12 @@ class Piece:
 
         circle = pygame.draw.circle(screen, colour, [x, y], PIECE_RAD)
         pygame.draw.circle(screen, border_colour, [x, y], PIECE_RAD, 5)  # border
+        mark_dirty(circle)
         return circle
 
 
 def draw_button(text_string: str, left: Union[float, int], top: Union[float, int], width: Union[float, int], height: Union[float, int]) -> pygame.rect:
-    font = pygame.font.SysFont(None, int(height * 0.9))
+    font = get_font(int(height * 0.9))
     # Draw button rectangle
     rect = pygame.draw.rect(screen, DARK_GREY, [left, top, width, height])
     # Draw text centered in rectangle
@@ -169,13 +226,25 @@ def draw_button(text_string: str, left: Union[float, int], top: Union[float, int
     text_rect = text.get_rect()
     text_rect.center = (left + width / 2, top + height / 2)
     screen.blit(text, text_rect)
+    mark_dirty(rect)
     # Return rectangle
     return rect
 
 
 def draw_board() -> List[Point]:
+    # The empty board never changes, so it is drawn once and then copied to the screen
+    global _board_cache
+    if _board_cache is None:
+        surface = pygame.Surface(screen.get_size())
+        _board_cache = (surface, render_board(surface))
+    screen.blit(_board_cache[0], (0, 0))
+    mark_dirty(screen.get_rect())
+    return _board_cache[1]
+
+
+def render_board(surface: pygame.Surface) -> List[Point]:
     # Clear screen
-    screen.fill(BLACK)
+    surface.fill(BLACK)
     # Draw board
     points: List[Point] = [None] * 24
     for n in range(0, 6):
@@ -185,20 +254,20 @@ def draw_board() -> List[Point]:
         else:
             spacer = 0
         # White triangles (player O)
-        points[12 + 2 * n] = pygame.draw.polygon(screen, WHITE, [
+        points[12 + 2 * n] = pygame.draw.polygon(surface, WHITE, [
                                             [W_BORDER + n * TRI_SPACING + spacer, 0],
                                             [W_BORDER + n * TRI_SPACING + TRI_WIDTH / 2 + spacer, TRI_HEIGHT],
                                             [W_BORDER + n * TRI_SPACING + TRI_WIDTH + spacer, 0]])
-        points[10 - 2 * n] = pygame.draw.polygon(screen, WHITE, [
+        points[10 - 2 * n] = pygame.draw.polygon(surface, WHITE, [
                                             [W_BORDER + n * TRI_SPACING + TRI_WIDTH + spacer, RES_Y],
                                             [W_BORDER + n * TRI_SPACING + TRI_WIDTH * 1.5 + spacer, RES_Y - TRI_HEIGHT],
                                             [W_BORDER + (n + 1) * TRI_SPACING + spacer, RES_Y]])
         # Red triangles
-        points[11 - 2 * n] = pygame.draw.polygon(screen, RED, [
+        points[11 - 2 * n] = pygame.draw.polygon(surface, RED, [
                                             [W_BORDER + n * TRI_SPACING + spacer, RES_Y],
                                             [W_BORDER + n * TRI_SPACING + TRI_WIDTH / 2 + spacer, RES_Y - TRI_HEIGHT],
                                             [W_BORDER + n * TRI_SPACING + TRI_WIDTH + spacer, RES_Y]])
-        points[13 + 2 * n] = pygame.draw.polygon(screen, RED, [
+        points[13 + 2 * n] = pygame.draw.polygon(surface, RED, [
                                             [W_BORDER + n * TRI_SPACING + TRI_WIDTH + spacer, 0],
                                             [W_BORDER + n * TRI_SPACING + TRI_WIDTH * 1.5 + spacer, TRI_HEIGHT],
                                             [W_BORDER + (n + 1) * TRI_SPACING + spacer, 0]])
@@ -206,38 +275,38 @@ def draw_board() -> List[Point]:
     for n in range(0, 24):
         points[n] = Point(points[n], n)
     # Bar
-    bar_o = pygame.draw.rect(screen, GREY, [W_BORDER + TRI_WIDTH * 6, 0, TRI_WIDTH, RES_Y / 2])
-    bar_x = pygame.draw.rect(screen, GREY, [W_BORDER + TRI_WIDTH * 6, RES_Y / 2, TRI_WIDTH, RES_Y / 2])
+    bar_o = pygame.draw.rect(surface, GREY, [W_BORDER + TRI_WIDTH * 6, 0, TRI_WIDTH, RES_Y / 2])
+    bar_x = pygame.draw.rect(surface, GREY, [W_BORDER + TRI_WIDTH * 6, RES_Y / 2, TRI_WIDTH, RES_Y / 2])
     # Add bars to points list
     points.append(Point(bar_o, 24))
     points.append(Point(bar_x, -1))
     # Home panel
-    home_x = pygame.draw.rect(screen, BLACK, [TRI_WIDTH * 13 + W_BORDER * 2, 0, TRI_WIDTH * 1.5, RES_Y / 2])
-    home_o = pygame.draw.rect(screen, BLACK, [TRI_WIDTH * 13 + W_BORDER * 2, RES_Y / 2, TRI_WIDTH * 1.5, RES_Y / 2])
+    home_x = pygame.draw.rect(surface, BLACK, [TRI_WIDTH * 13 + W_BORDER * 2, 0, TRI_WIDTH * 1.5, RES_Y / 2])
+    home_o = pygame.draw.rect(surface, BLACK, [TRI_WIDTH * 13 + W_BORDER * 2, RES_Y / 2, TRI_WIDTH * 1.5, RES_Y / 2])
     # Add home panel to points list
     points.append(Point(home_x, 24))
     points.append(Point(home_o, -1))
     # Screen border
-    pygame.draw.rect(screen, GREY, [0, 0, W_BORDER, RES_Y])  # left
-    pygame.draw.rect(screen, GREY, [TRI_WIDTH * 13 + W_BORDER, 0, W_BORDER, RES_Y])  # right
-    pygame.draw.rect(screen, GREY, [W_BORDER, 0, TRI_WIDTH * 13, W_BORDER])  # top
-    pygame.draw.rect(screen, GREY, [W_BORDER, RES_Y - W_BORDER, TRI_WIDTH * 13, W_BORDER])  # bottom
+    pygame.draw.rect(surface, GREY, [0, 0, W_BORDER, RES_Y])  # left
+    pygame.draw.rect(surface, GREY, [TRI_WIDTH * 13 + W_BORDER, 0, W_BORDER, RES_Y])  # right
+    pygame.draw.rect(surface, GREY, [W_BORDER, 0, TRI_WIDTH * 13, W_BORDER])  # top
+    pygame.draw.rect(surface, GREY, [W_BORDER, RES_Y - W_BORDER, TRI_WIDTH * 13, W_BORDER])  # bottom
 
     # Write global coord into triangles
-    font = pygame.font.SysFont(None, 24)
+    font = get_font(24)
     for n in range(0, 24):
         text = font.render(str(n), True, WHITE)
-        screen.blit(text, points[n].rect)
+        surface.blit(text, points[n].rect)
 
     return points
 
 
 def draw_welcome():
-    font = pygame.font.SysFont(None, int(RES_Y/12))
+    font = get_font(int(RES_Y/12))
     # Welcome message
     text = font.render("Welcome to Martin's backgammon", True, WHITE)
     text_rect = text.get_rect(center=((RES_X * 0.9)/2, RES_Y * 0.45))
-    screen.blit(text, text_rect)
+    mark_dirty(screen.blit(text, text_rect))
     # Game type options
     pvp = draw_button("Player vs Player", TRI_WIDTH * 1.25, RES_Y * 0.48, TRI_WIDTH * 4, RES_Y / 15)
     pve = draw_button("Player vs Computer", TRI_WIDTH * 7.75, RES_Y * 0.48, TRI_WIDTH * 5, RES_Y / 15)
@@ -263,7 +332,7 @@ def draw_die(player: int, face_value: int, die_index: int):
     # Die size
     width = TRI_WIDTH / 2
     # Draw cube surface
-    pygame.draw.rect(screen, colour, [center[0] - width/2, center[1] - width/2, width, width])
+    cube = pygame.draw.rect(screen, colour, [center[0] - width/2, center[1] - width/2, width, width])
     # Show face value
     dot_gap = width / 4
     dot_size = RES_Y / 200
@@ -278,100 +347,69 @@ def draw_die(player: int, face_value: int, die_index: int):
     if face_value == 6:
         pygame.draw.circle(screen, BLACK, [center[0] - dot_gap, center[1]], dot_size)  # mid left
         pygame.draw.circle(screen, BLACK, [center[0] + dot_gap, center[1]], dot_size)  # mid right
-    # Update display
-    pygame.display.update()
-
+    mark_dirty(cube)
 
-def roll_dice(num_die: int, player: int) -> List[int]:
-    logging.debug(f"Rolling {num_die} dice for player {player}")
-    roll_time = []
-    for n in range(0, num_die):
-        # Choose random amount of time for the die to take to settle
-        roll_time.append(0.5 + random.random() * DICE_ROLL_TIME_RANGE)
 
-    start_time = time.time()
-    dice_stopped = [False] * num_die
-    num_stopped = 0
-    face_value = [0] * num_die
-    done = False
-    clock = pygame.time.Clock()
+def play_dice_sound():
     # Random choice of sound effect
     rnd = random.randint(1, 6)
     if rnd == 1:
-        pygame.mixer.Sound("sound/zapsplat_leisure_board_game_dice_throw_roll_on_playing_board_001_37257.mp3").play()
+        get_sound("sound/zapsplat_leisure_board_game_dice_throw_roll_on_playing_board_001_37257.mp3").play()
     elif rnd == 2:
-        pygame.mixer.Sound("sound/zapsplat_leisure_board_game_dice_throw_roll_on_playing_board_002_37258.mp3").play()
+        get_sound("sound/zapsplat_leisure_board_game_dice_throw_roll_on_playing_board_002_37258.mp3").play()
     elif rnd == 3:
-        pygame.mixer.Sound("sound/zapsplat_leisure_board_game_dice_throw_roll_on_playing_board_003_37259.mp3").play()
+        get_sound("sound/zapsplat_leisure_board_game_dice_throw_roll_on_playing_board_003_37259.mp3").play()
     elif rnd == 4:
-        pygame.mixer.Sound("sound/zapsplat_leisure_board_game_dice_throw_roll_on_playing_board_004_37260.mp3").play()
+        get_sound("sound/zapsplat_leisure_board_game_dice_throw_roll_on_playing_board_004_37260.mp3").play()
     elif rnd == 5:
-        pygame.mixer.Sound("sound/zapsplat_leisure_board_game_dice_throw_roll_on_playing_board_005_37261.mp3").play()
+        get_sound("sound/zapsplat_leisure_board_game_dice_throw_roll_on_playing_board_005_37261.mp3").play()
     elif rnd == 6:
-        pygame.mixer.Sound("sound/zapsplat_leisure_board_game_dice_throw_roll_on_playing_board_006_37262.mp3").play()
-    # Run animation
-    while num_stopped < num_die or done:
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                done = True
-                face_value = None
-
-        elapsed = time.time() - start_time
-        for n in range(0, num_die):
-            if elapsed > roll_time[n]:
-                dice_stopped[n] = True
-                num_stopped += 1
-            if not dice_stopped[n]:
-                if random.random() > elapsed / roll_time[n]:
-                    face_value[n] = random.randint(1, 6)
-                    draw_die(player, face_value[n], n)
-        clock.tick(TARGET_FPS)
-    logging.info(f"Value(s) rolled: {' and '.join(str(v) for v in face_value)}")
-    return face_value
-
-
-def determine_first_player(first_attempt=True) -> int:
-    # Draw empty board
-    draw_board()
-    pygame.display.update()
-    # Roll dice
-    logging.info("Players to roll one die each; highest score gets to start the game.")
-    x_score = roll_dice(1, PLAYER_X)
-    o_score = roll_dice(1, PLAYER_O)
-    if x_score == o_score:
-        # Same roll for both so try again
-        logging.info(f"Players drew when rolling for first ply.")
-        draw_message("Draw! Roll again!")
-        winning_player = determine_first_player(False)
-    else:
-        if x_score > o_score:
-            winning_player = PLAYER_X
-            player_name = NAME_X
-        else:
-            winning_player = PLAYER_O
-            player_name = NAME_O
-        logging.info(f"Player {winning_player} ({player_name}) to start the game.")
-        draw_declare_starter(winning_player)
-    return winning_player
-
-
-def draw_declare_starter(player: int) -> None:
+        get_sound("sound/zapsplat_leisure_board_game_dice_throw_roll_on_playing_board_006_37262.mp3").play()
+
+
+class DiceRoll:
+    # Dice being rolled, animated one frame at a time by the ROLL_DICE_ANIM state so the main loop keeps running
+    def __init__(self, num_die: int, player: int):
+        logging.debug(f"Rolling {num_die} dice for player {player}")
+        self.player = player
+        # Choose random amount of time for each die to take to settle
+        self.roll_time = [0.5 + random.random() * DICE_ROLL_TIME_RANGE for _ in range(num_die)]
+        self.start_time = time.time()
+        self.face_value = [random.randint(1, 6) for _ in range(num_die)]
+        for n in range(num_die):
+            draw_die(player, self.face_value[n], n)
+        play_dice_sound()
+
+    def update(self) -> bool:
+        # Draws the next frame of the animation; returns True once every die has settled
+        elapsed = time.time() - self.start_time
+        for n in range(len(self.face_value)):
+            if elapsed < self.roll_time[n] and random.random() > elapsed / self.roll_time[n]:
+                self.face_value[n] = random.randint(1, 6)
+                draw_die(self.player, self.face_value[n], n)
+        if elapsed < max(self.roll_time):
+            return False
+        logging.info(f"Value(s) rolled: {' and '.join(str(v) for v in self.face_value)}")
+        return True
+
+
+def draw_declare_starter(player: int) -> float:
     if player == PLAYER_X:
         player_name = NAME_X
     else:
         player_name = NAME_O
-    draw_message(f"{player_name} to start the game!")
+    return draw_message(f"{player_name} to start the game!")
 
 
-def draw_message(text_string: str, long_show=False) -> None:
-    font = pygame.font.SysFont(None, int(RES_Y / 10))
+def draw_message(text_string: str, long_show=False) -> float:
+    # Returns how many seconds the message should stay up; the SHOW_MESSAGE state waits that long before moving on
+    font = get_font(int(RES_Y / 10))
     text = font.render(text_string, True, WHITE)
-    screen.blit(text, [TRI_WIDTH * 2, RES_Y * 0.45])
-    pygame.display.update()
-    time.sleep(MSG_DISPLAY_TIME)
+    mark_dirty(screen.blit(text, [TRI_WIDTH * 2, RES_Y * 0.45]))
     if long_show:
         # Show message for longer
-        time.sleep(MSG_DISPLAY_TIME * 2)
+        return MSG_DISPLAY_TIME * 3
+    return MSG_DISPLAY_TIME
 
 
 def draw_pieces_for_player(player: int, board: List[int], bar: int, removed: int) -> List[Piece]:
@@ -419,370 +457,413 @@ def redraw_dice(remaining_rolls: List[int], player: int):
         draw_die(player, roll, n)
 
 
-def choose_ai_move(g: Game, dice_rolls: List[int], player: int) -> List[Tuple[int, int]]:
-    draw_message("AI thinking")
-    agent = g.players[player]
-    current_board = g.board
-    best_value, best_moves = ai_move_tree_analysis(agent, current_board, dice_rolls, player, [])
-    time.sleep(random.random() * AI_THINK_TIME)
+def choose_ai_move(agent: Union[TDagent, QuantizedNetwork], board: Board, router: EvaluationRouter,
+                   dice_rolls: List[int], player: int, cancel: threading.Event) -> List[Tuple[int, int]]:
+    # Runs on ai_executor's thread, so it must not touch pygame or anything the main loop changes.  Searches deeper for
+    # as long as AI_THINK_TIME allows, or until cancelled, then plays the move from the deepest search completed.
+    search = ExpectimaxSearch(agent, AI_MAX_PLIES, AI_FILTER_WIDTH, router=router)
+    best_value, best_moves, _ = search.iterative_deepening(board, dice_rolls, player, AI_THINK_TIME, cancel)
+    stats = search.stats()
+    logging.debug("AI chose %s with value %.3f after a %d-ply search of %d positions (%.0f nodes/sec)",
+                  best_moves, best_value, stats["completed_plies"], stats["nodes"], stats["nodes_per_sec"])
     return best_moves
 
 
-def ai_move_tree_analysis(agent: TDagent, current_board: Board, available_rolls: List[int], player: int,
-                          prior_moves: List[Tuple[int, int]]) -> Tuple[float, List[Tuple[int, int]]]:
-    logging.debug(f"AI looking for moves subsequent to prior moves {prior_moves}")
-    possible_moves = current_board.permitted_moves(available_rolls, player)
-    if len(possible_moves) == 0:
-        # No valid moves, so return current state
-        logging.debug(f"AI found no valid moves with remaining dice rolls ({available_rolls}")
-        new_state = current_board.encode_features(player)
-        value = agent.assess_features(new_state)
-        return value, prior_moves
-    else:
-        # At least one valid move to look at
-        logging.debug(f"AI examining subsequent moves: {possible_moves}")
-        max_value = -np.inf
-        max_branch = None
-        for move in possible_moves:
-            temp_board = copy.deepcopy(current_board)
-            temp_board.perform_move(*move, player)
-            remaining_rolls = [available_rolls[i] for i in range(len(available_rolls)) if i != available_rolls.index(move[1])]
-            extant_moves = prior_moves + [move]
-            if len(remaining_rolls) > 0:
-                # Still got rolls to do
-                best_subsequent_value, best_subsequent_move_tree = \
-                    ai_move_tree_analysis(agent, temp_board, remaining_rolls, player, extant_moves)
-                if best_subsequent_value > max_value:
-                    max_value = best_subsequent_value
-                    max_branch = best_subsequent_move_tree
-            else:
-                new_state = temp_board.encode_features(player)
-                value = agent.assess_features(new_state)
-                if value > max_value:
-                    max_value = value
-                    max_branch = extant_moves
-        logging.debug(f"AI's best board found so far with score {max_value} on branch {max_branch}")
-        return max_value, max_branch
-
-
 def play_piece_move_sound():
     rnd = random.randint(1, 3)
     if rnd == 1:
-        pygame.mixer.Sound("sound/household_aftershave_bottle_scrape_across_table_1.mp3").play()
+        get_sound("sound/household_aftershave_bottle_scrape_across_table_1.mp3").play()
     elif rnd == 2:
-        pygame.mixer.Sound("sound/household_aftershave_bottle_scrape_across_table_2.mp3").play()
+        get_sound("sound/household_aftershave_bottle_scrape_across_table_2.mp3").play()
     elif rnd == 3:
-        pygame.mixer.Sound("sound/household_aftershave_bottle_scrape_across_table_3.mp3").play()
-
-
-# Configure debugging
-logging.basicConfig(level=logging.DEBUG, format="%(message)s")
-
-# Initialise pygame viewport
-pygame.init()
-screen = pygame.display.set_mode((RES_X, RES_Y))
-pygame.display.set_caption("MRGammon")
-#
-
-# Set up states
-game_state = GameState.WELCOME
-
-done = False
-press_enter = False
-game = None
-game_type = GameType.Undefined
-btn_menu = None
-current_player = 0
-selected_piece = 0
-pieces_x = []
-pieces_o = []
-my_pieces = []
-point_tris = []
-ai_move_list = []
-
-clock = pygame.time.Clock()
-
-# Draw exit button
-btn_quit = draw_exit_button(current_player)
-
-while not done:
-    # Get events
-    all_events = pygame.event.get()
-    for event in all_events:
-        if event.type == pygame.QUIT:
-            done = True
-        elif event.type == pygame.MOUSEBUTTONDOWN:
-            if btn_menu is not None and btn_menu.collidepoint(pygame.mouse.get_pos()):
-                # User clicked to return to main menu
-                logging.info("User clicked 'Main Menu' button")
-                game_state = GameState.WELCOME
-                break
-            if btn_quit is not None and btn_quit.collidepoint(pygame.mouse.get_pos()):
-                logging.info("User clicked 'Exit' button")
-                done = True
-                break
-            if btn_pvp is not None and btn_pvp.collidepoint(pygame.mouse.get_pos()):
-                logging.info("Clicked pvp")
-    if done:
-        break
-
-    # State machine
-    if game_state == GameState.WELCOME:
-        # Draw empty board
-        draw_board()
-        # Draw exit button
-        btn_menu = None
-        btn_quit = draw_exit_button(current_player)
-        # Print welcome message
-        btn_pvp, btn_pve = draw_welcome()
-        # Next state
-        game_state = GameState.WAIT_GAME_CHOICE
-        logging.info("Showing welcome screen")
-
-    elif game_state == GameState.WAIT_GAME_CHOICE:
-        # Detect user choice of game type
-        for event in all_events:
-            if event.type == pygame.MOUSEBUTTONDOWN:
-                if btn_pvp.collidepoint(pygame.mouse.get_pos()):
-                    logging.info("Chosen to play a game of PvP")
-                    game = Game(HumanAgent(), HumanAgent())
-                    game_type = GameType.PvP
-                    game_state = GameState.CHOOSE_FIRST_PLAYER
-                elif btn_pve.collidepoint(pygame.mouse.get_pos()):
-                    logging.info("Chosen to play a game of PvE")
-                    game = Game(HumanAgent(), TDagent())
-                    game_type = GameType.PvE
-                    game_state = GameState.CHOOSE_FIRST_PLAYER
-                if game_type != GameType.Undefined:
-                    logging.debug(f"User enabled game type {game_type}")
-                    # Load the trained AI brain(s)
-                    for plyr, n in zip(game.players, range(0, len(game.players))):
-                        if plyr.__class__.__name__ == "TDagent":
-                            logging.info(f"Loading brain for player {n}")
-                            plyr.load("TDGammon")
-                    break
+        get_sound("sound/household_aftershave_bottle_scrape_across_table_3.mp3").play()
 
-    elif game_state == GameState.CHOOSE_FIRST_PLAYER:
-        btn_quit = None
-        # Randomly choose first player by rolling dice
-        current_player = determine_first_player()
-        # Set player in game logic
-        game.set_player(current_player)
-        game_state = GameState.START_GAME
-
-    elif game_state == GameState.START_GAME:
-        # Populate initial board
-        game.generate_starting_board(False)
-        pieces_x, pieces_o, point_tris = draw_board_and_pieces(game.board.x_board, game.board.o_board,
-                                                               game.board.x_bar, game.board.o_bar,
-                                                               game.board.x_removed, game.board.o_removed)
-        game_state = GameState.PLAYER_ROLL_DICE
-
-    elif game_state == GameState.PLAYER_ROLL_DICE:
-        # Roll dice
-        rolls = roll_dice(2, current_player)
-        if rolls[0] == rolls[1]:
-            # Rolled a double
-            rolls = rolls + rolls
-            # Draw additional dice
-            draw_die(current_player, rolls[0], 2)
-            draw_die(current_player, rolls[0], 3)
-        if game_type == GameType.PvP or current_player == PLAYER_X:  # PLAYER_X is always human
-            logging.debug(f"Human to play (game type {game_type})")
-            game_state = GameState.PLAYER_SELECT_PIECE
-        else:
-            logging.debug(f"AI to play (game type {game_type})")
-            game_state = GameState.AI_SELECT_MOVE
 
-    elif game_state == GameState.PLAYER_SELECT_PIECE:
-        btn_menu = draw_main_menu_button(current_player)
-        if current_player == PLAYER_X:
-            my_pieces = pieces_x
-        else:
-            my_pieces = pieces_o
-        # Check that there are any possible legal moves
-        if len(game.board.permitted_moves(rolls, current_player)) == 0:
-            # Skip to next player
-            draw_message("No valid moves available!")
-            game_state = GameState.CHECK_GAME_END
-        # Wait for user to choose piece to move
-        for event in all_events:
-            if event.type == pygame.MOUSEBUTTONDOWN:
-                for piece in my_pieces:
-                    if piece.rect.collidepoint(pygame.mouse.get_pos()):
-                        # Clicked on a piece
-                        logging.info(f"Selected {piece.position_at_point}th piece at player point "
-                                     f"{piece.player_point}")
-                        piece.select()
-                        selected_piece = piece
-                        game_state = GameState.PLAYER_SELECT_DEST
-                        break
-                else:
-                    continue
+def main():
+    # Configure debugging
+    logging.basicConfig(level=logging.DEBUG, format="%(message)s")
+
+    # Initialise pygame viewport
+    init_display()
+
+    # Set up states
+    game_state = GameState.WELCOME
+
+    done = False
+    press_enter = False
+    game = None
+    game_type = GameType.Undefined
+    btn_menu = None
+    btn_pvp = None
+    btn_pve = None
+    current_player = 0
+    selected_piece = 0
+    pieces_x = []
+    pieces_o = []
+    my_pieces = []
+    point_tris = []
+    ai_move_list = []
+    dice_roll = None
+    after_dice = None  # State to go to once dice_roll has settled
+    message_until = 0.0
+    after_message = None  # State to go to once the message has been up for long enough
+    # The AI searches on a worker thread while the main loop keeps drawing frames and handling events
+    ai_executor = ThreadPoolExecutor(max_workers=1)
+    ai_future = None
+    ai_cancel = None
+
+    clock = pygame.time.Clock()
 
-    elif game_state == GameState.PLAYER_SELECT_DEST:
-        btn_menu = draw_main_menu_button(current_player)
-        # Wait for user to choose destination
+    # Draw exit button
+    btn_quit = draw_exit_button(current_player)
+
+    while not done:
+        # Get events
+        all_events = pygame.event.get()
         for event in all_events:
-            if event.type == pygame.MOUSEBUTTONDOWN:
-                for piece in my_pieces:
-                    if piece.rect.collidepoint(pygame.mouse.get_pos()) and piece.is_selected:
-                        # Player wants to unselect piece
-                        piece.deselect()
-                        selected_piece = None
-                        game_state = GameState.PLAYER_SELECT_PIECE
-                for tri in point_tris:
-                    if tri.rect.collidepoint(pygame.mouse.get_pos()) and selected_piece is not None:
-                        # Clicked on a triangle point with a piece selected
-                        # Check if the distance to the point is equal to one of the remaining dice rolls
-                        start_pos_player = selected_piece.player_point
-                        start_pos_global = convert_coords_to_global(start_pos_player, current_player)
-                        if current_player == PLAYER_X:
-                            move_direction = 1
-                            dest_pos = tri.point_x
-                        else:
-                            move_direction = -1
-                            dest_pos = tri.point_o
-                        logging.info(f"Clicked on triangle at player point {dest_pos}")
-                        move_distance = dest_pos - start_pos_player
-                        logging.info(f"Proposed move would be a distance of {move_distance}")
-                        if move_distance in rolls:
-                            # Can make that move according to dice, but still need to check that it's a legal move
-                            # selected_point = tri
-                            logging.info(f"Proposed move can use a dice roll")
-                            # Check to see if move is permitted (e.g. not blocked by double-stack)
-                            if start_pos_player == BAR_INDEX:
-                                start_pos_player = "bar"  # convert to board.Board() implementation
-                            if game.board.move_permitted(start_pos_player, move_distance, current_player):
-                                logging.info(f"Proposed move is considered permitted by game mechanics")
-                                old_board = copy.deepcopy(game.board)
-                                game.board.perform_move(start_pos_player, move_distance, current_player)
-                                rolls = update_dice_after_move(rolls, move_distance)
-                                game_state = GameState.SETUP_PIECE_ANIM
-                            else:
-                                logging.info(f"Move is not permitted by game mechanics")
+            if event.type == pygame.QUIT:
+                done = True
+            elif event.type == pygame.MOUSEBUTTONDOWN:
+                if btn_menu is not None and btn_menu.collidepoint(pygame.mouse.get_pos()):
+                    # User clicked to return to main menu
+                    logging.info("User clicked 'Main Menu' button")
+                    if ai_future is not None:
+                        # Abandon the AI's search; its result is never collected
+                        ai_cancel.set()
+                        ai_future = None
+                    ai_move_list = []
+                    game_state = GameState.WELCOME
+                    break
+                if btn_quit is not None and btn_quit.collidepoint(pygame.mouse.get_pos()):
+                    logging.info("User clicked 'Exit' button")
+                    done = True
+                    break
+                if btn_pvp is not None and btn_pvp.collidepoint(pygame.mouse.get_pos()):
+                    logging.info("Clicked pvp")
+        if done:
+            break
+
+        # State machine
+        if game_state == GameState.WELCOME:
+            # Draw empty board
+            draw_board()
+            # Draw exit button
+            btn_menu = None
+            btn_quit = draw_exit_button(current_player)
+            # Print welcome message
+            btn_pvp, btn_pve = draw_welcome()
+            # Next state
+            game_state = GameState.WAIT_GAME_CHOICE
+            logging.info("Showing welcome screen")
+
+        elif game_state == GameState.WAIT_GAME_CHOICE:
+            # Detect user choice of game type
+            for event in all_events:
+                if event.type == pygame.MOUSEBUTTONDOWN:
+                    if btn_pvp.collidepoint(pygame.mouse.get_pos()):
+                        logging.info("Chosen to play a game of PvP")
+                        game = Game(HumanAgent(), HumanAgent())
+                        game_type = GameType.PvP
+                        game_state = GameState.CHOOSE_FIRST_PLAYER
+                    elif btn_pve.collidepoint(pygame.mouse.get_pos()):
+                        logging.info("Chosen to play a game of PvE")
+                        ai = QuantizedNetwork.load(AI_QUANTIZED_MODEL) if AI_QUANTIZED_MODEL \
+                            else TDagent(cache_size=AI_CACHE_SIZE)
+                        game = Game(HumanAgent(), ai,
+                                    router=EvaluationRouter(load_database(BEAROFF_PATH)))
+                        game_type = GameType.PvE
+                        game_state = GameState.CHOOSE_FIRST_PLAYER
+                    if game_type != GameType.Undefined:
+                        logging.debug(f"User enabled game type {game_type}")
+                        # Load the trained AI brain(s)
+                        for plyr, n in zip(game.players, range(0, len(game.players))):
+                            if plyr.__class__.__name__ == "TDagent":
+                                logging.info(f"Loading brain for player {n}")
+                                plyr.load("TDGammon")
                         break
 
-    elif game_state == GameState.AI_SELECT_MOVE:
-        logging.info("AI player given control")
-        # Let AI look at all possible moves and choose favourite
-        if len(ai_move_list) == 0:
-            # Just started AI move so need to work out list of moves
-            logging.debug(f"AI plotting moves for turn")
-            ai_move_list = choose_ai_move(game, rolls, current_player)
-        if len(ai_move_list) == 0 and len(rolls) > 0:
-            # If still no moves in list, but rolls remain, then there are no valid moves this round
-            draw_message("No valid moves available!")
-            # TODO this gets drawn over by another message
-            game_state = GameState.CHECK_GAME_END
-        else:
-            logging.debug(f"Moves planned by AI: {ai_move_list} from dice rolls {rolls}")
-            old_board = copy.deepcopy(game.board)
-            start_pos_player, move_distance = ai_move_list.pop(0)
-            logging.debug(f"AI now performing move (with anim): piece at {start_pos_player}, moving {move_distance} pips")
-            game.board.perform_move(start_pos_player, move_distance, current_player)
-            rolls = update_dice_after_move(rolls, move_distance)
-            logging.debug(f"Rolls left after this animation: {rolls}")
-            game_state = GameState.SETUP_PIECE_ANIM
-
-    elif game_state == GameState.SETUP_PIECE_ANIM:
-        logging.debug(f" Start pos player: {start_pos_player}")
-        new_board = game.board
-        if current_player == PLAYER_X:
-            if start_pos_player == "bar":
-                start_pos_player = BAR_INDEX
-                occupancy_origin = old_board.x_bar
-                old_board.x_bar -= 1
-            else:
-                occupancy_origin = old_board.x_board[start_pos_player]
-                old_board.x_board[start_pos_player] -= 1  # take the piece away
-            if start_pos_player + move_distance == HOME_INDEX:
-                occupancy_dest = new_board.x_removed
+        elif game_state == GameState.CHOOSE_FIRST_PLAYER:
+            btn_quit = None
+            # Randomly choose first player by rolling dice
+            draw_board()
+            logging.info("Players to roll one die each; highest score gets to start the game.")
+            dice_roll = DiceRoll(1, PLAYER_X)
+            after_dice = GameState.FIRST_ROLL_O
+            game_state = GameState.ROLL_DICE_ANIM
+
+        elif game_state == GameState.FIRST_ROLL_O:
+            x_score = dice_roll.face_value[0]
+            dice_roll = DiceRoll(1, PLAYER_O)
+            after_dice = GameState.FIRST_PLAYER_CHOSEN
+            game_state = GameState.ROLL_DICE_ANIM
+
+        elif game_state == GameState.FIRST_PLAYER_CHOSEN:
+            o_score = dice_roll.face_value[0]
+            if x_score == o_score:
+                # Same roll for both so try again
+                logging.info(f"Players drew when rolling for first ply.")
+                message_until = time.time() + draw_message("Draw! Roll again!")
+                after_message = GameState.CHOOSE_FIRST_PLAYER
             else:
-                occupancy_dest = new_board.x_board[start_pos_player + move_distance]
-        else:
-            if start_pos_player == "bar":
-                start_pos_player = BAR_INDEX
-                occupancy_origin = old_board.o_bar
-                old_board.o_bar -= 1
-            else:
-                occupancy_origin = old_board.o_board[start_pos_player]
-                old_board.o_board[start_pos_player] -= 1  # take the piece away
-            if start_pos_player + move_distance == HOME_INDEX:
-                occupancy_dest = new_board.o_removed
-            else:
-                occupancy_dest = new_board.o_board[start_pos_player + move_distance]
-        draw_board_and_pieces(old_board.x_board, old_board.o_board, old_board.x_bar, old_board.o_bar,
-                              old_board.x_removed, old_board.o_removed)
-        piece_origin = Piece(start_pos_player, occupancy_origin, current_player, draw=False)
-        piece_dest = Piece(start_pos_player + move_distance, occupancy_dest, current_player, draw=False)
-        x_origin, y_origin = piece_origin.determine_piece_draw_position()
-        x_dest, y_dest = piece_dest.determine_piece_draw_position()
-        anim_frame = 0
-        game_state = GameState.DRAW_PIECE_ANIM
-        logging.debug(f"{x_origin} to {x_dest} and {y_origin} to {y_dest}")
-        play_piece_move_sound()
-
-    elif game_state == GameState.DRAW_PIECE_ANIM:
-        x_draw = (x_dest - x_origin) / MOVE_ANIM_FRAMES * anim_frame + x_origin
-        y_draw = (y_dest - y_origin) / MOVE_ANIM_FRAMES * anim_frame + y_origin
-        anim_frame += 1
-        # logging.debug(f"Anim frame {anim_frame}: {x_draw}, {y_draw}")
-        draw_board_and_pieces(old_board.x_board, old_board.o_board, old_board.x_bar, old_board.o_bar,
-                              old_board.x_removed, old_board.o_removed)
-        piece_dest.draw_piece(manual_position=(x_draw, y_draw))
-        if anim_frame < MOVE_ANIM_FRAMES:
-            # Continue animation
-            game_state = GameState.DRAW_PIECE_ANIM
-        elif len(rolls) > 0:
-            # Continue player turn
+                if x_score > o_score:
+                    current_player = PLAYER_X
+                else:
+                    current_player = PLAYER_O
+                logging.info(f"Player {current_player} ({NAME_X if current_player == PLAYER_X else NAME_O}) to start "
+                             f"the game.")
+                # Set player in game logic
+                game.set_player(current_player)
+                message_until = time.time() + draw_declare_starter(current_player)
+                after_message = GameState.START_GAME
+            game_state = GameState.SHOW_MESSAGE
+
+        elif game_state == GameState.ROLL_DICE_ANIM:
+            if dice_roll.update():
+                game_state = after_dice
+
+        elif game_state == GameState.SHOW_MESSAGE:
+            if time.time() >= message_until:
+                game_state = after_message
+
+        elif game_state == GameState.START_GAME:
+            # Populate initial board
+            game.generate_starting_board(False)
             pieces_x, pieces_o, point_tris = draw_board_and_pieces(game.board.x_board, game.board.o_board,
-                                  game.board.x_bar, game.board.o_bar,
-                                  game.board.x_removed, game.board.o_removed)
-            redraw_dice(rolls, current_player)
-            if game.players[current_player].__class__.__name__ == "TDagent":
-                game_state = GameState.AI_SELECT_MOVE
-            else:
+                                                                   game.board.x_bar, game.board.o_bar,
+                                                                   game.board.x_removed, game.board.o_removed)
+            game_state = GameState.PLAYER_ROLL_DICE
+
+        elif game_state == GameState.PLAYER_ROLL_DICE:
+            # Roll dice
+            dice_roll = DiceRoll(2, current_player)
+            after_dice = GameState.PLAYER_DICE_ROLLED
+            game_state = GameState.ROLL_DICE_ANIM
+
+        elif game_state == GameState.PLAYER_DICE_ROLLED:
+            rolls = dice_roll.face_value
+            if rolls[0] == rolls[1]:
+                # Rolled a double
+                rolls = rolls + rolls
+                # Draw additional dice
+                draw_die(current_player, rolls[0], 2)
+                draw_die(current_player, rolls[0], 3)
+            if game_type == GameType.PvP or current_player == PLAYER_X:  # PLAYER_X is always human
+                logging.debug(f"Human to play (game type {game_type})")
                 game_state = GameState.PLAYER_SELECT_PIECE
-        else:
-            # Player turn ended
-            game_state = GameState.CHECK_GAME_END
-
-    elif game_state == GameState.CHECK_GAME_END:
-        # Check to see if the game has ended before passing to next player
-        pieces_x, pieces_o, point_tris = draw_board_and_pieces(game.board.x_board, game.board.o_board,
-                                                               game.board.x_bar, game.board.o_bar,
-                                                               game.board.x_removed, game.board.o_removed)
-        if game.board.game_won(current_player):
-            if current_player == PLAYER_X:
-                player_name = NAME_X
             else:
-                player_name = NAME_O
-            if game.players[current_player].__class__.__name__ == "HumanAgent":
-                pygame.mixer.Sound("sound/sound_ex_machina_Applause,+Clapping,+Crowd+Ambience.mp3").play()
-            elif game.players[current_player].__class__.__name__ == "TDagent":
-                pygame.mixer.Sound("sound/zapsplat_science_fiction_robot_big_glitch_44020.mp3").play()
-            draw_message(f"{player_name} has won the game!", long_show=True)
-            game_state = GameState.WELCOME
-        else:
-            game_state = GameState.CHANGE_PLAYER
+                logging.debug(f"AI to play (game type {game_type})")
+                game_state = GameState.AI_SELECT_MOVE
 
-    elif game_state == GameState.CHANGE_PLAYER:
-        current_player = 1 - current_player
-        game.set_player(current_player)
-        game_state = GameState.PLAYER_ROLL_DICE
+        elif game_state == GameState.PLAYER_SELECT_PIECE:
+            btn_menu = draw_main_menu_button(current_player)
+            if current_player == PLAYER_X:
+                my_pieces = pieces_x
+            else:
+                my_pieces = pieces_o
+            # Check that there are any possible legal moves
+            if not game.board.has_any_legal_move(rolls, current_player):
+                # Skip to next player
+                message_until = time.time() + draw_message("No valid moves available!")
+                after_message = GameState.CHECK_GAME_END
+                game_state = GameState.SHOW_MESSAGE
+            # Wait for user to choose piece to move
+            for event in all_events:
+                if event.type == pygame.MOUSEBUTTONDOWN:
+                    for piece in my_pieces:
+                        if piece.rect.collidepoint(pygame.mouse.get_pos()):
+                            # Clicked on a piece
+                            logging.info(f"Selected {piece.position_at_point}th piece at player point "
+                                         f"{piece.player_point}")
+                            piece.select()
+                            selected_piece = piece
+                            game_state = GameState.PLAYER_SELECT_DEST
+                            break
+                    else:
+                        continue
+
+        elif game_state == GameState.PLAYER_SELECT_DEST:
+            btn_menu = draw_main_menu_button(current_player)
+            # Wait for user to choose destination
+            for event in all_events:
+                if event.type == pygame.MOUSEBUTTONDOWN:
+                    for piece in my_pieces:
+                        if piece.rect.collidepoint(pygame.mouse.get_pos()) and piece.is_selected:
+                            # Player wants to unselect piece
+                            piece.deselect()
+                            selected_piece = None
+                            game_state = GameState.PLAYER_SELECT_PIECE
+                    for tri in point_tris:
+                        if tri.rect.collidepoint(pygame.mouse.get_pos()) and selected_piece is not None:
+                            # Clicked on a triangle point with a piece selected
+                            # Check if the distance to the point is equal to one of the remaining dice rolls
+                            start_pos_player = selected_piece.player_point
+                            start_pos_global = convert_coords_to_global(start_pos_player, current_player)
+                            if current_player == PLAYER_X:
+                                move_direction = 1
+                                dest_pos = tri.point_x
+                            else:
+                                move_direction = -1
+                                dest_pos = tri.point_o
+                            logging.info(f"Clicked on triangle at player point {dest_pos}")
+                            move_distance = dest_pos - start_pos_player
+                            logging.info(f"Proposed move would be a distance of {move_distance}")
+                            if move_distance in rolls:
+                                # Can make that move according to dice, but still need to check that it's a legal move
+                                # selected_point = tri
+                                logging.info(f"Proposed move can use a dice roll")
+                                # Check to see if move is permitted (e.g. not blocked by double-stack)
+                                if game.board.move_permitted(start_pos_player, move_distance, current_player):
+                                    logging.info(f"Proposed move is considered permitted by game mechanics")
+                                    old_board = game.board.clone()
+                                    game.board.perform_move(start_pos_player, move_distance, current_player)
+                                    rolls = update_dice_after_move(rolls, move_distance)
+                                    game_state = GameState.SETUP_PIECE_ANIM
+                                else:
+                                    logging.info(f"Move is not permitted by game mechanics")
+                            break
+
+        elif game_state == GameState.AI_SELECT_MOVE:
+            logging.info("AI player given control")
+            # Let AI look at all possible moves and choose favourite
+            if len(ai_move_list) == 0:
+                # Just started AI move so need to work out list of moves, which happens on the worker thread
+                logging.debug(f"AI plotting moves for turn")
+                draw_message("AI thinking")
+                ai_cancel = threading.Event()
+                ai_future = ai_executor.submit(choose_ai_move, game.players[current_player], game.board.clone(),
+                                               game.router, list(rolls), current_player, ai_cancel)
+                game_state = GameState.AI_THINKING
+            else:
+                logging.debug(f"Moves planned by AI: {ai_move_list} from dice rolls {rolls}")
+                old_board = game.board.clone()
+                start_pos_player, move_distance = ai_move_list.pop(0)
+                logging.debug(f"AI now performing move (with anim): piece at {start_pos_player}, moving {move_distance} pips")
+                game.board.perform_move(start_pos_player, move_distance, current_player)
+                rolls = update_dice_after_move(rolls, move_distance)
+                logging.debug(f"Rolls left after this animation: {rolls}")
+                game_state = GameState.SETUP_PIECE_ANIM
+
+        elif game_state == GameState.AI_THINKING:
+            if ai_future.done():
+                ai_move_list = ai_future.result()
+                ai_future = None
+                if len(ai_move_list) == 0:
+                    # If still no moves in list, but rolls remain, then there are no valid moves this round
+                    pieces_x, pieces_o, point_tris = draw_board_and_pieces(game.board.x_board, game.board.o_board,
+                                                                           game.board.x_bar, game.board.o_bar,
+                                                                           game.board.x_removed, game.board.o_removed)
+                    redraw_dice(rolls, current_player)
+                    message_until = time.time() + draw_message("No valid moves available!")
+                    after_message = GameState.CHECK_GAME_END
+                    game_state = GameState.SHOW_MESSAGE
+                else:
+                    game_state = GameState.AI_SELECT_MOVE
 
-    else:
-        # Default state
-        logging.error(f"Unrecognised game state: {game_state}.")
-        game_state = GameState.WELCOME
+        elif game_state == GameState.SETUP_PIECE_ANIM:
+            logging.debug(f" Start pos player: {start_pos_player}")
+            new_board = game.board
+            if current_player == PLAYER_X:
+                if start_pos_player == BAR_INDEX:
+                    occupancy_origin = old_board.x_bar
+                    old_board.x_bar -= 1
+                else:
+                    occupancy_origin = old_board.x_board[start_pos_player]
+                    old_board.set_board(PLAYER_X, start_pos_player, -1)  # take the piece away
+                if start_pos_player + move_distance == HOME_INDEX:
+                    occupancy_dest = new_board.x_removed
+                else:
+                    occupancy_dest = new_board.x_board[start_pos_player + move_distance]
+            else:
+                if start_pos_player == BAR_INDEX:
+                    occupancy_origin = old_board.o_bar
+                    old_board.o_bar -= 1
+                else:
+                    occupancy_origin = old_board.o_board[start_pos_player]
+                    old_board.set_board(PLAYER_O, start_pos_player, -1)  # take the piece away
+                if start_pos_player + move_distance == HOME_INDEX:
+                    occupancy_dest = new_board.o_removed
+                else:
+                    occupancy_dest = new_board.o_board[start_pos_player + move_distance]
+            draw_board_and_pieces(old_board.x_board, old_board.o_board, old_board.x_bar, old_board.o_bar,
+                                  old_board.x_removed, old_board.o_removed)
+            piece_origin = Piece(start_pos_player, occupancy_origin, current_player, draw=False)
+            piece_dest = Piece(start_pos_player + move_distance, occupancy_dest, current_player, draw=False)
+            x_origin, y_origin = piece_origin.determine_piece_draw_position()
+            x_dest, y_dest = piece_dest.determine_piece_draw_position()
+            # The moving piece is drawn over a copy of the board without it, so each frame only has to put back the
+            # area it covered in the previous frame
+            anim_background = screen.copy()
+            anim_rect = None
+            anim_frame = 0
+            game_state = GameState.DRAW_PIECE_ANIM
+            logging.debug(f"{x_origin} to {x_dest} and {y_origin} to {y_dest}")
+            play_piece_move_sound()
+
+        elif game_state == GameState.DRAW_PIECE_ANIM:
+            x_draw = (x_dest - x_origin) / MOVE_ANIM_FRAMES * anim_frame + x_origin
+            y_draw = (y_dest - y_origin) / MOVE_ANIM_FRAMES * anim_frame + y_origin
+            anim_frame += 1
+            # logging.debug(f"Anim frame {anim_frame}: {x_draw}, {y_draw}")
+            if anim_rect is not None:
+                screen.blit(anim_background, anim_rect, anim_rect)
+                mark_dirty(anim_rect)
+            anim_rect = piece_dest.draw_piece(manual_position=(x_draw, y_draw))
+            if anim_frame < MOVE_ANIM_FRAMES:
+                # Continue animation
+                game_state = GameState.DRAW_PIECE_ANIM
+            elif len(rolls) > 0:
+                # Continue player turn
+                pieces_x, pieces_o, point_tris = draw_board_and_pieces(game.board.x_board, game.board.o_board,
+                                      game.board.x_bar, game.board.o_bar,
+                                      game.board.x_removed, game.board.o_removed)
+                redraw_dice(rolls, current_player)
+                if game.players[current_player].__class__.__name__ != "HumanAgent":
+                    game_state = GameState.AI_SELECT_MOVE
+                else:
+                    game_state = GameState.PLAYER_SELECT_PIECE
+            else:
+                # Player turn ended
+                game_state = GameState.CHECK_GAME_END
 
-    # Update the screen
-    pygame.display.update()
-    clock.tick(TARGET_FPS)
+        elif game_state == GameState.CHECK_GAME_END:
+            # Check to see if the game has ended before passing to next player
+            pieces_x, pieces_o, point_tris = draw_board_and_pieces(game.board.x_board, game.board.o_board,
+                                                                   game.board.x_bar, game.board.o_bar,
+                                                                   game.board.x_removed, game.board.o_removed)
+            if game.board.game_won(current_player):
+                if current_player == PLAYER_X:
+                    player_name = NAME_X
+                else:
+                    player_name = NAME_O
+                if game.players[current_player].__class__.__name__ == "HumanAgent":
+                    get_sound("sound/sound_ex_machina_Applause,+Clapping,+Crowd+Ambience.mp3").play()
+                else:
+                    get_sound("sound/zapsplat_science_fiction_robot_big_glitch_44020.mp3").play()
+                message_until = time.time() + draw_message(f"{player_name} has won the game!", long_show=True)
+                after_message = GameState.WELCOME
+                game_state = GameState.SHOW_MESSAGE
+            else:
+                game_state = GameState.CHANGE_PLAYER
 
+        elif game_state == GameState.CHANGE_PLAYER:
+            current_player = 1 - current_player
+            game.set_player(current_player)
+            game_state = GameState.PLAYER_ROLL_DICE
 
+        else:
+            # Default state
+            logging.error(f"Unrecognised game state: {game_state}.")
+            game_state = GameState.WELCOME
 
+        # Update the parts of the screen that have been drawn on
+        update_display()
+        clock.tick(TARGET_FPS)
 
+    # Stop any search still running so the worker thread can finish
+    if ai_cancel is not None:
+        ai_cancel.set()
+    ai_executor.shutdown()
 
 
+if __name__ == '__main__':
+    main()
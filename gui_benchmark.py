@@ -0,0 +1,76 @@
+# Frame times of the GUI's drawing, with SDL's dummy video driver so it runs headless, e.g. on a build machine:
+#   python gui_benchmark.py --frames 300
+# Nothing reaches a real window, so the times cover drawing to the screen surface, not copying it to the display.
+import os
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+import argparse
+import time
+from typing import Callable, Dict
+import pygame
+import gui
+from board import Board, PLAYER_X
+
+
+def _time_frames(draw_frame: Callable[[int], None], frames: int) -> Dict[str, float]:
+    start_time = time.perf_counter()
+    for frame in range(frames):
+        draw_frame(frame)
+        gui.update_display()
+    elapsed = time.perf_counter() - start_time
+    return {"ms_per_frame": elapsed / frames * 1000, "fps": frames / elapsed}
+
+
+def run_benchmarks(frames: int) -> Dict[str, Dict[str, float]]:
+    board = Board(False)
+    pieces = (board.x_board, board.o_board, board.x_bar, board.o_bar, board.x_removed, board.o_removed)
+    results = {}
+
+    # What every frame of a piece moving used to cost: the whole board drawn from scratch and pushed to the window
+    surface = pygame.Surface(gui.screen.get_size())
+
+    def uncached_frame(frame: int) -> None:
+        gui.render_board(surface)
+        gui.screen.blit(surface, (0, 0))
+        gui.draw_pieces_for_player(gui.PLAYER_X, *pieces[0::2])
+        gui.draw_pieces_for_player(gui.PLAYER_O, *pieces[1::2])
+        gui.mark_dirty(gui.screen.get_rect())
+    results["full redraw, board rendered"] = _time_frames(uncached_frame, frames)
+
+    # The whole board and pieces redrawn from the cached board, as after each move
+    results["full redraw, cached board"] = _time_frames(lambda frame: gui.draw_board_and_pieces(*pieces), frames)
+
+    # A piece moving across the board, as in DRAW_PIECE_ANIM
+    gui.draw_board_and_pieces(*pieces)
+    gui.update_display()
+    background = gui.screen.copy()
+    piece = gui.Piece(0, 1, PLAYER_X, draw=False)
+    x_origin, y_origin = piece.determine_piece_draw_position()
+    last_rect = [None]
+
+    def animation_frame(frame: int) -> None:
+        if last_rect[0] is not None:
+            gui.screen.blit(background, last_rect[0], last_rect[0])
+            gui.mark_dirty(last_rect[0])
+        fraction = frame % gui.MOVE_ANIM_FRAMES / gui.MOVE_ANIM_FRAMES
+        last_rect[0] = piece.draw_piece(manual_position=(x_origin + fraction * gui.RES_X / 2, y_origin))
+    results["piece animation, dirty rects"] = _time_frames(animation_frame, frames)
+
+    # Dice changing face while they roll
+    results["dice roll"] = _time_frames(lambda frame: [gui.draw_die(PLAYER_X, (frame + n) % 6 + 1, n)
+                                                       for n in range(2)], frames)
+    # A frame where nothing changes, such as while the AI thinks
+    results["idle"] = _time_frames(lambda frame: None, frames)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Time the GUI's frames without a display")
+    parser.add_argument("--frames", type=int, default=300, help="Frames to time for each benchmark")
+    args = parser.parse_args()
+
+    gui.init_display()
+    print(f"Target: {1000 / gui.TARGET_FPS:.1f} ms per frame ({gui.TARGET_FPS} fps)")
+    for name, result in run_benchmarks(args.frames).items():
+        print(f"{name:32s} {result['ms_per_frame']:8.3f} ms/frame {result['fps']:10.0f} fps")
+    pygame.quit()
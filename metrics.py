@@ -0,0 +1,105 @@
+# Low-overhead per-game metrics for long training runs.  Games are recorded into a bounded ring buffer and written out
+# to CSV or JSONL by a background thread, so the training loop never waits on the disk.
+import csv
+import json
+import logging
+import threading
+from collections import deque
+from typing import Dict, Optional
+
+
+class MetricsSink:
+    def __init__(self, path: Optional[str] = None, window: int = 100, buffer_size: int = 4096,
+                 flush_interval: float = 1.0):
+        # path: output file, written as CSV if it ends in ".csv" and as JSON lines otherwise (None to keep no file)
+        # window: number of recent games used for the rolling win rate
+        # buffer_size: records held waiting for the writer; the oldest are dropped if the writer falls this far behind
+        self.path = path
+        self.window = window
+        self.flush_interval = flush_interval
+        self.games = 0
+        self.total_steps = 0
+        self.dropped = 0
+        self._recent_winners = deque(maxlen=window)
+        self._recent_wins = [0, 0]
+        self._pending = deque(maxlen=buffer_size)
+        self._stop = threading.Event()
+        self._file = None
+        self._csv_writer = None
+        self._thread = None
+        if path is not None:
+            self._file = open(path, "a", newline="")
+            self._thread = threading.Thread(target=self._writer_loop, name="MetricsSink", daemon=True)
+            self._thread.start()
+
+    def record_game(self, winner: int, steps: int, **stats) -> Dict:
+        # Called once per game from the training loop.  Only appends to bounded containers.
+        if len(self._recent_winners) == self.window:
+            self._recent_wins[self._recent_winners[0]] -= 1
+        self._recent_winners.append(winner)
+        self._recent_wins[winner] += 1
+        self.games += 1
+        self.total_steps += steps
+        record = {"game": self.games, "winner": winner, "steps": steps, **stats,
+                  "rolling_win_rate": self.rolling_win_rate(0)}
+        if self._file is not None:
+            if len(self._pending) == self._pending.maxlen:
+                self.dropped += 1
+            self._pending.append(record)
+        return record
+
+    def rolling_win_rate(self, player: int = 0) -> float:
+        # Share of the last `window` games won by the player
+        if len(self._recent_winners) == 0:
+            return 0.0
+        return self._recent_wins[player] / len(self._recent_winners)
+
+    def get_state(self) -> Dict:
+        return {"games": self.games, "total_steps": self.total_steps, "recent_winners": list(self._recent_winners)}
+
+    def set_state(self, state: Dict) -> None:
+        self.games = state["games"]
+        self.total_steps = state["total_steps"]
+        self._recent_winners.clear()
+        self._recent_wins = [0, 0]
+        for winner in state["recent_winners"][-self.window:]:
+            self._recent_winners.append(winner)
+            self._recent_wins[winner] += 1
+
+    def _write_pending(self) -> None:
+        lines = 0
+        while len(self._pending) > 0:
+            record = self._pending.popleft()
+            if self.path.endswith(".csv"):
+                if self._csv_writer is None:
+                    self._csv_writer = csv.DictWriter(self._file, fieldnames=list(record), extrasaction="ignore")
+                    if self._file.tell() == 0:
+                        self._csv_writer.writeheader()
+                self._csv_writer.writerow(record)
+            else:
+                self._file.write(json.dumps(record) + "\n")
+            lines += 1
+        if lines > 0:
+            self._file.flush()
+
+    def _writer_loop(self) -> None:
+        while not self._stop.wait(self.flush_interval):
+            self._write_pending()
+        self._write_pending()
+
+    def close(self) -> None:
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self.dropped > 0:
+            logging.warning("Metrics writer fell behind; %d game records were dropped", self.dropped)
+
+    def __enter__(self) -> "MetricsSink":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
@@ -0,0 +1,169 @@
+from typing import List, Tuple
+import numpy as np
+
+
+def _sigmoid(x: np.ndarray, out: np.ndarray) -> np.ndarray:
+    np.negative(x, out=out)
+    np.exp(out, out=out)
+    out += 1
+    np.reciprocal(out, out=out)
+    return out
+
+
+class NumpyNetwork:
+    # Pure NumPy copy of TDagent's Keras model (num_features -> num_hidden sigmoid -> 1 sigmoid), including the
+    # TD(lambda) update performed by TDagent.update_model.  All per-step work happens in preallocated float32 arrays.
+    def __init__(self, num_features: int, num_hidden: int):
+        self.num_features = num_features
+        self.num_hidden = num_hidden
+        # Same ordering as tf.keras.Model.get_weights(): hidden kernel, hidden bias, output kernel, output bias
+        self.weights = [np.zeros((num_features, num_hidden), dtype=np.float32),
+                        np.zeros(num_hidden, dtype=np.float32),
+                        np.zeros((num_hidden, 1), dtype=np.float32),
+                        np.zeros(1, dtype=np.float32)]
+        self.trace = [np.zeros_like(w) for w in self.weights]
+        self._grads = [np.zeros_like(w) for w in self.weights]
+        self._step = [np.zeros_like(w) for w in self.weights]
+        self._x = np.zeros((1, num_features), dtype=np.float32)
+        self._z1 = np.zeros((1, num_hidden), dtype=np.float32)
+        self._h = np.zeros((1, num_hidden), dtype=np.float32)
+        self._z2 = np.zeros((1, 1), dtype=np.float32)
+        self._v = np.zeros((1, 1), dtype=np.float32)
+
+    def get_weights(self) -> List[np.ndarray]:
+        return [w.copy() for w in self.weights]
+
+    def set_weights(self, weights: List[np.ndarray]) -> None:
+        for mine, theirs in zip(self.weights, weights):
+            mine[...] = theirs
+
+    def reset_trace(self) -> None:
+        for t in self.trace:
+            t.fill(0)
+
+    def predict(self, features_matrix: np.ndarray) -> np.ndarray:
+        return self.predict_with_hidden(features_matrix)[0]
+
+    def predict_with_hidden(self, features_matrix: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        # predict(), also returning the hidden layer's activations so a row's gradient needs no second forward pass
+        w1, b1, w2, b2 = self.weights
+        hidden = np.dot(np.asarray(features_matrix, dtype=np.float32), w1)
+        hidden += b1
+        _sigmoid(hidden, hidden)
+        output = np.dot(hidden, w2)
+        output += b2
+        return _sigmoid(output, output)[:, 0], hidden
+
+    def _forward_single(self, state: np.ndarray) -> float:
+        w1, b1, w2, b2 = self.weights
+        self._x[...] = state
+        np.dot(self._x, w1, out=self._z1)
+        self._z1 += b1
+        _sigmoid(self._z1, self._h)
+        np.dot(self._h, w2, out=self._z2)
+        self._z2 += b2
+        _sigmoid(self._z2, self._v)
+        return float(self._v[0, 0])
+
+    def value_and_gradient(self, state: np.ndarray) -> float:
+        # Forward pass for one position, leaving d(value)/d(weights) in self._grads
+        value = self._forward_single(state)
+        self._gradient(self._x[0], self._h[0], value)
+        return value
+
+    def _gradient(self, features: np.ndarray, hidden: np.ndarray, value: float) -> None:
+        # Backward pass for one position, from its features and forward pass activations, into self._grads
+        g_w1, g_b1, g_w2, g_b2 = self._grads
+        d_output = value * (1 - value)
+        g_b2[0] = d_output
+        np.multiply(hidden, d_output, out=g_w2[:, 0])
+        # Back-propagate through the hidden sigmoid: d_hidden = d_output * w2 * h * (1 - h)
+        np.multiply(self.weights[2][:, 0], d_output, out=g_b1)
+        g_b1 *= hidden
+        g_b1 *= 1 - hidden
+        np.outer(features, g_b1, out=g_w1)
+
+    def fit_batch(self, features_matrix: np.ndarray, targets: np.ndarray, alpha: float) -> float:
+        # One gradient step of alpha on half the mean squared error between the values of the rows and their targets;
+        # returns that loss from before the step
+        w1, b1, w2, b2 = self.weights
+        x = np.asarray(features_matrix, dtype=np.float32)
+        hidden = np.dot(x, w1)
+        hidden += b1
+        _sigmoid(hidden, hidden)
+        output = np.dot(hidden, w2)[:, 0]
+        output += b2[0]
+        _sigmoid(output, output)
+        error = np.asarray(targets, dtype=np.float32) - output
+        # Moving along +error * d(value)/d(weights) lowers the loss
+        d_output = error * output * (1 - output) / len(x)
+        d_hidden = np.outer(d_output, w2[:, 0])
+        d_hidden *= hidden
+        d_hidden *= 1 - hidden
+        w2[:, 0] += alpha * np.dot(hidden.T, d_output)
+        b2 += alpha * d_output.sum()
+        w1 += alpha * np.dot(x.T, d_hidden)
+        b1 += alpha * d_hidden.sum(axis=0)
+        return float(0.5 * np.mean(error ** 2))
+
+    def td_update(self, previous_state: np.ndarray, new_state: np.ndarray, reward: float, alpha: float,
+                  LAMBDA: float) -> float:
+        # Mirrors TDagent.update_model: the trace accumulates the gradient of the new state's value and every
+        # weight moves by alpha * td_error * trace
+        value_previous = self._forward_single(previous_state)
+        value_next = self.value_and_gradient(new_state)
+        td_error = reward + value_next - value_previous
+        self._apply_td(td_error, alpha, LAMBDA)
+        return td_error
+
+    def td_update_from_forward(self, value_previous: float, features_new: np.ndarray, hidden_new: np.ndarray,
+                               value_next: float, reward: float, alpha: float, LAMBDA: float) -> float:
+        # td_update() when both values and the new state's hidden activations are already known from a batched
+        # forward pass, so only the new state's backward pass is left to do
+        self._gradient(features_new, hidden_new, value_next)
+        td_error = reward + value_next - value_previous
+        self._apply_td(td_error, alpha, LAMBDA)
+        return td_error
+
+    def _apply_td(self, td_error: float, alpha: float, LAMBDA: float) -> None:
+        for weight, trace, grad, step in zip(self.weights, self.trace, self._grads, self._step):
+            trace *= LAMBDA
+            trace += grad
+            np.multiply(trace, alpha * td_error, out=step)
+            weight += step
+
+
+if __name__ == '__main__':
+    # Parity check against the TensorFlow path, then a steps-per-second comparison of the two backends
+    import logging
+    from board import Board, PLAYER_X, encode_features_batch
+    from game import Game
+    from TDGammon_agent import TDagent
+
+    PARITY_TOLERANCE = 1e-5  # float32 round-off; the two backends sum in different orders
+
+    logging.basicConfig(level=logging.WARN, format="%(message)s")
+    np.random.seed(0)
+    tf_agent = TDagent(0.1, 0.7, 196)
+    np_agent = TDagent(0.1, 0.7, 196, backend="numpy")
+    np_agent.network.set_weights(tf_agent.model.get_weights())
+
+    board = Board(False)
+    candidates = [b for _, b in board.legal_afterstates([6, 5], PLAYER_X)]
+    features = encode_features_batch(candidates, PLAYER_X)
+    value_diff = np.abs(tf_agent.assess_batch(features) - np_agent.assess_batch(features)).max()
+    print(f"Max value difference: {value_diff:.2e}")
+    assert value_diff < PARITY_TOLERANCE, f"NumPy values differ from TensorFlow's by {value_diff:.2e}"
+    for n in range(1, len(features)):
+        reward = 1 if n == len(features) - 1 else 0
+        for agent in (tf_agent, np_agent):
+            agent.update_model(features[n - 1:n], features[n:n + 1], reward, episode_end=False)
+    weight_diffs = [np.abs(a - b).max() for a, b in zip(tf_agent.model.get_weights(), np_agent.network.get_weights())]
+    print(f"Max weight difference after {len(features) - 1} updates: {max(weight_diffs):.2e}")
+    assert max(weight_diffs) < PARITY_TOLERANCE, f"NumPy weights differ from TensorFlow's by {max(weight_diffs):.2e}"
+
+    num_games = 5
+    for agent in (tf_agent, np_agent):
+        g = Game(agent, agent)
+        elapsed = sum(g.training_game(False) for _ in range(num_games))
+        print(f"{agent.backend:10s} backend: {sum(g.game_len_history) / elapsed:.1f} steps/sec")
@@ -0,0 +1,144 @@
+# Offline TD(lambda) from a game record store (see records.py), e.g. games recorded by train.py --record:
+#   python offline_train.py --records games --epochs 5 --load TDGammon --export TDGammon_offline
+# Every recorded afterstate is valued from the side of the player who has just moved, as assess_boards() does.  Each
+# epoch values every position in large batches, works out the lambda-returns of all the episodes at once, and then fits
+# the network to them in shuffled minibatches, instead of one update_model() call per turn.
+import argparse
+import logging
+import time
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from board import POSITION_SIZE, encode_positions
+from records import GameRecords
+from TDGammon_agent import TDagent, BACKENDS
+
+EVAL_BATCH_SIZE = 65536  # Positions valued per forward pass when working out the targets
+
+
+def load_trajectories(records: GameRecords) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # (positions, players, ends): the position after every recorded turn as an (N, POSITION_SIZE) array, the player
+    # who made each move, and the end of each game in those arrays.  Stores with positions are used in place; the
+    # others are replayed once.
+    ends = (records.games["first_turn"] + records.games["num_turns"]).astype(np.int64)
+    if records.positions:
+        return records.turns["position"], records.turns["player"], ends
+    positions = np.empty((len(records.turns), POSITION_SIZE), dtype=np.int8)
+    for game in range(len(records)):
+        first = int(records.games[game]["first_turn"])
+        for n, board in enumerate(records.replay(game)[1:]):
+            positions[first + n] = board._data[:POSITION_SIZE]
+    return positions, records.turns["player"], ends
+
+
+def lambda_returns(values: np.ndarray, ends: np.ndarray, LAMBDA: float) -> np.ndarray:
+    # Target for each position given the current value of every position.  A game's last move wins it, so its
+    # target is 1.  Before that, the next position belongs to the opponent, so from the mover's side it is worth
+    # 1 - value, and the lambda-return blends that one-step estimate with the following return:
+    #   G[t] = 1 - ((1 - LAMBDA) * value[t + 1] + LAMBDA * G[t + 1])
+    # The recursion runs backwards from the end of every game at once, one step at a time.
+    starts = np.concatenate(([0], ends[:-1]))
+    lengths = ends - starts
+    targets = np.empty(len(values), dtype=np.float32)
+    targets[ends - 1] = 1
+    for steps_from_end in range(1, int(lengths.max())):
+        t = ends[lengths > steps_from_end] - 1 - steps_from_end
+        targets[t] = 1 - ((1 - LAMBDA) * values[t + 1] + LAMBDA * targets[t + 1])
+    return targets
+
+
+def assess_positions(agent: TDagent, positions: np.ndarray, players: np.ndarray) -> np.ndarray:
+    values = np.empty(len(positions), dtype=np.float32)
+    for start in range(0, len(positions), EVAL_BATCH_SIZE):
+        end = start + EVAL_BATCH_SIZE
+        values[start:end] = agent.assess_batch(encode_positions(positions[start:end], players[start:end]))
+    return values
+
+
+def train_offline(agent: TDagent, positions: np.ndarray, players: np.ndarray, ends: np.ndarray, epochs: int,
+                  batch_size: int, LAMBDA: float, rng: np.random.RandomState) -> List[Dict[str, float]]:
+    # Returns the loss and throughput of each epoch
+    history = []
+    for epoch in range(epochs):
+        start_time = time.perf_counter()
+        targets = lambda_returns(assess_positions(agent, positions, players), ends, LAMBDA)
+        target_time = time.perf_counter() - start_time
+        order = rng.permutation(len(positions))
+        losses = []
+        for start in range(0, len(order), batch_size):
+            # Sorting each minibatch's indices keeps reads from a memory-mapped store close to sequential
+            batch = np.sort(order[start:start + batch_size])
+            features = encode_positions(positions[batch], players[batch])
+            losses.append(agent.fit_batch(features, targets[batch]) * len(batch))
+        elapsed = time.perf_counter() - start_time
+        history.append({"epoch": epoch + 1, "loss": sum(losses) / len(positions), "elapsed": elapsed,
+                        "target_time": target_time, "positions_per_sec": len(positions) / elapsed})
+    return history
+
+
+def online_positions_per_sec(agent: TDagent, positions: np.ndarray, players: np.ndarray, ends: np.ndarray,
+                             num_positions: int) -> float:
+    # Rate of relearning the same games the way training_game does, with one update_model() call per turn, on a
+    # copy of the agent.  Each turn's previous state is the position before the move.  Starting boards are not among
+    # the positions, so a game's first turn uses its own position rather than the end of the game before.
+    online = TDagent(agent.alpha, agent.LAMBDA, agent.num_features, backend=agent.backend)
+    online.set_weights(agent.get_weights())
+    num_positions = min(num_positions, int(ends[-1]))
+    game_ends = set(int(end) for end in ends)
+    game_starts = set(int(start) for start in np.concatenate(([0], ends[:-1])))
+    start_time = time.perf_counter()
+    for t in range(num_positions):
+        player = int(players[t])
+        previous = positions[t:t + 1] if t in game_starts else positions[t - 1:t]
+        episode_end = t + 1 in game_ends
+        online.update_model(encode_positions(previous, player), encode_positions(positions[t:t + 1], player),
+                            int(episode_end), episode_end)
+    return num_positions / (time.perf_counter() - start_time)
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Retrain TDagent offline from recorded games")
+    parser.add_argument("--records", required=True, help="Game record store, as <prefix>.games and <prefix>.turns")
+    parser.add_argument("--backend", choices=BACKENDS, default="numpy")
+    parser.add_argument("--alpha", type=float, default=1.0, help="Learning rate of each minibatch step")
+    parser.add_argument("--lambda", dest="LAMBDA", type=float, default=0.7, help="Lambda of the lambda-returns")
+    parser.add_argument("--epochs", type=int, default=5, help="Passes over the recorded positions")
+    parser.add_argument("--batch-size", type=int, default=1024)
+    parser.add_argument("--load", help="Keras weights in checkpoints/ to start from")
+    parser.add_argument("--export", help="Keras weights in checkpoints/ to write at the end")
+    parser.add_argument("--compare-online", type=int, default=2000,
+                        help="Turns to relearn with update_model() for comparison (0 to skip)")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    logging.basicConfig(level=logging.WARN, format="%(message)s")
+    args = parse_args(argv)
+    agent = TDagent(args.alpha, args.LAMBDA, backend=args.backend)
+    if args.load:
+        agent.load(args.load)
+
+    start_time = time.perf_counter()
+    records = GameRecords(args.records)
+    positions, players, ends = load_trajectories(records)
+    print(f"Loaded {len(records)} games, {len(positions)} positions in {time.perf_counter() - start_time:.2f}s"
+          f"{'' if records.positions else ' (replayed from the moves)'}")
+
+    if args.compare_online > 0:
+        online_rate = online_positions_per_sec(agent, positions, players, ends, args.compare_online)
+        print(f"Turn-by-turn update_model(): {online_rate:.0f} positions/sec")
+    history = train_offline(agent, positions, players, ends, args.epochs, args.batch_size, args.LAMBDA,
+                            np.random.RandomState(args.seed))
+    for stats in history:
+        print(f"Epoch {stats['epoch']}: loss {stats['loss']:.5f}, {stats['elapsed']:.2f}s "
+              f"({stats['target_time']:.2f}s on targets), {stats['positions_per_sec']:.0f} positions/sec")
+    total = sum(stats["elapsed"] for stats in history)
+    offline_rate = len(positions) * len(history) / total
+    print(f"Offline: {offline_rate:.0f} positions/sec"
+          + (f", {offline_rate / online_rate:.1f}x turn-by-turn" if args.compare_online > 0 else ""))
+    if args.export:
+        agent.save(args.export)
+
+
+if __name__ == '__main__':
+    main()
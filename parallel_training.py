@@ -0,0 +1,179 @@
+# Parallel self-play: actor processes play games with a recent copy of the weights and send the trajectories back to
+# a single learner process, which applies the TD(lambda) updates and broadcasts new weights every few games.
+import argparse
+import logging
+import multiprocessing as mp
+import queue
+import time
+from typing import Dict, List, Tuple
+import numpy as np
+from board import encode_features_batch
+from numpy_network import NumpyNetwork
+from TDGammon_agent import TDagent, NUM_HIDDEN
+
+# Trajectory of one game as stacked arrays: previous states, new states, rewards and episode-end flags
+Trajectory = Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]
+WORKER_CHECK_INTERVAL = 5.0  # Seconds the learner waits for a trajectory before checking that the actors are alive
+
+
+class ActorAgent:
+    # Inference-only agent for the actor processes.  Instead of learning, update_model records each transition so the
+    # learner can replay it.
+    def __init__(self, num_features: int = 196):
+        self.network = NumpyNetwork(num_features, NUM_HIDDEN)
+        self.transitions = []
+
+    def assess_features(self, state: np.ndarray):
+        return self.network.predict(state).sum()
+
+    def assess_batch(self, features_matrix: np.ndarray) -> np.ndarray:
+        return self.network.predict(features_matrix)
+
+    def assess_boards(self, boards, player: int) -> np.ndarray:
+        return self.network.predict(encode_features_batch(boards, player))
+
+    def update_model(self, previous_state, new_state, reward, episode_end):
+        self.transitions.append((previous_state, new_state, reward, episode_end))
+
+    def take_trajectory(self) -> Trajectory:
+        previous_states = np.concatenate([t[0] for t in self.transitions]).astype(np.float32)
+        new_states = np.concatenate([t[1] for t in self.transitions]).astype(np.float32)
+        rewards = np.array([t[2] for t in self.transitions], dtype=np.float32)
+        episode_ends = np.array([t[3] for t in self.transitions], dtype=bool)
+        self.transitions = []
+        return previous_states, new_states, rewards, episode_ends
+
+
+def _actor_process(worker_id: int, weights_queue: mp.Queue, trajectory_queue: mp.Queue, stop_event,
+                   endgame_board: bool, seed: int) -> None:
+    from game import Game
+
+    logging.basicConfig(level=logging.WARN, format="%(message)s")
+    np.random.seed(seed + worker_id)
+    agent = ActorAgent()
+    version = -1
+    g = Game(agent, agent, verbose=False)
+    while not stop_event.is_set():
+        # Always play with the most recent weights that have been broadcast
+        try:
+            while True:
+                version, weights = weights_queue.get(block=(version < 0), timeout=1)
+                agent.network.set_weights(weights)
+        except queue.Empty:
+            pass
+        if version < 0:
+            continue
+        elapsed = g.training_game(endgame_board)
+        trajectory = agent.take_trajectory()
+        while not stop_event.is_set():
+            try:
+                trajectory_queue.put((worker_id, version, trajectory, elapsed), timeout=1)
+                break
+            except queue.Full:
+                pass
+
+
+class ParallelTrainer:
+    def __init__(self, agent: TDagent, num_workers: int = 4, sync_interval: int = 10, max_staleness: int = 2,
+                 endgame_board: bool = False, seed: int = 0):
+        # sync_interval: games applied by the learner between weight broadcasts
+        # max_staleness: trajectories played with weights more than this many broadcasts old are discarded
+        self.agent = agent
+        self.num_workers = num_workers
+        self.sync_interval = sync_interval
+        self.max_staleness = max_staleness
+        self.endgame_board = endgame_board
+        self.seed = seed
+        self.version = 0
+        self.games_applied = 0
+        self.games_discarded = 0
+        self.worker_games = [0] * num_workers
+        self.worker_game_time = [0.0] * num_workers
+
+    def _broadcast(self, weights_queues: List[mp.Queue]) -> None:
+        weights = self.agent.get_weights()
+        for weights_queue in weights_queues:
+            weights_queue.put((self.version, weights))
+
+    def _apply(self, trajectory: Trajectory) -> None:
+        previous_states, new_states, rewards, episode_ends = trajectory
+        for n in range(len(rewards)):
+            self.agent.update_model(previous_states[n:n + 1], new_states[n:n + 1], int(rewards[n]),
+                                    episode_end=bool(episode_ends[n]))
+
+    def worker_stats(self, elapsed: float) -> List[Dict[str, float]]:
+        return [{"worker": n, "games": self.worker_games[n], "games_per_sec": self.worker_games[n] / elapsed,
+                 "sec_per_game": self.worker_game_time[n] / max(self.worker_games[n], 1)}
+                for n in range(self.num_workers)]
+
+    def run(self, num_games: int, report_period: int = 100) -> None:
+        ctx = mp.get_context("spawn")  # TensorFlow does not survive being forked
+        stop_event = ctx.Event()
+        weights_queues = [ctx.Queue() for _ in range(self.num_workers)]
+        trajectory_queue = ctx.Queue(maxsize=2 * self.num_workers)
+        workers = [ctx.Process(target=_actor_process, daemon=True,
+                               args=(n, weights_queues[n], trajectory_queue, stop_event, self.endgame_board,
+                                     self.seed))
+                   for n in range(self.num_workers)]
+        for worker in workers:
+            worker.start()
+        self._broadcast(weights_queues)
+
+        start_time = time.time()
+        try:
+            while self.games_applied < num_games:
+                try:
+                    worker_id, version, trajectory, game_time = trajectory_queue.get(timeout=WORKER_CHECK_INTERVAL)
+                except queue.Empty:
+                    # Actors only exit once stop_event is set, so any exit code means one has died
+                    for n, worker in enumerate(workers):
+                        if worker.exitcode is not None:
+                            raise RuntimeError(f"Actor process {n} died with exit code {worker.exitcode}")
+                    continue
+                self.worker_games[worker_id] += 1
+                self.worker_game_time[worker_id] += game_time
+                if self.version - version > self.max_staleness:
+                    self.games_discarded += 1
+                    continue
+                self._apply(trajectory)
+                self.games_applied += 1
+                if self.games_applied % self.sync_interval == 0:
+                    self.version += 1
+                    self._broadcast(weights_queues)
+                if self.games_applied % report_period == 0:
+                    self.report(time.time() - start_time)
+        finally:
+            stop_event.set()
+            for worker in workers:
+                worker.join(timeout=5)
+                if worker.is_alive():
+                    worker.terminate()
+        self.report(time.time() - start_time)
+
+    def report(self, elapsed: float) -> None:
+        print(f"Games applied: {self.games_applied}\tDiscarded as stale: {self.games_discarded}\t"
+              f"Weights version: {self.version}\tLearner games per sec: {self.games_applied / elapsed:.2f}")
+        for stats in self.worker_stats(elapsed):
+            print(f"  Worker {stats['worker']}: {stats['games']} games\t{stats['games_per_sec']:.2f} games/sec")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Train TDagent with parallel self-play actors")
+    parser.add_argument("--games", type=int, default=1000, help="Number of games for the learner to apply")
+    parser.add_argument("--workers", type=int, default=max(mp.cpu_count() - 1, 1))
+    parser.add_argument("--sync-interval", type=int, default=10, help="Games between weight broadcasts")
+    parser.add_argument("--max-staleness", type=int, default=2,
+                        help="Discard games played with weights more than this many broadcasts old")
+    parser.add_argument("--endgame", action="store_true", help="Use the endgame starting board")
+    parser.add_argument("--backend", choices=["tensorflow", "numpy"], default="numpy")
+    parser.add_argument("--load", help="Checkpoint to start from")
+    parser.add_argument("--save", default="TDGammon", help="Checkpoint to save to at the end")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARN, format="%(message)s")
+    learner_agent = TDagent(0.1, 0.7, 196, backend=args.backend)
+    if args.load:
+        learner_agent.load(args.load)
+    trainer = ParallelTrainer(learner_agent, args.workers, args.sync_interval, args.max_staleness, args.endgame)
+    trainer.run(args.games)
+    learner_agent.save(args.save)
@@ -0,0 +1,81 @@
+# Opt-in per-phase instrumentation for the training loop.  Game only touches a PhaseProfiler when one has been
+# attached with Game.enable_profiling(), so a disabled profiler costs one "is None" check per phase.
+import json
+import time
+import tracemalloc
+from typing import Dict
+try:
+    import resource  # Not available on Windows
+except ImportError:
+    resource = None
+
+
+class PhaseProfiler:
+    def __init__(self, report_every: int = 0, trace_memory: bool = False):
+        # report_every: print a summary every this many games (0 to only report on demand)
+        # trace_memory: also track the peak of Python allocations with tracemalloc, which slows everything down
+        self.report_every = report_every
+        self.trace_memory = trace_memory
+        self.times: Dict[str, float] = {}
+        self.calls: Dict[str, int] = {}
+        self.counters: Dict[str, int] = {}
+        self.games = 0
+        self.peak_rss_kb = 0
+        self.peak_traced_kb = 0
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def record(self, phase: str, start_time: float, exclude: float = 0.0) -> float:
+        # Adds the time since start_time to the phase and returns the current time, so phases can be chained.
+        # exclude: seconds within that time already recorded under other, nested phases
+        now = time.perf_counter()
+        self.times[phase] = self.times.get(phase, 0.0) + now - start_time - exclude
+        self.calls[phase] = self.calls.get(phase, 0) + 1
+        return now
+
+    def total(self, *phases: str) -> float:
+        return sum(self.times.get(phase, 0.0) for phase in phases)
+
+    def count(self, counter: str, n: int = 1) -> None:
+        self.counters[counter] = self.counters.get(counter, 0) + n
+
+    def sample_memory(self) -> None:
+        if resource is not None:
+            # ru_maxrss is already a peak, reported in kilobytes on Linux
+            self.peak_rss_kb = max(self.peak_rss_kb, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+        if self.trace_memory:
+            self.peak_traced_kb = max(self.peak_traced_kb, tracemalloc.get_traced_memory()[1] // 1024)
+
+    def end_game(self) -> None:
+        self.games += 1
+        self.sample_memory()
+        if self.report_every > 0 and self.games % self.report_every == 0:
+            self.report()
+
+    def summary(self) -> Dict:
+        total = sum(self.times.values())
+        phases = {phase: {"seconds": self.times[phase], "calls": self.calls[phase],
+                          "us_per_call": self.times[phase] / self.calls[phase] * 1e6,
+                          "share": self.times[phase] / total if total > 0 else 0.0}
+                  for phase in sorted(self.times, key=self.times.get, reverse=True)}
+        return {"games": self.games, "phases": phases, "counters": dict(self.counters),
+                "peak_rss_kb": self.peak_rss_kb, "peak_traced_kb": self.peak_traced_kb}
+
+    def report(self) -> None:
+        summary = self.summary()
+        print(f"Profile after {summary['games']} games (peak RSS {summary['peak_rss_kb'] / 1024:.1f} MB):")
+        for phase, stats in summary["phases"].items():
+            print(f"  {phase:20s} {stats['seconds']:9.3f}s {stats['share'] * 100:5.1f}% "
+                  f"{stats['calls']:9d} calls {stats['us_per_call']:9.1f} us/call")
+        for counter, value in summary["counters"].items():
+            print(f"  {counter:20s} {value:9d}")
+
+    def export(self, path: str) -> None:
+        with open(path, "w") as f:
+            json.dump(self.summary(), f, indent=2)
+
+    def reset(self) -> None:
+        self.times.clear()
+        self.calls.clear()
+        self.counters.clear()
+        self.games = 0
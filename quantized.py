@@ -0,0 +1,187 @@
+# Reduced-precision inference copies of TDagent's network, for running many evaluators per machine:
+#   python quantized.py --checkpoint-dir checkpoints/training --output checkpoints/TDGammon
+# writes checkpoints/TDGammon.float16.npz and checkpoints/TDGammon.int8.npz, then compares them with the float32
+# network on a corpus of positions: value error, move choice, weight memory, throughput and evaluator process memory.
+# The files load with NumPy alone, so an evaluator never has to import TensorFlow.
+#   float16: every weight rounded to half precision
+#   int8:    kernels quantised symmetrically with one scale per output unit; biases stay float32
+# QuantizedNetwork keeps the kernels at their stored precision.  NumPy has no fast float16 or int8 matrix product, so
+# each batch casts the kernel to float32 for the product (and applies int8 scales to the result), trading a little
+# time per batch for weights that take a half or a quarter of the memory.
+from typing import Dict, List, Sequence
+import numpy as np
+from board import Board, encode_features_batch
+
+PRECISIONS = ("float16", "int8")
+_FORMAT_VERSION = 1
+
+
+def quantize(weights: List[np.ndarray], precision: str) -> Dict[str, np.ndarray]:
+    # Arrays to save for weights in tf.keras.Model.get_weights() order: hidden kernel, hidden bias, output kernel,
+    # output bias
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision '{precision}', expected one of {PRECISIONS}")
+    arrays = {"version": np.array(_FORMAT_VERSION), "precision": np.array(precision)}
+    for layer, (kernel, bias) in enumerate(zip(weights[0::2], weights[1::2])):
+        if precision == "float16":
+            arrays[f"kernel{layer}"] = kernel.astype(np.float16)
+            arrays[f"bias{layer}"] = bias.astype(np.float16)
+        else:
+            scale = np.abs(kernel).max(axis=0) / 127
+            scale[scale == 0] = 1
+            arrays[f"kernel{layer}"] = np.round(kernel / scale).astype(np.int8)
+            arrays[f"scale{layer}"] = scale.astype(np.float32)
+            arrays[f"bias{layer}"] = bias.astype(np.float32)
+    return arrays
+
+
+def save_quantized(weights: List[np.ndarray], path: str, precision: str) -> None:
+    np.savez(path, **quantize(weights, precision))
+
+
+class QuantizedNetwork:
+    # Same forward pass as NumpyNetwork.predict(), from quantised weights; usable wherever a player only needs
+    # assess_boards(), such as ExpectimaxSearch, the GUI and the Evaluator
+    def __init__(self, arrays: Dict[str, np.ndarray]):
+        if int(arrays["version"]) != _FORMAT_VERSION:
+            raise ValueError(f"Quantised network format {int(arrays['version'])} is not version {_FORMAT_VERSION}")
+        self.precision = str(arrays["precision"])
+        self.kernels = [arrays["kernel0"], arrays["kernel1"]]
+        self.biases = [arrays["bias0"].astype(np.float32), arrays["bias1"].astype(np.float32)]
+        self.scales = [arrays["scale0"], arrays["scale1"]] if self.precision == "int8" else None
+
+    @classmethod
+    def load(cls, path: str) -> "QuantizedNetwork":
+        with np.load(path) as arrays:
+            return cls(dict(arrays))
+
+    @property
+    def nbytes(self) -> int:
+        # Memory held by the weights
+        return sum(a.nbytes for a in self.kernels + self.biases + (self.scales or []))
+
+    def _layer(self, layer: int, inputs: np.ndarray) -> np.ndarray:
+        # Sigmoid of inputs @ kernel + bias.  The float32 copy of the kernel only lives for this product, and an int8
+        # kernel's scales are applied to the product (one per output unit) rather than to the weights.
+        out = np.dot(inputs, self.kernels[layer].astype(np.float32))
+        if self.scales is not None:
+            out *= self.scales[layer]
+        out += self.biases[layer]
+        np.negative(out, out=out)
+        np.exp(out, out=out)
+        out += 1
+        return np.reciprocal(out, out=out)
+
+    def predict(self, features_matrix: np.ndarray) -> np.ndarray:
+        hidden = self._layer(0, np.asarray(features_matrix, dtype=np.float32))
+        return self._layer(1, hidden)[:, 0]
+
+    def assess_boards(self, boards: Sequence[Board], player: int) -> np.ndarray:
+        return self.predict(encode_features_batch(boards, player))
+
+
+def _peak_rss_mb(code: str) -> float:
+    # Peak resident memory of a fresh Python process running code from the repository directory (Unix only; NaN
+    # elsewhere).  Linux keeps ru_maxrss across exec, so the child would report this process's peak if it was
+    # higher; VmHWM starts again from zero.  Elsewhere ru_maxrss is used, which macOS gives in bytes, not kilobytes.
+    import os
+    import subprocess
+    import sys
+    script = code + ("\nimport os, resource, sys\n"
+                     "if os.path.exists('/proc/self/status'):\n"
+                     "    print([l.split()[1] for l in open('/proc/self/status') if l.startswith('VmHWM')][0])\n"
+                     "else:\n"
+                     "    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss\n"
+                     "    print(rss // 1024 if sys.platform == 'darwin' else rss)")
+    try:
+        output = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+        return int(output.split()[-1]) / 1024
+    except (subprocess.CalledProcessError, ValueError, IndexError):
+        return float("nan")
+
+
+if __name__ == '__main__':
+    import argparse
+    import logging
+    import os
+    import tempfile
+    import time
+    from benchmark import build_corpus
+    from checkpointing import CheckpointManager
+    from numpy_network import NumpyNetwork
+    from TDGammon_agent import TDagent
+
+    parser = argparse.ArgumentParser(description="Export float16 and int8 inference models and report their accuracy")
+    parser.add_argument("--load", help="Keras weights in checkpoints/ to export")
+    parser.add_argument("--checkpoint-dir",
+                        help="Export the weights of the latest training checkpoint in this directory")
+    parser.add_argument("--output", default="checkpoints/TDGammon", help="Writes <output>.<precision>.npz")
+    parser.add_argument("--positions", type=int, default=100, help="Corpus positions per category")
+    parser.add_argument("--seed", type=int, default=1234, help="Seed for the position corpus")
+    parser.add_argument("--min-time", type=float, default=1.0, help="Seconds to time each model for")
+    parser.add_argument("--batch", type=int, default=4096, help="Positions per forward pass in the memory comparison")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARN, format="%(message)s")
+    agent = TDagent(backend="numpy")
+    if args.load:
+        agent.load(args.load)
+    elif args.checkpoint_dir:
+        state = CheckpointManager(args.checkpoint_dir).load()
+        if state is None:
+            parser.error(f"No training checkpoint in {args.checkpoint_dir}")
+        agent.set_weights(state["weights"])
+    weights = agent.get_weights()
+    reference = NumpyNetwork(*weights[0].shape)
+    reference.set_weights(weights)
+    models = {"float32": reference}
+    temp_dir = tempfile.TemporaryDirectory()
+    # The float32 weights are saved too, only so the baseline is measured the same way as the other two
+    paths = {"float32": os.path.join(temp_dir.name, "float32.npz")}
+    np.savez(paths["float32"], *weights)
+    for precision in PRECISIONS:
+        paths[precision] = f"{args.output}.{precision}.npz"
+        save_quantized(weights, paths[precision], precision)
+        models[precision] = QuantizedNetwork.load(paths[precision])
+        print(f"Wrote {paths[precision]}")
+
+    # Memory of an evaluator process holding each model through a forward pass, all with NumPy alone
+    loaders = {"float32": "from numpy_network import NumpyNetwork\n"
+                          "weights = [arrays[f'arr_{n}'] for n in range(len(arrays.files))]\n"
+                          "model = NumpyNetwork(*weights[0].shape)\n"
+                          "model.set_weights(weights)\n"}
+    for precision in PRECISIONS:
+        loaders[precision] = "from quantized import QuantizedNetwork\nmodel = QuantizedNetwork(dict(arrays))\n"
+    peak_rss = {name: _peak_rss_mb(f"import numpy as np\narrays = np.load({os.path.abspath(paths[name])!r})\n" +
+                                   loader +
+                                   f"model.predict(np.ones(({args.batch}, {weights[0].shape[0]}), np.float32))")
+                for name, loader in loaders.items()}
+
+    # Accuracy: values of every candidate move in the corpus, and whether the same move would be chosen
+    corpus = [position for positions in build_corpus(args.seed, args.positions).values() for position in positions]
+    candidate_features = []
+    for board, player, dice in corpus:
+        candidate_features.append(encode_features_batch([b for _, b in board.legal_afterstates(dice, player)],
+                                                        player))
+    all_features = np.concatenate(candidate_features)
+    reference_values = [reference.predict(f) for f in candidate_features]
+    print(f"\n{len(corpus)} positions, {len(all_features)} candidate moves")
+    print(f"{'model':8s} {'mean |error|':>12s} {'max |error|':>12s} {'same move':>10s} {'weights':>10s} "
+          f"{'file':>10s} {'positions/sec':>14s} {'peak RSS':>10s}")
+    for name, model in models.items():
+        values = [model.predict(f) for f in candidate_features]
+        errors = np.abs(np.concatenate(values) - np.concatenate(reference_values))
+        agreement = np.mean([np.argmax(v) == np.argmax(r) for v, r in zip(values, reference_values)])
+        # Throughput over the whole corpus at once, as in batched evaluation
+        calls = 0
+        start_time = time.perf_counter()
+        while time.perf_counter() - start_time < args.min_time:
+            model.predict(all_features)
+            calls += 1
+        rate = calls * len(all_features) / (time.perf_counter() - start_time)
+        weight_bytes = sum(w.nbytes for w in weights) if name == "float32" else model.nbytes
+        print(f"{name:8s} {errors.mean():12.2e} {errors.max():12.2e} {agreement:10.3f} {weight_bytes / 1024:8.1f}KB "
+              f"{os.path.getsize(paths[name]) / 1024:8.1f}KB {rate:14.0f} {peak_rss[name]:8.1f}MB")
+    print("Peak RSS is a whole evaluator process, mostly Python and NumPy; the network's share is the weights column")
+    temp_dir.cleanup()
@@ -0,0 +1,114 @@
+# Positions without contact are pure races, where the network adds little over a pip count.  EvaluationRouter sends
+# each candidate position to the cheapest evaluator that applies: the bear-off database once both sides are home, a
+# pip count and wastage formula for other races, and the agent's network only while there is still contact.
+import math
+from typing import Dict, Optional, Sequence
+import numpy as np
+from bearoff import BearoffDatabase, is_bearoff
+from board import Board, NUM_POINTS, _index, _PIP_COUNT, stack_boards
+
+# Pips moved by one roll, over the 36 equally likely rolls (doubles move four times)
+_ROLL_PIPS = np.array([4 * a if a == b else a + b for a in range(1, 7) for b in range(1, 7)], dtype=np.float64)
+ROLL_MEAN = _ROLL_PIPS.mean()
+ROLL_VARIANCE = _ROLL_PIPS.var()
+# Wastage: pips that have to be added to the pip count to get the effective number needed to bear everything off.
+# Pieces have to be borne off with an exact roll, so pieces on the low points waste a lot.  Fitted to the expected
+# roll counts in the bear-off database: a base amount, plus an amount per piece and per occupied point at each distance
+# from being borne off (1 to 6).
+_WASTAGE_BASE = 33.6
+_WASTAGE_PER_PIECE = np.array([16.1, 8.1, 7.1, 3.7, 3.1, 0.8])
+_WASTAGE_PER_POINT = np.array([-9.6, -6.5, -6.8, -6.0, -5.5, -3.6])
+# Rolls that cannot be played make the number of rolls needed about this much more spread out than the dice alone
+# would, again fitted to the bear-off database
+_DEVIATION_SCALE = 2.5
+# Standard normal CDF tabulated for linear interpolation (within 2e-7), as NumPy has no vectorised erf; one np.interp
+# call costs less than a math.erf loop even for a handful of positions.  Beyond the table it is 0 or 1 to float32.
+_CDF_GRID = np.linspace(-8, 8, 8193)
+_CDF_TABLE = np.array([0.5 * (1 + math.erf(x / math.sqrt(2))) for x in _CDF_GRID])
+_HOME_SLOTS = [[_index(player, NUM_POINTS - distance) for distance in range(1, 7)] for player in (0, 1)]
+PATHS = ("network", "race", "bearoff")
+
+
+def effective_pip_counts(positions: np.ndarray, player: int) -> np.ndarray:
+    # Pip count plus wastage for the player in each row of an (N, BOARD_ARRAY_SIZE) array; 0 once they have won
+    pips = positions[:, _PIP_COUNT + player].astype(np.float64)
+    home = positions[:, _HOME_SLOTS[player]]
+    wastage = _WASTAGE_BASE + home @ _WASTAGE_PER_PIECE + (home > 0) @ _WASTAGE_PER_POINT
+    return np.where(pips > 0, pips + wastage, 0.0)
+
+
+def race_win_probability(boards: Sequence[Board], player: int) -> np.ndarray:
+    # Chance that the player, who has just moved, wins each race with their opponent on roll.  The rolls each side
+    # needs are treated as normally distributed, with the mean and variance of the number of rolls needed to cover
+    # their effective pip count.
+    positions = stack_boards(boards)
+    mine = effective_pip_counts(positions, player)
+    theirs = effective_pip_counts(positions, 1 - player)
+    mean_difference = (theirs - mine) / ROLL_MEAN
+    deviation = _DEVIATION_SCALE * np.sqrt((mine + theirs) * ROLL_VARIANCE / ROLL_MEAN ** 3)
+    # The opponent rolls first, so the player wins only by needing strictly fewer rolls
+    z = (mean_difference - 0.5) / np.maximum(deviation, 1e-6)
+    values = np.interp(z, _CDF_GRID, _CDF_TABLE).astype(np.float32)
+    values[mine == 0] = 1
+    return values
+
+
+class EvaluationRouter:
+    def __init__(self, bearoff: Optional[BearoffDatabase] = None, race: bool = True):
+        # bearoff: database for positions where both sides are home (optional)
+        # race: use the race formula for the other positions without contact
+        self.bearoff = bearoff
+        self.race = race
+        self.positions = dict.fromkeys(PATHS, 0)
+        self.turns = 0
+        self.network_turns = 0
+
+    def _path(self, board: Board) -> str:
+        if board.has_contact():
+            return "network"
+        if self.bearoff is not None and is_bearoff(board):
+            return "bearoff"
+        return "race" if self.race else "network"
+
+    def network_only(self, boards: Sequence[Board]) -> bool:
+        # Whether assess() would send every board to the network, so the agent could value them all itself
+        return all(self._path(board) == "network" for board in boards)
+
+    def count_network(self, num_boards: int) -> None:
+        # Counts a turn whose boards the agent valued itself after network_only(), so stats() still covers it
+        self.positions["network"] += num_boards
+        self.network_turns += 1
+        self.turns += 1
+
+    def assess(self, agent, boards: Sequence[Board], player: int) -> np.ndarray:
+        # agent.assess_boards(), except that positions without contact skip the network
+        paths = [self._path(board) for board in boards]
+        values = np.empty(len(boards), dtype=np.float32)
+        for path in PATHS:
+            selected = [i for i, p in enumerate(paths) if p == path]
+            if len(selected) == 0:
+                continue
+            chosen = [boards[i] for i in selected]
+            if path == "network":
+                values[selected] = agent.assess_boards(chosen, player)
+                self.network_turns += 1
+            elif path == "race":
+                values[selected] = race_win_probability(chosen, player)
+            else:
+                values[selected] = self.bearoff.win_probability(chosen, player)
+            self.positions[path] += len(selected)
+        self.turns += 1
+        return values
+
+    def stats(self) -> Dict[str, float]:
+        total = sum(self.positions.values())
+        stats = {f"{path}_positions": self.positions[path] for path in PATHS}
+        stats.update({f"{path}_share": self.positions[path] / total if total > 0 else 0.0 for path in PATHS})
+        stats["turns"] = self.turns
+        stats["turns_skipping_network"] = self.turns - self.network_turns
+        return stats
+
+    def reset(self) -> None:
+        self.positions = dict.fromkeys(PATHS, 0)
+        self.turns = 0
+        self.network_turns = 0
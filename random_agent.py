@@ -9,6 +9,12 @@ class RandomAgent:
     def assess_features(self, state):
         return np.random.rand()
 
+    def assess_batch(self, features_matrix: np.ndarray) -> np.ndarray:
+        return np.random.rand(features_matrix.shape[0])
+
+    def assess_boards(self, boards, player: int) -> np.ndarray:
+        return np.random.rand(len(boards))
+
     def choose_action(self, states: List[List]):
         chosen_board_index = np.random.randint(0, len(states))
         return chosen_board_index
@@ -0,0 +1,206 @@
+# Append-only store of played games, so self-play can be replayed, reanalysed or trained on again later.  A store is a
+# pair of files of fixed-size little-endian records after a short header:
+#   <path>.games  one record per game: its starting position, first player, winner and where its turns are
+#   <path>.turns  one record per turn: the player, dice and moves, and optionally the position after the move
+# Positions are the first POSITION_SIZE slots of Board's array (piece counts, so int8 is enough) and can be turned
+# into network inputs with board.encode_positions().  GameRecords memory-maps both files and hands out NumPy views,
+# so scanning millions of games reads straight from the page cache without copying or parsing.
+#   python records.py --output games --games 1000
+import os
+from typing import List, Optional, Sequence, Tuple
+import numpy as np
+from board import Board, POSITION_SIZE
+
+MAX_MOVES = 4  # Moves in a turn, for a double
+
+_GAMES_MAGIC = b"BGGR"
+_TURNS_MAGIC = b"BGTR"
+_VERSION = 1
+_HEADER_DTYPE = np.dtype([("magic", "S4"), ("version", "<u2"), ("positions", "<u2")])
+GAME_DTYPE = np.dtype([("first_turn", "<u8"), ("num_turns", "<u2"), ("first_player", "u1"), ("winner", "u1"),
+                       ("start", "i1", (POSITION_SIZE,))])
+# Unused move slots hold (0, 0); a roll that could not be played has no moves
+TURN_DTYPE = np.dtype([("player", "u1"), ("dice", "u1", (2,)), ("num_moves", "u1"), ("moves", "i1", (MAX_MOVES, 2))])
+TURN_WITH_POSITION_DTYPE = np.dtype(TURN_DTYPE.descr + [("position", "i1", (POSITION_SIZE,))])
+
+
+def _paths(path: str) -> Tuple[str, str]:
+    return path + ".games", path + ".turns"
+
+
+def _read_header(path: str, magic: bytes) -> np.void:
+    header = np.fromfile(path, dtype=_HEADER_DTYPE, count=1)
+    if len(header) == 0 or header[0]["magic"] != magic or header[0]["version"] != _VERSION:
+        raise ValueError(f"{path} is not a version {_VERSION} game record file")
+    return header[0]
+
+
+def _position(board: Board) -> np.ndarray:
+    return np.asarray(board._data[:POSITION_SIZE], dtype=np.int8)
+
+
+class GameWriter:
+    def __init__(self, path: str, positions: bool = False):
+        # path: store to append to, created if it does not exist yet
+        # positions: also store the position after every turn (52 more bytes per turn)
+        games_path, turns_path = _paths(path)
+        self.path = path
+        if os.path.exists(games_path):
+            stored_positions = bool(_read_header(games_path, _GAMES_MAGIC)["positions"])
+            if stored_positions != positions:
+                raise ValueError(f"{path} was written {'with' if stored_positions else 'without'} positions")
+        self.positions = positions
+        self.turn_dtype = TURN_WITH_POSITION_DTYPE if positions else TURN_DTYPE
+        for file_path, magic in ((games_path, _GAMES_MAGIC), (turns_path, _TURNS_MAGIC)):
+            if not os.path.exists(file_path):
+                header = np.array([(magic, _VERSION, positions)], dtype=_HEADER_DTYPE)
+                with open(file_path, "wb") as f:
+                    f.write(header.tobytes())
+        self._games = open(games_path, "r+b")
+        self._turns = open(turns_path, "r+b")
+        games = (os.path.getsize(games_path) - _HEADER_DTYPE.itemsize) // GAME_DTYPE.itemsize
+        # Drops anything after the last complete game, such as the turns of a game cut short by a crash
+        self.truncate(games)
+        self._start: Optional[np.ndarray] = None
+        self._first_player = 0
+        self._turn_buffer: List[Tuple] = []
+
+    def __len__(self) -> int:
+        return self.num_games
+
+    def truncate(self, num_games: int) -> None:
+        # Keeps only the first num_games games, e.g. to go back to the last checkpoint of a resumed run
+        self._games.seek(0, os.SEEK_END)
+        stored = (self._games.tell() - _HEADER_DTYPE.itemsize) // GAME_DTYPE.itemsize
+        if num_games > stored:
+            raise ValueError(f"{self.path} only holds {stored} games, not {num_games}")
+        self.num_games = num_games
+        self.num_turns = 0
+        if num_games > 0:
+            self._games.seek(_HEADER_DTYPE.itemsize + (num_games - 1) * GAME_DTYPE.itemsize)
+            last = np.frombuffer(self._games.read(GAME_DTYPE.itemsize), dtype=GAME_DTYPE)[0]
+            self.num_turns = int(last["first_turn"]) + int(last["num_turns"])
+        self._games.truncate(_HEADER_DTYPE.itemsize + num_games * GAME_DTYPE.itemsize)
+        self._turns.truncate(_HEADER_DTYPE.itemsize + self.num_turns * self.turn_dtype.itemsize)
+        self._games.seek(0, os.SEEK_END)
+        self._turns.seek(0, os.SEEK_END)
+        self._start = None
+        self._turn_buffer = []
+
+    def start_game(self, board: Board, first_player: int) -> None:
+        self._start = _position(board)
+        self._first_player = first_player
+        self._turn_buffer = []
+
+    def record_turn(self, player: int, rolls: Sequence[int], moves: Sequence[Tuple[int, int]],
+                    board: Optional[Board] = None) -> None:
+        # board: position after the move, needed if the store keeps positions
+        padded = list(moves) + [(0, 0)] * (MAX_MOVES - len(moves))
+        turn = (player, rolls[:2], len(moves), padded)
+        if self.positions:
+            turn += (_position(board),)
+        self._turn_buffer.append(turn)
+
+    def end_game(self, winner: int) -> None:
+        # Writes the game's turns and then the game itself, so a reader never sees a game without all of its turns
+        turns = np.array(self._turn_buffer, dtype=self.turn_dtype)
+        game = np.array([(self.num_turns, len(turns), self._first_player, winner, self._start)], dtype=GAME_DTYPE)
+        self._turns.write(turns.tobytes())
+        self._turns.flush()
+        self._games.write(game.tobytes())
+        self._games.flush()
+        self.num_games += 1
+        self.num_turns += len(turns)
+        self._start = None
+        self._turn_buffer = []
+
+    def close(self) -> None:
+        self._games.close()
+        self._turns.close()
+
+    def __enter__(self) -> "GameWriter":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def _map(path: str, dtype: np.dtype) -> np.ndarray:
+    count = (os.path.getsize(path) - _HEADER_DTYPE.itemsize) // dtype.itemsize
+    if count == 0:
+        return np.zeros(0, dtype=dtype)  # An empty file region cannot be memory-mapped
+    return np.memmap(path, dtype=dtype, mode="r", offset=_HEADER_DTYPE.itemsize, shape=(count,))
+
+
+class GameRecords:
+    def __init__(self, path: str):
+        # Maps the games complete when the store is opened; games written later need a new GameRecords
+        games_path, turns_path = _paths(path)
+        self.path = path
+        self.positions = bool(_read_header(games_path, _GAMES_MAGIC)["positions"])
+        _read_header(turns_path, _TURNS_MAGIC)
+        self.games = _map(games_path, GAME_DTYPE)
+        self.turns = _map(turns_path, TURN_WITH_POSITION_DTYPE if self.positions else TURN_DTYPE)
+
+    def __len__(self) -> int:
+        return len(self.games)
+
+    def game_turns(self, game: int) -> np.ndarray:
+        # View of the game's turn records
+        first = int(self.games[game]["first_turn"])
+        return self.turns[first:first + int(self.games[game]["num_turns"])]
+
+    def start_board(self, game: int) -> Board:
+        return Board.from_position(self.games[game]["start"])
+
+    def replay(self, game: int) -> List[Board]:
+        # The game's starting board followed by the board after each turn, rebuilt from the moves
+        board = self.start_board(game)
+        boards = [board]
+        for turn in self.game_turns(game):
+            board = board.clone()
+            for start, roll in turn["moves"][:turn["num_moves"]]:
+                board.perform_move(int(start), int(roll), int(turn["player"]))
+            boards.append(board)
+        return boards
+
+
+if __name__ == '__main__':
+    import argparse
+    import logging
+    import time
+    from board import encode_positions
+    from game import Game
+    from random_agent import RandomAgent
+
+    parser = argparse.ArgumentParser(description="Record random-play games, then time reading them back")
+    parser.add_argument("--output", default="games")
+    parser.add_argument("--games", type=int, default=1000)
+    parser.add_argument("--positions", action="store_true", help="Store the position after every turn")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARN, format="%(message)s")
+    start_time = time.time()
+    with GameWriter(args.output, positions=args.positions) as writer:
+        g = Game(RandomAgent(), RandomAgent(), verbose=False, recorder=writer)
+        for _ in range(args.games):
+            g.training_game(False)
+    print(f"Played and recorded {args.games} games in {time.time() - start_time:.1f}s")
+
+    records = GameRecords(args.output)
+    size = sum(os.path.getsize(p) for p in _paths(args.output))
+    print(f"{len(records)} games, {len(records.turns)} turns, {size / 1e6:.1f} MB "
+          f"({size / len(records):.0f} bytes per game)")
+    start_time = time.time()
+    doubles = (records.turns["dice"][:, 0] == records.turns["dice"][:, 1]).mean()
+    wins = np.bincount(records.games["winner"], minlength=2)
+    print(f"Scanned every turn in {time.time() - start_time:.4f}s: {doubles:.3f} of rolls were doubles, "
+          f"wins by player {wins[0]} to {wins[1]}")
+    boards = records.replay(len(records) - 1)
+    assert boards[-1].game_won(int(records.games[-1]["winner"]))
+    if records.positions:
+        last = records.game_turns(len(records) - 1)
+        assert all(np.array_equal(_position(b), p) for b, p in zip(boards[1:], last["position"]))
+        start_time = time.time()
+        features = encode_positions(records.turns["position"].astype(np.int16), records.turns["player"])
+        print(f"Encoded {len(features)} stored positions in {time.time() - start_time:.3f}s")
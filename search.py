@@ -0,0 +1,197 @@
+# n-ply expectimax move selection.  Plies are counted the way move_tree_analysis works: 1 ply scores the positions
+# reachable with the current roll, and each further ply averages over the 21 distinct rolls of the player to move next,
+# who is assumed to pick their best reply.  As in gnubg, a move filter keeps only the best few candidates from a cheap
+# static pass at each move node for the deeper search, and the tree is grown one level at a time so that the
+# positions at a level are evaluated together, in batches of BATCH_SIZE.
+# iterative_deepening() searches one ply deeper at a time until a time budget runs out, so that a move is always ready
+# and the budget goes on looking further ahead.
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from board import Board
+
+# The 21 distinct rolls and their probabilities; doubles are played four times
+ROLLS: List[Tuple[List[int], float]] = [([a] * 4 if a == b else [a, b], (1 if a == b else 2) / 36)
+                                        for a in range(1, 7) for b in range(a, 7)]
+BATCH_SIZE = 4096  # Positions evaluated per call, so that deep searches can be stopped part way through a level
+
+
+class _Interrupted(Exception):
+    # Raised inside a search once its deadline has passed or it has been cancelled
+    pass
+
+
+class ExpectimaxSearch:
+    def __init__(self, agent, plies: int = 2, filter_width: int = 8, router=None):
+        # plies: search depth, where 1 is the same as a plain move_tree_analysis
+        # filter_width: candidates kept at each move node for searching deeper
+        # router: optional race.EvaluationRouter for positions without contact
+        if plies < 1:
+            raise ValueError(f"Search depth must be at least 1 ply, not {plies}")
+        self.agent = agent
+        self.plies = plies
+        self.filter_width = filter_width
+        self.router = router
+        self.nodes = 0  # Positions generated and statically evaluated
+        self.searches = 0
+        self.elapsed = 0.0
+        self.completed_plies = 0  # Depth of the last move chosen
+        self._deadline: Optional[float] = None
+        self._cancel: Optional[threading.Event] = None
+
+    def _check_time(self) -> None:
+        if ((self._deadline is not None and time.perf_counter() >= self._deadline)
+                or (self._cancel is not None and self._cancel.is_set())):
+            raise _Interrupted()
+
+    def _evaluate(self, boards: List[Board], player: int) -> np.ndarray:
+        # Static value of each position for the player who has just moved, with wins scored exactly
+        values = np.empty(len(boards), dtype=np.float64)
+        for start in range(0, len(boards), BATCH_SIZE):
+            self._check_time()
+            batch = boards[start:start + BATCH_SIZE]
+            if self.router is None:
+                values[start:start + len(batch)] = self.agent.assess_boards(batch, player)
+            else:
+                values[start:start + len(batch)] = self.router.assess(self.agent, batch, player)
+            self.nodes += len(batch)
+        for i, board in enumerate(boards):
+            if board.game_won(player):
+                values[i] = 1.0
+        return values
+
+    def _filter(self, values: np.ndarray, start: int, end: int) -> List[int]:
+        # Indices of the best filter_width candidates in values[start:end]
+        if end - start <= self.filter_width:
+            return list(range(start, end))
+        best = np.argpartition(-values[start:end], self.filter_width - 1)[:self.filter_width]
+        return [start + int(i) for i in best]
+
+    def _expected_values(self, boards: List[Board], player: int, plies: int) -> np.ndarray:
+        # Value of each position for the player who has just moved to it, looking plies - 1 rolls ahead.  All the
+        # replies to all the positions are generated first and evaluated in one batch before going a level deeper.
+        values = np.zeros(len(boards), dtype=np.float64)
+        opponent = 1 - player
+        replies: List[Board] = []
+        groups = []  # (position, probability, first reply, end of replies) for each position and roll
+        for n, board in enumerate(boards):
+            if board.game_won(player):
+                values[n] = 1.0
+                continue
+            self._check_time()
+            for rolls, probability in ROLLS:
+                start = len(replies)
+                replies.extend(b for _, b in board.legal_afterstates(rolls, opponent))
+                groups.append((n, probability, start, len(replies)))
+        if len(replies) == 0:
+            return values
+        reply_values = self._evaluate(replies, opponent)
+        if plies > 2:
+            # Search the most promising replies to each roll one ply deeper, all of them together
+            kept = [i for _, _, start, end in groups for i in self._filter(reply_values, start, end)]
+            deeper = self._expected_values([replies[i] for i in kept], opponent, plies - 1)
+            reply_values = np.full(len(replies), -np.inf)
+            reply_values[kept] = deeper
+        for n, probability, start, end in groups:
+            # The opponent picks their best reply, which the player then loses with that reply's value
+            values[n] += probability * (1 - reply_values[start:end].max())
+        return values
+
+    def _root_values(self, boards: List[Board], static_values: np.ndarray, player: int, plies: int) -> np.ndarray:
+        if plies == 1 or len(boards) == 1:
+            return static_values
+        kept = self._filter(static_values, 0, len(boards))
+        values = np.full(len(boards), -np.inf)
+        values[kept] = self._expected_values([boards[i] for i in kept], player, plies)
+        return values
+
+    def choose(self, board: Board, rolls: List[int], player: int) -> Tuple[float, List[Tuple[int, int]], Board]:
+        # Best move for the player with the given roll, as (value, moves, resulting board)
+        start_time = time.perf_counter()
+        afterstates = board.legal_afterstates(rolls, player)
+        boards = [b for _, b in afterstates]
+        values = self._root_values(boards, self._evaluate(boards, player), player, self.plies)
+        best = int(np.argmax(values))
+        self.searches += 1
+        self.completed_plies = self.plies
+        self.elapsed += time.perf_counter() - start_time
+        return float(values[best]), afterstates[best][0], afterstates[best][1]
+
+    def iterative_deepening(self, board: Board, rolls: List[int], player: int, budget: float,
+                            cancel: Optional[threading.Event] = None) -> Tuple[float, List[Tuple[int, int]], Board]:
+        # Like choose(), but searching 1 ply, then 2, and so on up to self.plies for as long as the budget in seconds
+        # lasts.  The search under way when the budget runs out, or when cancel is set, is abandoned and the move from
+        # the deepest completed one is returned; the 1-ply move is always completed.  completed_plies gives its depth.
+        start_time = time.perf_counter()
+        afterstates = board.legal_afterstates(rolls, player)
+        boards = [b for _, b in afterstates]
+        static_values = self._evaluate(boards, player)
+        values = static_values
+        self.completed_plies = 1
+        self._deadline = start_time + budget
+        self._cancel = cancel
+        try:
+            # Only one move, or a win on the spot, needs no looking ahead
+            while self.completed_plies < self.plies and len(boards) > 1 and static_values.max() < 1:
+                values = self._root_values(boards, static_values, player, self.completed_plies + 1)
+                self.completed_plies += 1
+        except _Interrupted:
+            pass
+        finally:
+            self._deadline = None
+            self._cancel = None
+        best = int(np.argmax(values))
+        self.searches += 1
+        self.elapsed += time.perf_counter() - start_time
+        return float(values[best]), afterstates[best][0], afterstates[best][1]
+
+    def stats(self) -> Dict[str, float]:
+        return {"plies": self.plies, "filter_width": self.filter_width, "completed_plies": self.completed_plies,
+                "searches": self.searches,
+                "nodes": self.nodes, "elapsed": self.elapsed,
+                "nodes_per_sec": self.nodes / self.elapsed if self.elapsed > 0 else 0.0,
+                "nodes_per_search": self.nodes / self.searches if self.searches > 0 else 0.0}
+
+
+if __name__ == '__main__':
+    import argparse
+    import logging
+    from TDGammon_agent import TDagent
+
+    parser = argparse.ArgumentParser(description="Time n-ply searches from random positions")
+    parser.add_argument("--plies", type=int, nargs="+", default=[1, 2, 3])
+    parser.add_argument("--filter", type=int, default=4, help="Candidates searched deeper at each move node")
+    parser.add_argument("--positions", type=int, default=5)
+    parser.add_argument("--backend", choices=["tensorflow", "numpy"], default="numpy")
+    parser.add_argument("--budget", type=float, default=None,
+                        help="Also search each position by iterative deepening for this many seconds")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARN, format="%(message)s")
+    search_agent = TDagent(backend=args.backend)
+    # A few positions from the opening onwards, reached by playing the network against itself
+    rng = np.random.RandomState(0)
+
+    def roll() -> List[int]:
+        return ROLLS[rng.choice(len(ROLLS), p=[p for _, p in ROLLS])][0]
+    positions = []
+    position = Board(False)
+    for turn in range(2 * args.positions):
+        _, _, position = ExpectimaxSearch(search_agent, 1).choose(position, roll(), turn % 2)
+        if turn % 2 == 1:
+            positions.append((position, roll()))
+    for plies in args.plies:
+        search = ExpectimaxSearch(search_agent, plies, args.filter)
+        for position, dice in positions:
+            search.choose(position, dice, 0)
+        stats = search.stats()
+        print(f"{plies}-ply: {stats['nodes_per_search']:10.0f} nodes/search {stats['elapsed'] / stats['searches']:8.3f} "
+              f"s/search {stats['nodes_per_sec']:10.0f} nodes/sec")
+    if args.budget is not None:
+        search = ExpectimaxSearch(search_agent, max(args.plies), args.filter)
+        for position, dice in positions:
+            start = time.perf_counter()
+            search.iterative_deepening(position, dice, 0, args.budget)
+            print(f"{args.budget:.1f}s budget: reached {search.completed_plies} plies in "
+                  f"{time.perf_counter() - start:.3f}s")
@@ -0,0 +1,193 @@
+# Non-interactive self-play training with resumable checkpoints, e.g.:
+#   python train.py --episodes 100000 --checkpoint-every 1000 --test-episodes 100
+# Rerunning the same command after the run is killed carries on from the latest checkpoint in --checkpoint-dir, with
+# the same weights, eligibility traces, random number generator state and game histories.
+import argparse
+import logging
+import time
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+import tensorflow as tf
+from bearoff import load_database
+from checkpointing import CheckpointManager
+from evaluate import Evaluator, SequentialTest, format_result
+from race import EvaluationRouter
+from game import Game
+from records import GameWriter
+from metrics import MetricsSink
+from random_agent import RandomAgent
+from TDGammon_agent import TDagent, BACKENDS
+
+# Settings that have to stay the same for a run to resume exactly; on resume these come from the checkpoint
+RUN_CONFIG = ("backend", "alpha", "LAMBDA", "endgame", "checkpoint_every", "test_episodes", "test_learning")
+
+
+def snapshot(episode: int, config: Dict, agent: TDagent, train_game: Game, test_game: Game,
+             train_metrics: Optional[MetricsSink], test_metrics: Optional[MetricsSink]) -> Dict:
+    # Everything is copied here, on the training thread, so the checkpoint writer never sees a half-updated state
+    return {"episode": episode, "config": dict(config),
+            "weights": agent.get_weights(), "trace": agent.get_trace(),
+            "rng_state": np.random.get_state(),
+            "train_game": train_game.get_state(), "test_game": test_game.get_state(),
+            "train_metrics": train_metrics.get_state() if train_metrics is not None else None,
+            "test_metrics": test_metrics.get_state() if test_metrics is not None else None}
+
+
+def restore(state: Dict, agent: TDagent, train_game: Game, test_game: Game, train_metrics: Optional[MetricsSink],
+            test_metrics: Optional[MetricsSink]) -> int:
+    # Returns the last completed episode
+    agent.set_weights(state["weights"])
+    if len(state["trace"]) > 0:
+        agent.set_trace(state["trace"])
+    np.random.set_state(state["rng_state"])
+    train_game.set_state(state["train_game"])
+    test_game.set_state(state["test_game"])
+    if train_metrics is not None and state["train_metrics"] is not None:
+        train_metrics.set_state(state["train_metrics"])
+    if test_metrics is not None and state["test_metrics"] is not None:
+        test_metrics.set_state(state["test_metrics"])
+    return state["episode"]
+
+
+def train(args: argparse.Namespace) -> Tuple[Game, Game]:
+    manager = CheckpointManager(args.checkpoint_dir, args.keep)
+    state = manager.load() if not args.restart else None
+    config = {name: getattr(args, name) for name in RUN_CONFIG}
+    if state is not None:
+        config.update(state["config"])
+    elif args.seed is not None:
+        # Also seeds TensorFlow, which draws the initial weights
+        tf.keras.utils.set_random_seed(args.seed)
+
+    agent = TDagent(config["alpha"], config["LAMBDA"], 196, backend=config["backend"])
+    if state is None and args.load:
+        agent.load(args.load)
+    if args.metrics:
+        # Games played after the last checkpoint of a killed run are recorded again on resume, under the same numbers
+        train_metrics = MetricsSink(args.metrics + "_train.jsonl")
+        test_metrics = MetricsSink(args.metrics + "_test.jsonl")
+    else:
+        train_metrics = None
+        test_metrics = None
+    bearoff = load_database(args.bearoff)
+    router = EvaluationRouter(bearoff, race=args.race) if args.race or bearoff is not None else None
+    recorder = GameWriter(args.record, positions=args.record_positions) if args.record else None
+    g = Game(agent, agent, metrics=train_metrics, verbose=(train_metrics is None), router=router, recorder=recorder)
+    if args.profile_every > 0:
+        g.enable_profiling(report_every=args.profile_every)
+    # The test games leave the router out, as it would choose RandomAgent's moves in races as well
+    g_test = Game(agent, RandomAgent(), metrics=test_metrics, verbose=(test_metrics is None))
+
+    # Duplicate-dice matches against RandomAgent, which leave the training random sequence untouched
+    evaluator = None
+    if args.evaluate:
+        evaluator = Evaluator(args.eval_workers, endgame_board=config["endgame"], bearoff_path=args.bearoff,
+                              race=args.race, plies=args.eval_plies)
+
+    start_episode = 0
+    if state is not None:
+        start_episode = restore(state, agent, g, g_test, train_metrics, test_metrics)
+        if recorder is not None and len(recorder) > g.game_count:
+            # Games played after the checkpoint are played again, so their first recording is dropped
+            recorder.truncate(g.game_count)
+        print(f"Resuming from episode {start_episode}")
+
+    episode = start_episode
+    last_ten_ep_lengths = [0.0] * 10
+    try:
+        for episode in range(start_episode + 1, args.episodes + 1):
+            episode_length = g.training_game(config["endgame"])
+            last_ten_ep_lengths = last_ten_ep_lengths[1:] + [episode_length]
+            if episode % config["checkpoint_every"] == 0:
+                if config["test_episodes"] > 0:
+                    print("Starting test phase versus RandomAgent().")
+                    if not config["test_learning"]:
+                        agent.disable_learning()
+                    for _ in range(config["test_episodes"]):
+                        g_test.training_game(config["endgame"])
+                    agent.enable_learning()
+                    if test_metrics is not None:
+                        print(f"Episode {episode}: recent win rate {train_metrics.rolling_win_rate(0):.3f} in "
+                              f"training, {test_metrics.rolling_win_rate(0):.3f} versus RandomAgent")
+                if evaluator is not None:
+                    match = evaluator.evaluate(agent.get_weights(), "random", test=SequentialTest("ci"))
+                    print(f"Episode {episode} versus RandomAgent: {format_result(match)}")
+                manager.save_async(episode, snapshot(episode, config, agent, g, g_test, train_metrics, test_metrics))
+            if episode % 10 == 0 and config["test_episodes"] == 0:
+                # Give estimate of time to complete
+                remaining_time = (args.episodes - episode) * np.average(last_ten_ep_lengths)
+                print(f"Estimated time to complete: {remaining_time / 60:.2f} mins")
+        if episode % config["checkpoint_every"] != 0:
+            manager.save_async(episode, snapshot(episode, config, agent, g, g_test, train_metrics, test_metrics))
+    finally:
+        manager.wait()
+        if evaluator is not None:
+            evaluator.close()
+        if train_metrics is not None:
+            train_metrics.close()
+            test_metrics.close()
+        if recorder is not None:
+            recorder.close()
+
+    if router is not None:
+        stats = router.stats()
+        print(f"Positions evaluated by the network: {stats['network_share'] * 100:.1f}%, race formula: "
+              f"{stats['race_share'] * 100:.1f}%, bear-off database: {stats['bearoff_share'] * 100:.1f}%; "
+              f"{stats['turns_skipping_network']} of {stats['turns']} turns skipped the network")
+    if args.export:
+        # Keras weights for the GUI and TDagent.load()
+        agent.save(args.export)
+    return g, g_test
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Train TDagent by self-play, checkpointing so the run can resume")
+    parser.add_argument("--episodes", type=int, default=10000, help="Total training games, including resumed ones")
+    parser.add_argument("--backend", choices=BACKENDS, default="tensorflow")
+    parser.add_argument("--alpha", type=float, default=0.1, help="Learning rate")
+    parser.add_argument("--lambda", dest="LAMBDA", type=float, default=0.7, help="Eligibility trace decay")
+    parser.add_argument("--endgame", action="store_true", help="Use the endgame starting board")
+    parser.add_argument("--bearoff", help="Bear-off database used to choose moves once both sides are home")
+    parser.add_argument("--race", action="store_true", help="Choose moves in races without contact by pip count")
+    parser.add_argument("--checkpoint-every", type=int, default=1000, help="Games between checkpoints")
+    parser.add_argument("--checkpoint-dir", default="checkpoints/training")
+    parser.add_argument("--keep", type=int, default=3, help="Number of recent checkpoints to keep")
+    parser.add_argument("--restart", action="store_true", help="Ignore existing checkpoints and start afresh")
+    parser.add_argument("--test-episodes", type=int, default=0,
+                        help="Games against RandomAgent after each checkpoint")
+    parser.add_argument("--evaluate", action="store_true",
+                        help="Evaluate against RandomAgent after each checkpoint, stopping once the result is clear")
+    parser.add_argument("--eval-workers", type=int, default=0, help="Processes to spread evaluation games over")
+    parser.add_argument("--eval-plies", type=int, default=1, help="Search depth of the agent in evaluation games")
+    parser.add_argument("--test-learning", action="store_true", help="Keep learning during the test games")
+    parser.add_argument("--load", help="Keras weights in checkpoints/ to start a new run from")
+    parser.add_argument("--export", default="TDGammon", help="Keras weights in checkpoints/ to write at the end")
+    parser.add_argument("--metrics", help="Write per-game stats to <prefix>_train.jsonl and <prefix>_test.jsonl "
+                                          "instead of printing every game")
+    parser.add_argument("--record", help="Append every training game to the game record store <prefix>.games and "
+                                         "<prefix>.turns")
+    parser.add_argument("--record-positions", action="store_true", help="Also record the position after every turn")
+    parser.add_argument("--profile-every", type=int, default=0, help="Print a per-phase profile every N games")
+    parser.add_argument("--seed", type=int, default=None, help="Seed for a new run")
+    parser.add_argument("--plot", action="store_true", help="Plot the win ratio histories at the end")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    logging.basicConfig(level=logging.WARN, format="%(message)s")
+    start_time = time.time()
+    args = parse_args(argv)
+    g, g_test = train(args)
+    print(f"Finished {g.game_count} games in {(time.time() - start_time) / 60:.2f} mins")
+    if args.plot:
+        import matplotlib.pyplot as plt
+
+        plt.plot(g.win_history, label="Training")
+        plt.plot(g_test.win_history, label="Testing")
+        plt.plot([0.5] * len(g.win_history), ":")
+        plt.legend()
+        plt.show()
+
+
+if __name__ == '__main__':
+    main()
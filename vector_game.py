@@ -0,0 +1,107 @@
+# Lockstep vectorised environment: K games advance one turn together, and every candidate position across all of the
+# games is scored with one batched call per agent.
+import logging
+import time
+from typing import Dict, List, Sequence
+import numpy as np
+from board import Board, encode_features_batch
+
+
+class VectorGame:
+    def __init__(self, players: Sequence[Sequence], endgame_board: bool = False):
+        # players[k] holds the two agents for game slot k, so slots can mix agent types
+        self.players = [list(pair) for pair in players]
+        self.num_games = len(self.players)
+        self.endgame_board = endgame_board
+        self.boards: List[Board] = [None] * self.num_games
+        self.pIDs = np.zeros(self.num_games, dtype=np.intp)
+        self.steps = np.zeros(self.num_games, dtype=np.int64)
+        self.win_counts = np.zeros((self.num_games, 2), dtype=np.int64)
+        self.game_count = 0
+        self.game_len_history = []
+        for k in range(self.num_games):
+            self.reset(k)
+
+    def reset(self, k: int) -> None:
+        self.boards[k] = Board(self.endgame_board)
+        self.pIDs[k] = np.random.randint(0, 2)
+        self.steps[k] = 0
+
+    def _roll_dice(self) -> List[List[int]]:
+        # Roll for every game at once; doubles are played four times
+        dice = np.random.randint(1, 7, size=(self.num_games, 2))
+        rolls = []
+        for first, second in dice.tolist():
+            if first == second:
+                rolls.append([first] * 4)
+            else:
+                rolls.append([first, second])
+        return rolls
+
+    def step(self) -> List[int]:
+        # Play one turn in every game.  Returns the slots whose game finished (and has been reset) this turn.
+        all_rolls = self._roll_dice()
+        afterstates = [self.boards[k].legal_afterstates(all_rolls[k], int(self.pIDs[k]))
+                       for k in range(self.num_games)]
+
+        # Gather the candidates of all slots whose mover is the same agent, and score them in one call
+        slots_by_agent: Dict[int, List[int]] = {}
+        agents = {}
+        for k in range(self.num_games):
+            agent = self.players[k][self.pIDs[k]]
+            slots_by_agent.setdefault(id(agent), []).append(k)
+            agents[id(agent)] = agent
+        values = [None] * self.num_games
+        for agent_id, slots in slots_by_agent.items():
+            boards = [board for k in slots for _, board in afterstates[k]]
+            players = np.repeat(self.pIDs[slots], [len(afterstates[k]) for k in slots])
+            agent_values = agents[agent_id].assess_batch(encode_features_batch(boards, players))
+            start = 0
+            for k in slots:
+                values[k] = agent_values[start:start + len(afterstates[k])]
+                start += len(afterstates[k])
+
+        finished = []
+        for k in range(self.num_games):
+            self.boards[k] = afterstates[k][int(np.argmax(values[k]))][1]
+            player = int(self.pIDs[k])
+            if self.boards[k].game_won(player):
+                logging.info("Slot %d: player %d won after %d turns", k, player, self.steps[k])
+                self.win_counts[k, player] += 1
+                self.game_count += 1
+                self.game_len_history.append(int(self.steps[k]))
+                finished.append(k)
+                self.reset(k)
+            else:
+                self.pIDs[k] = 1 - player
+                self.steps[k] += 1
+        return finished
+
+    def run(self, num_games: int) -> np.ndarray:
+        # Keep stepping until at least num_games have finished; returns the per-slot win counts
+        target = self.game_count + num_games
+        while self.game_count < target:
+            self.step()
+        return self.win_counts
+
+
+if __name__ == '__main__':
+    from random_agent import RandomAgent
+    from TDGammon_agent import TDagent
+
+    logging.basicConfig(level=logging.WARN, format="%(message)s")
+    td_agent = TDagent(backend="numpy")
+    td_agent.disable_learning()
+    random_agent = RandomAgent()
+    num_slots = 64
+    # Half the slots are TD self-play, the other half TD against RandomAgent
+    slot_players = [(td_agent, td_agent) if k % 2 == 0 else (td_agent, random_agent) for k in range(num_slots)]
+    env = VectorGame(slot_players)
+    start_time = time.time()
+    wins = env.run(200)
+    elapsed = time.time() - start_time
+    turns = sum(env.game_len_history)
+    print(f"{env.game_count} games in {elapsed:.1f}s: {env.game_count / elapsed:.2f} games/sec, "
+          f"{turns / elapsed:.0f} turns/sec")
+    vs_random = wins[1::2].sum(axis=0)
+    print(f"TDagent vs RandomAgent wins: {vs_random[0]} - {vs_random[1]}")